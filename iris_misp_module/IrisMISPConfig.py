@@ -24,6 +24,34 @@ module_version = "1.4.0"
 pipeline_support = False
 pipeline_info = {}
 
+default_report_template = ("<div class=\"row\">\n    <div class=\"col-12\">\n        <div "
+                           "class=\"accordion\">\n            <h3>MISP raw results</h3>\n\n           "
+                           " <div class=\"card\">\n                <div class=\"card-header "
+                           "collapsed\" id=\"drop_r_misp\" data-toggle=\"collapse\" "
+                           "data-target=\"#drop_raw_misp\" aria-expanded=\"false\" "
+                           "aria-controls=\"drop_raw_misp\" role=\"button\">\n                    <div "
+                           "class=\"span-icon\">\n                        <div "
+                           "class=\"flaticon-file\"></div>\n                    </div>\n              "
+                           "      <div class=\"span-title\">\n                        MISP raw "
+                           "results\n                    </div>\n                    <div "
+                           "class=\"span-mode\"></div>\n                </div>\n                <div "
+                           "id=\"drop_raw_misp\" class=\"collapse\" aria-labelledby=\"drop_r_misp\" "
+                           "style=\"\">\n                    <div class=\"card-body\">\n              "
+                           "          <div id='misp_raw_ace'>{{ results| tojson(indent=4) }}</div>\n  "
+                           "                  </div>\n                </div>\n            </div>\n    "
+                           "    </div>\n    </div>\n</div> \n<script>\nvar misp_in_raw = ace.edit("
+                           "\"misp_raw_ace\",\n{\n    autoScrollEditorIntoView: true,\n    minLines: "
+                           "30,\n});\nmisp_in_raw.setReadOnly(true);\nmisp_in_raw.setTheme("
+                           "\"ace/theme/tomorrow\");\nmisp_in_raw.session.setMode("
+                           "\"ace/mode/json\");\nmisp_in_raw.renderer.setShowGutter("
+                           "true);\nmisp_in_raw.setOption(\"showLineNumbers\", "
+                           "true);\nmisp_in_raw.setOption(\"showPrintMargin\", "
+                           "false);\nmisp_in_raw.setOption(\"displayIndentGuides\", "
+                           "true);\nmisp_in_raw.setOption(\"maxLines\", "
+                           "\"Infinity\");\nmisp_in_raw.session.setUseWrapMode("
+                           "true);\nmisp_in_raw.setOption(\"indentedSoftWrap\", "
+                           "true);\nmisp_in_raw.renderer.setScrollMargin(8, 5);\n</script> ")
+
 module_configuration = [
     {
         "param_name": "misp_config",
@@ -69,33 +97,7 @@ module_configuration = [
         "param_name": "misp_domain_report_template",
         "param_human_name": "Domain report template",
         "param_description": "Domain report template used to add a new custom attribute to the target IOC",
-        "default": "<div class=\"row\">\n    <div class=\"col-12\">\n        <div "
-                   "class=\"accordion\">\n            <h3>MISP raw results</h3>\n\n           "
-                   " <div class=\"card\">\n                <div class=\"card-header "
-                   "collapsed\" id=\"drop_r_misp\" data-toggle=\"collapse\" "
-                   "data-target=\"#drop_raw_misp\" aria-expanded=\"false\" "
-                   "aria-controls=\"drop_raw_misp\" role=\"button\">\n                    <div "
-                   "class=\"span-icon\">\n                        <div "
-                   "class=\"flaticon-file\"></div>\n                    </div>\n              "
-                   "      <div class=\"span-title\">\n                        MISP raw "
-                   "results\n                    </div>\n                    <div "
-                   "class=\"span-mode\"></div>\n                </div>\n                <div "
-                   "id=\"drop_raw_misp\" class=\"collapse\" aria-labelledby=\"drop_r_misp\" "
-                   "style=\"\">\n                    <div class=\"card-body\">\n              "
-                   "          <div id='misp_raw_ace'>{{ results| tojson(indent=4) }}</div>\n  "
-                   "                  </div>\n                </div>\n            </div>\n    "
-                   "    </div>\n    </div>\n</div> \n<script>\nvar misp_in_raw = ace.edit("
-                   "\"misp_raw_ace\",\n{\n    autoScrollEditorIntoView: true,\n    minLines: "
-                   "30,\n});\nmisp_in_raw.setReadOnly(true);\nmisp_in_raw.setTheme("
-                   "\"ace/theme/tomorrow\");\nmisp_in_raw.session.setMode("
-                   "\"ace/mode/json\");\nmisp_in_raw.renderer.setShowGutter("
-                   "true);\nmisp_in_raw.setOption(\"showLineNumbers\", "
-                   "true);\nmisp_in_raw.setOption(\"showPrintMargin\", "
-                   "false);\nmisp_in_raw.setOption(\"displayIndentGuides\", "
-                   "true);\nmisp_in_raw.setOption(\"maxLines\", "
-                   "\"Infinity\");\nmisp_in_raw.session.setUseWrapMode("
-                   "true);\nmisp_in_raw.setOption(\"indentedSoftWrap\", "
-                   "true);\nmisp_in_raw.renderer.setScrollMargin(8, 5);\n</script> ",
+        "default": default_report_template,
         "mandatory": False,
         "type": "textfield_html",
         "section": "Templates"
@@ -104,33 +106,7 @@ module_configuration = [
         "param_name": "misp_ip_report_template",
         "param_human_name": "IP report template",
         "param_description": "IP report template used to add a new custom attribute to the target IOC",
-        "default": "<div class=\"row\">\n    <div class=\"col-12\">\n        <div "
-                   "class=\"accordion\">\n            <h3>MISP raw results</h3>\n\n           "
-                   " <div class=\"card\">\n                <div class=\"card-header "
-                   "collapsed\" id=\"drop_r_misp\" data-toggle=\"collapse\" "
-                   "data-target=\"#drop_raw_misp\" aria-expanded=\"false\" "
-                   "aria-controls=\"drop_raw_misp\" role=\"button\">\n                    <div "
-                   "class=\"span-icon\">\n                        <div "
-                   "class=\"flaticon-file\"></div>\n                    </div>\n              "
-                   "      <div class=\"span-title\">\n                        MISP raw "
-                   "results\n                    </div>\n                    <div "
-                   "class=\"span-mode\"></div>\n                </div>\n                <div "
-                   "id=\"drop_raw_misp\" class=\"collapse\" aria-labelledby=\"drop_r_misp\" "
-                   "style=\"\">\n                    <div class=\"card-body\">\n              "
-                   "          <div id='misp_raw_ace'>{{ results| tojson(indent=4) }}</div>\n  "
-                   "                  </div>\n                </div>\n            </div>\n    "
-                   "    </div>\n    </div>\n</div> \n<script>\nvar misp_in_raw = ace.edit("
-                   "\"misp_raw_ace\",\n{\n    autoScrollEditorIntoView: true,\n    minLines: "
-                   "30,\n});\nmisp_in_raw.setReadOnly(true);\nmisp_in_raw.setTheme("
-                   "\"ace/theme/tomorrow\");\nmisp_in_raw.session.setMode("
-                   "\"ace/mode/json\");\nmisp_in_raw.renderer.setShowGutter("
-                   "true);\nmisp_in_raw.setOption(\"showLineNumbers\", "
-                   "true);\nmisp_in_raw.setOption(\"showPrintMargin\", "
-                   "false);\nmisp_in_raw.setOption(\"displayIndentGuides\", "
-                   "true);\nmisp_in_raw.setOption(\"maxLines\", "
-                   "\"Infinity\");\nmisp_in_raw.session.setUseWrapMode("
-                   "true);\nmisp_in_raw.setOption(\"indentedSoftWrap\", "
-                   "true);\nmisp_in_raw.renderer.setScrollMargin(8, 5);\n</script> ",
+        "default": default_report_template,
         "mandatory": False,
         "type": "textfield_html",
         "section": "Templates"
@@ -139,33 +115,7 @@ module_configuration = [
         "param_name": "misp_hash_report_template",
         "param_human_name": "Hash report template",
         "param_description": "Hash report template used to add a new custom attribute to the target IOC",
-        "default": "<div class=\"row\">\n    <div class=\"col-12\">\n        <div "
-                   "class=\"accordion\">\n            <h3>MISP raw results</h3>\n\n           "
-                   " <div class=\"card\">\n                <div class=\"card-header "
-                   "collapsed\" id=\"drop_r_misp\" data-toggle=\"collapse\" "
-                   "data-target=\"#drop_raw_misp\" aria-expanded=\"false\" "
-                   "aria-controls=\"drop_raw_misp\" role=\"button\">\n                    <div "
-                   "class=\"span-icon\">\n                        <div "
-                   "class=\"flaticon-file\"></div>\n                    </div>\n              "
-                   "      <div class=\"span-title\">\n                        MISP raw "
-                   "results\n                    </div>\n                    <div "
-                   "class=\"span-mode\"></div>\n                </div>\n                <div "
-                   "id=\"drop_raw_misp\" class=\"collapse\" aria-labelledby=\"drop_r_misp\" "
-                   "style=\"\">\n                    <div class=\"card-body\">\n              "
-                   "          <div id='misp_raw_ace'>{{ results| tojson(indent=4) }}</div>\n  "
-                   "                  </div>\n                </div>\n            </div>\n    "
-                   "    </div>\n    </div>\n</div> \n<script>\nvar misp_in_raw = ace.edit("
-                   "\"misp_raw_ace\",\n{\n    autoScrollEditorIntoView: true,\n    minLines: "
-                   "30,\n});\nmisp_in_raw.setReadOnly(true);\nmisp_in_raw.setTheme("
-                   "\"ace/theme/tomorrow\");\nmisp_in_raw.session.setMode("
-                   "\"ace/mode/json\");\nmisp_in_raw.renderer.setShowGutter("
-                   "true);\nmisp_in_raw.setOption(\"showLineNumbers\", "
-                   "true);\nmisp_in_raw.setOption(\"showPrintMargin\", "
-                   "false);\nmisp_in_raw.setOption(\"displayIndentGuides\", "
-                   "true);\nmisp_in_raw.setOption(\"maxLines\", "
-                   "\"Infinity\");\nmisp_in_raw.session.setUseWrapMode("
-                   "true);\nmisp_in_raw.setOption(\"indentedSoftWrap\", "
-                   "true);\nmisp_in_raw.renderer.setScrollMargin(8, 5);\n</script> ",
+        "default": default_report_template,
         "mandatory": False,
         "type": "textfield_html",
         "section": "Templates"
@@ -174,37 +124,426 @@ module_configuration = [
         "param_name": "misp_ja3_report_template",
         "param_human_name": "JA3 report template",
         "param_description": "JA3 report template used to add a new custom attribute to the target IOC",
-        "default": "<div class=\"row\">\n    <div class=\"col-12\">\n        <div "
-                   "class=\"accordion\">\n            <h3>MISP raw results</h3>\n\n           "
-                   " <div class=\"card\">\n                <div class=\"card-header "
-                   "collapsed\" id=\"drop_r_misp\" data-toggle=\"collapse\" "
-                   "data-target=\"#drop_raw_misp\" aria-expanded=\"false\" "
-                   "aria-controls=\"drop_raw_misp\" role=\"button\">\n                    <div "
-                   "class=\"span-icon\">\n                        <div "
-                   "class=\"flaticon-file\"></div>\n                    </div>\n              "
-                   "      <div class=\"span-title\">\n                        MISP raw "
-                   "results\n                    </div>\n                    <div "
-                   "class=\"span-mode\"></div>\n                </div>\n                <div "
-                   "id=\"drop_raw_misp\" class=\"collapse\" aria-labelledby=\"drop_r_misp\" "
-                   "style=\"\">\n                    <div class=\"card-body\">\n              "
-                   "          <div id='misp_raw_ace'>{{ results| tojson(indent=4) }}</div>\n  "
-                   "                  </div>\n                </div>\n            </div>\n    "
-                   "    </div>\n    </div>\n</div> \n<script>\nvar misp_in_raw = ace.edit("
-                   "\"misp_raw_ace\",\n{\n    autoScrollEditorIntoView: true,\n    minLines: "
-                   "30,\n});\nmisp_in_raw.setReadOnly(true);\nmisp_in_raw.setTheme("
-                   "\"ace/theme/tomorrow\");\nmisp_in_raw.session.setMode("
-                   "\"ace/mode/json\");\nmisp_in_raw.renderer.setShowGutter("
-                   "true);\nmisp_in_raw.setOption(\"showLineNumbers\", "
-                   "true);\nmisp_in_raw.setOption(\"showPrintMargin\", "
-                   "false);\nmisp_in_raw.setOption(\"displayIndentGuides\", "
-                   "true);\nmisp_in_raw.setOption(\"maxLines\", "
-                   "\"Infinity\");\nmisp_in_raw.session.setUseWrapMode("
-                   "true);\nmisp_in_raw.setOption(\"indentedSoftWrap\", "
-                   "true);\nmisp_in_raw.renderer.setScrollMargin(8, 5);\n</script> ",
+        "default": default_report_template,
+        "mandatory": False,
+        "type": "textfield_html",
+        "section": "Templates"
+    },
+    {
+        "param_name": "misp_url_report_template",
+        "param_human_name": "URL report template",
+        "param_description": "URL report template used to add a new custom attribute to the target IOC",
+        "default": default_report_template,
+        "mandatory": False,
+        "type": "textfield_html",
+        "section": "Templates"
+    },
+    {
+        "param_name": "misp_mail_report_template",
+        "param_human_name": "Email report template",
+        "param_description": "Email report template used to add a new custom attribute to the target IOC",
+        "default": default_report_template,
         "mandatory": False,
         "type": "textfield_html",
         "section": "Templates"
     },
+    {
+        "param_name": "misp_registry_report_template",
+        "param_human_name": "Registry key report template",
+        "param_description": "Registry key report template used to add a new custom attribute to the target IOC",
+        "default": default_report_template,
+        "mandatory": False,
+        "type": "textfield_html",
+        "section": "Templates"
+    },
+    {
+        "param_name": "misp_filename_report_template",
+        "param_human_name": "Filename report template",
+        "param_description": "Filename report template used to add a new custom attribute to the target IOC",
+        "default": default_report_template,
+        "mandatory": False,
+        "type": "textfield_html",
+        "section": "Templates"
+    },
+    {
+        "param_name": "misp_report_mode",
+        "param_human_name": "Report mode",
+        "param_description": "Either 'full' to render the reports with the templates above, or 'compact' to render "
+                             "a summary table per MISP instance followed by the raw results as compact JSON, "
+                             "truncated to the maximum report size",
+        "default": "full",
+        "mandatory": False,
+        "type": "string",
+        "section": "Templates"
+    },
+    {
+        "param_name": "misp_report_max_size",
+        "param_human_name": "Compact report maximum size (KB)",
+        "param_description": "Maximum size in kilobytes of a report rendered in compact mode",
+        "default": 256,
+        "mandatory": False,
+        "type": "int",
+        "section": "Templates"
+    },
+    {
+        "param_name": "misp_report_top_events",
+        "param_human_name": "Compact report events",
+        "param_description": "Number of events listed per MISP instance in compact mode, most recent first",
+        "default": 10,
+        "mandatory": False,
+        "type": "int",
+        "section": "Templates"
+    },
+    {
+        "param_name": "misp_search_mode",
+        "param_human_name": "Search mode",
+        "param_description": "Either 'events' to fetch the full matching events and strip them in the module, or "
+                             "'attributes' to only fetch the matching attributes with their event id, info, date "
+                             "and tags. The attributes mode keeps responses small for events with many attributes",
+        "default": "events",
+        "mandatory": False,
+        "type": "string",
+        "section": "Search"
+    },
+    {
+        "param_name": "misp_search_limit",
+        "param_human_name": "Search page size",
+        "param_description": "Number of attributes fetched per request in attributes mode, further pages are "
+                             "fetched until all the matching attributes are returned. 0 to fetch them at once",
+        "default": 1000,
+        "mandatory": False,
+        "type": "int",
+        "section": "Search"
+    },
+    {
+        "param_name": "misp_streaming_enabled",
+        "param_human_name": "Stream search responses",
+        "param_description": "Set to True to parse MISP responses while they are downloaded in events mode. Stripped "
+                             "fields are skipped by the parser, so memory is bounded by the largest event instead "
+                             "of the whole response. Requires the ijson package",
+        "default": False,
+        "mandatory": True,
+        "type": "bool",
+        "section": "Search"
+    },
+    {
+        "param_name": "misp_lookup_workers",
+        "param_human_name": "Concurrent lookups",
+        "param_description": "Maximum number of MISP lookups running concurrently when a hook carries several IOCs",
+        "default": 8,
+        "mandatory": False,
+        "type": "int",
+        "section": "Search"
+    },
+    {
+        "param_name": "misp_async_enabled",
+        "param_human_name": "Asynchronous lookups",
+        "param_description": "Set to True to look up the IOCs of bulk hooks with an asyncio client, keeping many "
+                             "lookups in flight from a single thread. Requires the aiohttp package. The client only "
+                             "sends plain event searches: it is not used when warninglists, a local index, the "
+                             "prefilter, delta searches, streaming or the attributes search mode are enabled",
+        "default": False,
+        "mandatory": True,
+        "type": "bool",
+        "section": "Search"
+    },
+    {
+        "param_name": "misp_async_concurrency",
+        "param_human_name": "Asynchronous lookups concurrency",
+        "param_description": "Maximum number of asynchronous lookups and connections in flight",
+        "default": 100,
+        "mandatory": False,
+        "type": "int",
+        "section": "Search"
+    },
+    {
+        "param_name": "misp_cache_enabled",
+        "param_human_name": "Cache MISP results",
+        "param_description": "Set to True to keep MISP search results in memory, so indicators looked up again are "
+                             "not searched on MISP until their result expires. Changes made on MISP meanwhile are "
+                             "not seen, including by manual triggers",
+        "default": False,
+        "mandatory": True,
+        "type": "bool",
+        "section": "Cache"
+    },
+    {
+        "param_name": "misp_cache_ttl",
+        "param_human_name": "Cache TTL",
+        "param_description": "Time in seconds during which a MISP result with hits is kept in cache",
+        "default": 3600,
+        "mandatory": False,
+        "type": "int",
+        "section": "Cache"
+    },
+    {
+        "param_name": "misp_cache_negative_ttl",
+        "param_human_name": "Cache TTL without hit",
+        "param_description": "Time in seconds during which a MISP result without any hit is kept in cache",
+        "default": 300,
+        "mandatory": False,
+        "type": "int",
+        "section": "Cache"
+    },
+    {
+        "param_name": "misp_cache_max_entries",
+        "param_human_name": "Cache maximum entries",
+        "param_description": "Maximum number of MISP results kept in cache. Least recently used results are evicted "
+                             "first",
+        "default": 10000,
+        "mandatory": False,
+        "type": "int",
+        "section": "Cache"
+    },
+    {
+        "param_name": "misp_cache_max_size",
+        "param_human_name": "Cache maximum size (MB)",
+        "param_description": "Maximum size in megabytes of the MISP results kept in cache",
+        "default": 64,
+        "mandatory": False,
+        "type": "int",
+        "section": "Cache"
+    },
+    {
+        "param_name": "misp_cache_path",
+        "param_human_name": "Persistent cache path",
+        "param_description": "Path of a SQLite database used as a persistent cache, shared by all the IRIS workers "
+                             "of the host. Leave empty to keep the cache in memory of each worker. The cache "
+                             "limits above apply to the persistent cache as well",
+        "default": None,
+        "mandatory": False,
+        "type": "string",
+        "section": "Cache"
+    },
+    {
+        "param_name": "misp_delta_enabled",
+        "param_human_name": "Delta searches",
+        "param_description": "Set to True to record when each value was last searched on each MISP instance. Later "
+                             "searches of the value only fetch the events changed since then and merge them into "
+                             "the previous result",
+        "default": False,
+        "mandatory": True,
+        "type": "bool",
+        "section": "Delta searches"
+    },
+    {
+        "param_name": "misp_delta_full_interval",
+        "param_human_name": "Full search interval",
+        "param_description": "Time in seconds after which a value is fully searched again, so events which stopped "
+                             "matching it are dropped from its result",
+        "default": 86400,
+        "mandatory": False,
+        "type": "int",
+        "section": "Delta searches"
+    },
+    {
+        "param_name": "misp_delta_max_entries",
+        "param_human_name": "Delta searches maximum entries",
+        "param_description": "Maximum number of searches recorded. Least recently searched values are dropped first",
+        "default": 100000,
+        "mandatory": False,
+        "type": "int",
+        "section": "Delta searches"
+    },
+    {
+        "param_name": "misp_delta_path",
+        "param_human_name": "Delta searches database path",
+        "param_description": "Path of the SQLite database recording the searches, shared by all the IRIS workers of "
+                             "the host. Leave empty to use the temporary directory of the host",
+        "default": None,
+        "mandatory": False,
+        "type": "string",
+        "section": "Delta searches"
+    },
+    {
+        "param_name": "misp_local_index_enabled",
+        "param_human_name": "Local attribute index",
+        "param_description": "Set to True to keep a local index of the hash, IP, domain and JA3 attributes of each "
+                             "MISP instance. Values absent from the index are answered locally, and MISP is only "
+                             "queried for the details of the events containing a value",
+        "default": False,
+        "mandatory": True,
+        "type": "bool",
+        "section": "Local index"
+    },
+    {
+        "param_name": "misp_local_index_interval",
+        "param_human_name": "Local index sync interval",
+        "param_description": "Time in seconds between two incremental syncs of the local attribute index",
+        "default": 300,
+        "mandatory": False,
+        "type": "int",
+        "section": "Local index"
+    },
+    {
+        "param_name": "misp_network_index_enabled",
+        "param_human_name": "Local network index",
+        "param_description": "Set to True to keep a local index of the ip-src and ip-dst attributes of each MISP "
+                             "instance holding a network, such as 203.0.113.0/24. The reports of IPs inside these "
+                             "networks list them, without querying MISP",
+        "default": False,
+        "mandatory": True,
+        "type": "bool",
+        "section": "Local index"
+    },
+    {
+        "param_name": "misp_network_index_interval",
+        "param_human_name": "Network index sync interval",
+        "param_description": "Time in seconds between two incremental syncs of the local network index",
+        "default": 300,
+        "mandatory": False,
+        "type": "int",
+        "section": "Local index"
+    },
+    {
+        "param_name": "misp_fuzzy_index_enabled",
+        "param_human_name": "Local fuzzy hash index",
+        "param_description": "Set to True to keep a local similarity index of the ssdeep and TLSH attributes of each "
+                             "MISP instance. The reports of ssdeep and TLSH IOCs list the similar hashes found in "
+                             "MISP, without querying it",
+        "default": False,
+        "mandatory": True,
+        "type": "bool",
+        "section": "Local index"
+    },
+    {
+        "param_name": "misp_fuzzy_index_interval",
+        "param_human_name": "Fuzzy hash index sync interval",
+        "param_description": "Time in seconds between two incremental syncs of the local fuzzy hash index",
+        "default": 300,
+        "mandatory": False,
+        "type": "int",
+        "section": "Local index"
+    },
+    {
+        "param_name": "misp_fuzzy_ssdeep_threshold",
+        "param_human_name": "ssdeep similarity threshold",
+        "param_description": "Minimum ssdeep score, from 0 to 100, of the similar hashes reported",
+        "default": 60,
+        "mandatory": False,
+        "type": "int",
+        "section": "Local index"
+    },
+    {
+        "param_name": "misp_fuzzy_tlsh_threshold",
+        "param_human_name": "TLSH distance threshold",
+        "param_description": "Maximum TLSH distance of the similar hashes reported. Lower is more similar, 0 for "
+                             "identical files",
+        "default": 40,
+        "mandatory": False,
+        "type": "int",
+        "section": "Local index"
+    },
+    {
+        "param_name": "misp_prefilter_enabled",
+        "param_human_name": "Bloom filter prefilter",
+        "param_description": "Set to True to build a Bloom filter of the attribute values of each MISP instance. "
+                             "Instances which definitely do not hold a value are not queried",
+        "default": False,
+        "mandatory": True,
+        "type": "bool",
+        "section": "Prefilter"
+    },
+    {
+        "param_name": "misp_prefilter_fp_rate",
+        "param_human_name": "Prefilter false positive rate",
+        "param_description": "Targeted rate of values wrongly reported as possibly present, e.g 0.01",
+        "default": "0.01",
+        "mandatory": False,
+        "type": "string",
+        "section": "Prefilter"
+    },
+    {
+        "param_name": "misp_prefilter_max_size",
+        "param_human_name": "Prefilter maximum size (MB)",
+        "param_description": "Memory budget in megabytes of the Bloom filter of each MISP instance",
+        "default": 16,
+        "mandatory": False,
+        "type": "int",
+        "section": "Prefilter"
+    },
+    {
+        "param_name": "misp_prefilter_interval",
+        "param_human_name": "Prefilter rebuild interval",
+        "param_description": "Time in seconds between two rebuilds of the Bloom filters",
+        "default": 3600,
+        "mandatory": False,
+        "type": "int",
+        "section": "Prefilter"
+    },
+    {
+        "param_name": "misp_warninglist_enabled",
+        "param_human_name": "Local warninglists",
+        "param_description": "Set to True to skip the lookup of values held by a MISP warninglist, such as private "
+                             "networks, cloud ranges or popular domains. The reports of these values name the "
+                             "matching warninglists instead of holding MISP results",
+        "default": False,
+        "mandatory": True,
+        "type": "bool",
+        "section": "Warninglists"
+    },
+    {
+        "param_name": "misp_warninglist_path",
+        "param_human_name": "Warninglists export path",
+        "param_description": "Path of a JSON export of MISP warninglists, or of a directory of them such as a clone "
+                             "of the misp-warninglists repository. cidr, hostname and string lists are used",
+        "default": None,
+        "mandatory": False,
+        "type": "string",
+        "section": "Warninglists"
+    },
+    {
+        "param_name": "misp_warninglist_interval",
+        "param_human_name": "Warninglists reload interval",
+        "param_description": "Time in seconds between two checks of the export, which is loaded again when it "
+                             "changed",
+        "default": 3600,
+        "mandatory": False,
+        "type": "int",
+        "section": "Warninglists"
+    },
+    {
+        "param_name": "misp_bulk_chunk_size",
+        "param_human_name": "Bulk enrichment chunk size",
+        "param_description": "Number of IOCs looked up at once and committed together by the case enrichment job",
+        "default": 500,
+        "mandatory": False,
+        "type": "int",
+        "section": "Bulk enrichment"
+    },
+    {
+        "param_name": "misp_bulk_checkpoint_path",
+        "param_human_name": "Bulk enrichment checkpoint path",
+        "param_description": "Path of the SQLite database recording the progress of case enrichment jobs, so an "
+                             "interrupted job resumes where it stopped. Leave empty to use the temporary "
+                             "directory of the host",
+        "default": None,
+        "mandatory": False,
+        "type": "string",
+        "section": "Bulk enrichment"
+    },
+    {
+        "param_name": "misp_metrics_log_enabled",
+        "param_human_name": "Log stage timings",
+        "param_description": "Set to True to log, after each hook, the number of calls and the total time spent in "
+                             "each stage of the module since it was loaded: client creation, searches, rendering "
+                             "and attribute writes",
+        "default": False,
+        "mandatory": True,
+        "type": "bool",
+        "section": "Metrics"
+    },
+    {
+        "param_name": "misp_metrics_path",
+        "param_human_name": "Prometheus metrics file",
+        "param_description": "Path of a file where the counters and the stage timings histograms of the module are "
+                             "written in the Prometheus text format after each hook, e.g in the textfile "
+                             "collector directory of the node exporter. Leave empty to disable",
+        "default": None,
+        "mandatory": False,
+        "type": "string",
+        "section": "Metrics"
+    },
     {
         "param_name": "misp_manual_hook_enabled",
         "param_human_name": "Manual triggers on IOCs",
@@ -214,6 +553,16 @@ module_configuration = [
         "type": "bool",
         "section": "Triggers"
     },
+    {
+        "param_name": "misp_case_hook_enabled",
+        "param_human_name": "Manual triggers on cases",
+        "param_description": "Set to True to offers possibility to manually enrich all the IOCs of one or several "
+                             "cases as a single batch job via the UI",
+        "default": False,
+        "mandatory": True,
+        "type": "bool",
+        "section": "Triggers"
+    },
     {
         "param_name": "misp_on_create_hook_enabled",
         "param_human_name": "Triggers automatically on IOC create",
@@ -16,12 +16,17 @@
 #  You should have received a copy of the GNU Lesser General Public License
 #  along with this program; if not, write to the Free Software Foundation,
 #  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import os
+import tempfile
 
 import iris_interface.IrisInterfaceStatus as InterfaceStatus
 from iris_interface.IrisModuleInterface import IrisModuleInterface, IrisModuleTypes
 
 import iris_misp_module.IrisMISPConfig as interface_conf
+from iris_misp_module.misp_handler.misp_bulk import MISPBulkCheckpoint, MISPBulkEnrichment
 from iris_misp_module.misp_handler.misp_handler import MispHandler
+from iris_misp_module.misp_handler.misp_metrics import metrics
+from iris_misp_module.misp_handler.misp_template import MISPTemplateCache
 
 
 class IrisMISPInterface(IrisModuleInterface):
@@ -48,6 +53,13 @@ class IrisMISPInterface(IrisModuleInterface):
         """
         self.module_id = module_id
 
+        # Hooks are registered again each time the configuration is saved, so the report templates are compiled
+        # here, before the first IOC is handled
+        try:
+            MISPTemplateCache.precompile(self._dict_conf)
+        except Exception as e:
+            self.log.error(f'Unable to compile the report templates: {e}')
+
         if self._dict_conf.get('misp_on_create_hook_enabled'):
             status = self.register_to_hook(module_id, iris_hook_name='on_postload_ioc_create')
             if status.is_failure():
@@ -82,6 +94,18 @@ class IrisMISPInterface(IrisModuleInterface):
         else:
             self.deregister_from_hook(module_id=self.module_id, iris_hook_name='on_manual_trigger_ioc')
 
+        if self._dict_conf.get('misp_case_hook_enabled'):
+            status = self.register_to_hook(module_id, iris_hook_name='on_manual_trigger_case',
+                                           manual_hook_name='Enrich case IOCs with MISP')
+            if status.is_failure():
+                self.log.error(status.get_message())
+                self.log.error(status.get_data())
+
+            else:
+                self.log.info("Successfully registered on_manual_trigger_case hook")
+        else:
+            self.deregister_from_hook(module_id=self.module_id, iris_hook_name='on_manual_trigger_case')
+
     def hooks_handler(self, hook_name: str, hook_ui_name: str, data: any):
         """
         Hooks handler table. Calls corresponding methods depending on the hooks name.
@@ -96,6 +120,9 @@ class IrisMISPInterface(IrisModuleInterface):
         if hook_name in ['on_postload_ioc_create', 'on_postload_ioc_update', 'on_manual_trigger_ioc']:
             status = self._handle_ioc(data=data)
 
+        elif hook_name == 'on_manual_trigger_case':
+            status = self._handle_cases(data=data)
+
         else:
             self.log.critical(f'Received unsupported hook {hook_name}')
             return InterfaceStatus.I2Error(data=data, logs=list(self.message_queue))
@@ -122,36 +149,107 @@ class IrisMISPInterface(IrisModuleInterface):
         misp_handler.load_misp_instance()
         in_status = InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeNoError)
 
+        if len(data) > 1:
+            # Bulk hooks are handled in two stages. All the MISP lookups first run concurrently, then the reports
+            # are rendered and written below, on this thread which owns the SQLAlchemy session of the IOCs.
+            misp_handler.prefetch_reports(data)
+
         for element in data:
-            # Check that the IOC we receive is of type the module can handle and dispatch
-            if 'domain|ip' == element.ioc_type.type_name:
-                status = misp_handler.handle_misp_domain_ip(ioc=element)
-                in_status = InterfaceStatus.merge_status(in_status, status)
-            elif element.ioc_type.type_name.startswith('ip'):
-                if element.ioc_type.type_name.endswith('|port'):
-                    ip, _ = element.ioc_value.split('|')
-                    element.ioc_value = ip
-                status = misp_handler.handle_misp_ip(ioc=element)
+            status = self._handle_ioc_element(misp_handler, element)
+            if status is not None:
                 in_status = InterfaceStatus.merge_status(in_status, status)
 
-            elif 'domain' in element.ioc_type.type_name:
-                status = misp_handler.handle_misp_domain(ioc=element)
-                in_status = InterfaceStatus.merge_status(in_status, status)
+        self._report_stats(misp_handler)
 
-            elif element.ioc_type.type_name == 'ja3-fingerprint-md5':
-                status = misp_handler.handle_misp_ja3(ioc=element)
-                in_status = InterfaceStatus.merge_status(in_status, status)
+        return in_status(data=data)
 
-            elif element.ioc_type.type_name in ['md5', 'sha1', 'sha256', 'ssdeep', 'sha224', 'sha384', 'sha512', 'sha512/224', 'sha512/256', 'tlsh', 'authentihash']:
-                status = misp_handler.handle_misp_hash(ioc=element)
-                in_status = InterfaceStatus.merge_status(in_status, status)
-            elif element.ioc_type.type_name.startswith('filename|'):
-                _, hash = element.ioc_value.split('|')
-                element.ioc_value = hash
-                status = misp_handler.handle_misp_hash(ioc=element)
-                in_status = InterfaceStatus.merge_status(in_status, status)
+    def _handle_ioc_element(self, misp_handler, element) -> InterfaceStatus.IIStatus:
+        """
+        Dispatches an IOC to the MISP lookups of its type. Unsupported types are skipped.
 
-            else:
-                self.log.error(f'IOC type {element.ioc_type.type_name} not handled by MISP module. Skipping')
+        :param misp_handler: MispHandler with a loaded MISP instance
+        :param element: IOC instance
+        :return: IIStatus, or None if the IOC type is not handled
+        """
+        status = misp_handler.handle_ioc(ioc=element)
+        if status is None:
+            self.log.error(f'IOC type {element.ioc_type.type_name} not handled by MISP module. Skipping')
+
+        return status
+
+    def _handle_cases(self, data) -> InterfaceStatus.IIStatus:
+        """
+        Enriches all the IOCs of the cases the module just received as a single batch job. Values are deduped
+        and looked up by chunks, and the progress is checkpointed so an interrupted job resumes where it stopped
+        when it is triggered again on the same cases.
+
+        :param data: Data associated to the hook, here Case objects
+        :return: IIStatus
+        """
+        from app import db
+
+        case_ids = [case.case_id for case in data]
+        iocs = self._get_cases_iocs(case_ids)
+        self.log.info(f'Enriching {len(iocs)} IOCs of cases {case_ids}')
+
+        misp_handler = MispHandler(mod_config=self._dict_conf, logger=self.log)
+        misp_handler.load_misp_instance()
+
+        checkpoint_path = self._dict_conf.get('misp_bulk_checkpoint_path') or \
+            os.path.join(tempfile.gettempdir(), 'iris_misp_bulk.sqlite')
+        checkpoint = MISPBulkCheckpoint(checkpoint_path)
+
+        job = MISPBulkEnrichment(misp_handler=misp_handler,
+                                 dispatcher=self._handle_ioc_element,
+                                 logger=self.log,
+                                 checkpoint=checkpoint,
+                                 chunk_size=int(self._dict_conf.get('misp_bulk_chunk_size') or 500),
+                                 commit=db.session.commit)
+        try:
+            in_status = job.run(MISPBulkEnrichment.job_id(case_ids), iocs)
+        finally:
+            checkpoint.close()
+
+        self._report_stats(misp_handler)
 
         return in_status(data=data)
+
+    @staticmethod
+    def _get_cases_iocs(case_ids):
+        """
+        Returns the IOCs of a set of cases. IOCs belong to a single case in recent IRIS versions, older ones link
+        them to their cases through the IocLink table.
+
+        :param case_ids: Ids of the cases
+        :return: list of IOC instances
+        """
+        from app.models import Ioc
+
+        if hasattr(Ioc, 'case_id'):
+            return Ioc.query.filter(Ioc.case_id.in_(case_ids)).all()
+
+        from app.models import IocLink
+        return Ioc.query.join(IocLink, IocLink.ioc_id == Ioc.ioc_id).filter(IocLink.case_id.in_(case_ids)) \
+            .distinct().all()
+
+    def _report_stats(self, misp_handler):
+        """
+        Logs the statistics of the module after a hook, and exports its metrics if configured
+
+        :param misp_handler: MispHandler used by the hook
+        :return: Nothing
+        """
+        cache_stats = misp_handler.get_cache_stats()
+        if cache_stats:
+            self.log.info(f'MISP cache stats: {cache_stats}')
+        self.log.info(f'MISP report writes: {MispHandler.get_write_stats()}')
+
+        if self._dict_conf.get('misp_metrics_log_enabled'):
+            self.log.info(f'MISP stage timings: {metrics.summary()}')
+
+        metrics_path = self._dict_conf.get('misp_metrics_path')
+        if metrics_path:
+            try:
+                metrics.write_prometheus(metrics_path)
+            except OSError as e:
+                self.log.error(f'Unable to write the metrics to {metrics_path}: {e}')
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+#
+#  IRIS MISP Module Source Code
+#  contact@dfir-iris.org
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import asyncio
+import os
+import ssl as ssl_lib
+import threading
+import time
+from urllib.parse import urljoin
+
+from iris_misp_module.misp_handler.misp_helper import normalize_value
+from iris_misp_module.misp_handler.mispclient import MISPClient, MISPClientError, EmptySearchtermError, \
+    CertificateNotFoundError, MISPOverloadedError
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncMISPClient:
+    """Asyncio variant of MISPClient, with the same search_* methods as coroutines. All the requests go through a
+    single aiohttp session whose connector limits the number of open connections, so hundreds of lookups can be
+    in flight from a single thread. Params are the same as MISPClient, and can be lists to query more than one
+    MISP instance.
+
+    The client must be used as an async context manager, so the session is opened and closed in the running loop.
+    Synchronous callers can instead use run_many, which keeps the session open on a loop owned by the client so
+    its connections are reused from one call to the next, until close is called.
+
+    :param url: URL of MISP instance
+    :type url: [str, list]
+    :param key: API key
+    :type key: [str, list]
+    :param ssl: Use/dont' use ssl or path to ssl cert if not possible to verify through trusted CAs
+    :type ssl: [bool, list, str]
+    :param name: Name of the MISP instance, is sent back in the report for matching the results.
+    :type name: [str, list]
+    :param proxies: Proxy to use
+    :type proxies: dict
+    :param limit: Maximum number of concurrent connections, for all the instances
+    :type limit: int
+    :param timeout: Timeout in seconds of a search on a MISP instance
+    :type timeout: [float, list, None]
+    :param cache: Cache of the search results, shared with MISPClient
+    :type cache: [MISPLookupCache, None]
+    :param breakers: Circuit breakers of the instances, shared with MISPClient
+    :type breakers: [list, None]
+    :param limiters: Rate and concurrency limits of the instances, shared with MISPClient
+    :type limiters: [list, None]
+    """
+
+    def __init__(self, url, key, ssl=True, name='Unnamed', proxies=None, limit=100, timeout=None, cache=None,
+                 breakers=None, limiters=None):
+        if aiohttp is None:
+            raise MISPClientError('The asynchronous client requires the aiohttp package')
+
+        urls = url if isinstance(url, list) else [url]
+        keys = key if isinstance(key, list) else [key]
+        self.instances = []
+        for idx, server in enumerate(urls):
+            self.instances.append({
+                'url': server,
+                'key': keys[idx],
+                'name': name[idx] if isinstance(name, list) else name,
+                'ssl': self.__ssl_context(MISPClient._instance_param(ssl, idx, True)),
+                'timeout': MISPClient._instance_param(timeout, idx),
+                'breaker': breakers[idx] if breakers else None,
+                'limiter': limiters[idx] if limiters else None
+            })
+
+        self.proxies = proxies or {}
+        self.limit = limit
+        self.cache = cache
+        self._session = None
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    @staticmethod
+    def __ssl_context(ssl):
+        """Converts the ssl parameter of an instance to the aiohttp ssl argument
+
+        :param ssl: bool or path to a certificate
+        """
+        if isinstance(ssl, str) and os.path.isfile(ssl):
+            return ssl_lib.create_default_context(cafile=ssl)
+        if isinstance(ssl, str) and ssl != "":
+            raise CertificateNotFoundError('Certificate not found under {}.'.format(ssl))
+        if ssl is False:
+            return False
+        return None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.limit)
+        self._session = aiohttp.ClientSession(connector=connector)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._session.close()
+        self._session = None
+
+    @staticmethod
+    def __clean_event(misp_event):
+        """Strips an event the same way MISPClient does
+
+        :param misp_event: misp event
+        :return: misp event
+        """
+        for event_filter in MISPClient._event_filters:
+            misp_event.pop(event_filter, None)
+
+        if 'RelatedEvent' in misp_event:
+            misp_event['RelatedEvent'] = [{'info': event['Event']['info'], 'id': event['Event']['id']}
+                                          for event in misp_event['RelatedEvent']]
+        return misp_event
+
+    async def __search_instance(self, instance, value, type_attribute, category):
+        """Searches a single MISP instance, behind the same circuit breaker and limits as MISPClient. Errors are
+        reported in the result entry.
+
+        :param instance: Instance settings
+        :param value: value to search for.
+        :param type_attribute: attribute types to search for.
+        :param category: search category, used as part of the cache key
+        :rtype: dict
+        """
+        cache_key = (instance['url'], category, normalize_value(value))
+        if self.cache is not None and category is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        entry = {'url': instance['url'], 'name': instance['name'], 'result': []}
+        breaker = instance['breaker']
+        if breaker is not None and not breaker.allow():
+            entry['error'] = f'Instance unavailable, next attempt in {breaker.retry_in():.0f}s'
+            return entry
+
+        try:
+            entry['result'] = await self.__limited_query(instance, value, type_attribute)
+
+        except asyncio.TimeoutError:
+            entry['error'] = f"Timeout after {instance['timeout']}s"
+
+        except MISPClientError as e:
+            entry['error'] = str(e)
+
+        except Exception as e:
+            entry['error'] = f'{type(e).__name__}: {e}'
+
+        if breaker is not None:
+            if 'error' in entry:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+
+        if self.cache is not None and category is not None:
+            self.cache.set(cache_key, entry)
+
+        return entry
+
+    async def __limited_query(self, instance, value, type_attribute):
+        """Sends a search within the rate and concurrency limits of the instance. The limiters block, so they
+        are waited for in the default executor rather than in the loop.
+
+        :param instance: Instance settings
+        :param value: value to search for.
+        :param type_attribute: attribute types to search for.
+        :rtype: list
+        """
+        limiter = instance['limiter']
+        if limiter is None:
+            return await self.__query(instance, value, type_attribute)
+
+        await asyncio.get_running_loop().run_in_executor(None, limiter.acquire)
+        start = time.perf_counter()
+        overloaded = False
+        try:
+            return await self.__query(instance, value, type_attribute)
+        except (MISPOverloadedError, asyncio.TimeoutError):
+            overloaded = True
+            raise
+        finally:
+            limiter.release(time.perf_counter() - start, overloaded)
+
+    async def __query(self, instance, value, type_attribute):
+        """Sends a search to the instance and returns the cleaned events
+
+        :param instance: Instance settings
+        :param value: value to search for.
+        :param type_attribute: attribute types to search for.
+        :rtype: list
+        """
+        headers = {'Authorization': instance['key'],
+                   'Accept': 'application/json',
+                   'content-type': 'application/json'}
+        query = {'returnFormat': 'json', 'value': value, 'type': type_attribute}
+        proxy = self.proxies.get('https' if instance['url'].startswith('https') else 'http')
+
+        timeout = aiohttp.ClientTimeout(total=float(instance['timeout']) if instance['timeout'] else None)
+        async with self._session.post(urljoin(instance['url'].rstrip('/') + '/', 'events/restSearch'),
+                                      json=query, headers=headers, ssl=instance['ssl'], proxy=proxy,
+                                      timeout=timeout) as response:
+            if response.status >= 400:
+                # Same errors as the ones PyMISP returns to MISPClient
+                errors = (response.status, f'Error code {response.status}: {(await response.text())[:200]}')
+                if response.status == 429 or response.status >= 500:
+                    raise MISPOverloadedError(errors)
+                raise MISPClientError(errors)
+
+            misp_response = await response.json(content_type=None)
+
+        if isinstance(misp_response, dict) and misp_response.get('errors'):
+            raise MISPClientError(misp_response.get('errors'))
+
+        if isinstance(misp_response, dict):
+            misp_response = misp_response.get('response', [])
+        return [self.__clean_event(event['Event']) for event in misp_response]
+
+    async def search(self, category, searchterm):
+        """Searches a value of a search category on all the instances concurrently
+
+        :param category: Search category, see MISPClient._mispcategorytypes
+        :param searchterm: value to search for
+        :rtype: list
+        """
+        if not searchterm:
+            raise EmptySearchtermError
+
+        type_attribute = MISPClient._mispcategorytypes(category)
+        return list(await asyncio.gather(*(self.__search_instance(instance, searchterm, type_attribute, category)
+                                           for instance in self.instances)))
+
+    async def search_url(self, searchterm):
+        return await self.search('url', searchterm)
+
+    async def search_hash(self, searchterm):
+        return await self.search('hash', searchterm)
+
+    async def search_domain(self, searchterm):
+        return await self.search('domain', searchterm)
+
+    async def search_mail(self, searchterm):
+        return await self.search('mail', searchterm)
+
+    async def search_ip(self, searchterm):
+        return await self.search('ip', searchterm)
+
+    async def search_registry(self, searchterm):
+        return await self.search('registry', searchterm)
+
+    async def search_filename(self, searchterm):
+        return await self.search('filename', searchterm)
+
+    async def search_ja3(self, searchterm):
+        return await self.search('ja3', searchterm)
+
+    async def search_many(self, lookups, concurrency=100):
+        """Runs many lookups with at most concurrency of them in flight
+
+        :param lookups: Iterable of (category, value)
+        :param concurrency: Maximum number of lookups in flight
+        :returns: dict of (category, normalized value) -> result list
+        :rtype: dict
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        lookups = {(category, normalize_value(value)): value for category, value in lookups if value}
+
+        async def bounded_search(category, value):
+            async with semaphore:
+                return await self.search(category, value)
+
+        reports = await asyncio.gather(*(bounded_search(category, value)
+                                         for (category, _), value in lookups.items()))
+        return dict(zip(lookups.keys(), reports))
+
+    def run_many(self, lookups, concurrency=100):
+        """Runs search_many from synchronous code, on the loop and session of the client
+
+        :param lookups: Iterable of (category, value)
+        :param concurrency: Maximum number of lookups in flight
+        :returns: dict of (category, normalized value) -> result list
+        :rtype: dict
+        """
+        async def search_many():
+            if self._session is None:
+                await self.__aenter__()
+            return await self.search_many(lookups, concurrency=concurrency)
+
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+            return self._loop.run_until_complete(search_many())
+
+    def close(self):
+        """Closes the session and the loop opened by run_many
+        """
+        with self._loop_lock:
+            if self._loop is None:
+                return
+
+            if self._session is not None:
+                self._loop.run_until_complete(self.__aexit__(None, None, None))
+            self._loop.close()
+            self._loop = None
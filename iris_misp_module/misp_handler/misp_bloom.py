@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+#
+#  IRIS MISP Module Source Code
+#  contact@dfir-iris.org
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import hashlib
+import logging
+import math
+import threading
+from array import array
+
+from iris_misp_module.misp_handler.misp_helper import normalize_value
+from iris_misp_module.misp_handler.misp_index import attribute_values, iter_attributes
+
+log = logging.getLogger(__name__)
+
+
+def _hash_pair(value):
+    """
+    Returns two independent 64 bits hashes of a normalized value, combined by double hashing into the k
+    positions of the filter
+    """
+    digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+
+class BloomFilter:
+    """
+    Bloom filter over normalized values. A negative answer is certain, a positive answer is wrong with a
+    probability close to fp_rate, or higher if max_bytes does not allow the optimal number of bits.
+
+    :param capacity: Expected number of values
+    :param fp_rate: Targeted false positive rate
+    :param max_bytes: Memory budget of the bit array
+    """
+
+    def __init__(self, capacity, fp_rate=0.01, max_bytes=16 * 1024 * 1024):
+        capacity = max(1, capacity)
+        optimal_bits = math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2))
+
+        self.size = max(64, min(optimal_bits, max_bytes * 8))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _add_hashes(self, h1, h2):
+        for i in range(self.hash_count):
+            position = (h1 + i * h2) % self.size
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def add(self, value):
+        """
+        Adds a value to the filter
+
+        :param value: Value to add
+        """
+        self._add_hashes(*_hash_pair(normalize_value(value)))
+
+    def __contains__(self, value):
+        h1, h2 = _hash_pair(normalize_value(value))
+        for i in range(self.hash_count):
+            position = (h1 + i * h2) % self.size
+            if not self._bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def expected_fp_rate(self):
+        """
+        Returns the false positive rate expected for the current content of the filter
+        """
+        return (1 - math.exp(-self.hash_count * self.count / self.size)) ** self.hash_count
+
+
+class MISPBloomPrefilter:
+    """
+    Prefilter telling whether a value is definitely absent from a MISP instance, so the search can be skipped.
+
+    The filter is built from an export of the attribute values of the instance, and rebuilt every interval
+    seconds by a background thread. Lookups keep using the previous filter until the new one is complete, and
+    every value is considered possibly present until the first build succeeds.
+
+    :param connection: PyMISP connection of the instance
+    :param type_attribute: attribute types exported in the filter
+    :param fp_rate: Targeted false positive rate
+    :param max_bytes: Memory budget of the filter
+    :param interval: Time in seconds between two rebuilds
+    """
+
+    def __init__(self, connection, type_attribute, fp_rate=0.01, max_bytes=16 * 1024 * 1024, interval=3600):
+        self.connection = connection
+        self.type_attribute = type_attribute
+        self.fp_rate = fp_rate
+        self.max_bytes = max_bytes
+        self.interval = interval
+
+        self._filter = None
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='misp_bloom_rebuild', daemon=True)
+        self._thread.start()
+
+    def build(self):
+        """
+        Exports the attribute values of the instance and builds a new filter from them
+
+        :return: BloomFilter
+        """
+        # Hashes are kept in compact arrays until the number of values is known and the filter can be sized
+        first_hashes = array('Q')
+        second_hashes = array('Q')
+        for attribute in iter_attributes(self.connection, self.type_attribute):
+            for value in attribute_values(attribute.get('value', '')):
+                h1, h2 = _hash_pair(value)
+                first_hashes.append(h1)
+                second_hashes.append(h2)
+
+        bloom_filter = BloomFilter(capacity=len(first_hashes), fp_rate=self.fp_rate, max_bytes=self.max_bytes)
+        for h1, h2 in zip(first_hashes, second_hashes):
+            bloom_filter._add_hashes(h1, h2)
+
+        return bloom_filter
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self._filter = self.build()
+                log.debug(f'Rebuilt prefilter of {self.connection.root_url} with {self._filter.count} values, '
+                          f'expected false positive rate {self._filter.expected_fp_rate():.4f}')
+
+            except Exception as e:
+                log.warning(f'Unable to rebuild prefilter of {self.connection.root_url}: {e}')
+
+            self._stop_event.wait(self.interval)
+
+    def might_contain(self, value):
+        """
+        Returns False if the value is definitely absent from the instance
+
+        :param value: Value to check
+        :return: bool
+        """
+        bloom_filter = self._filter
+        if bloom_filter is None:
+            return True
+        return value in bloom_filter
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+#
+#  IRIS MISP Module Source Code
+#  contact@dfir-iris.org
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import hashlib
+import sqlite3
+import time
+
+import iris_interface.IrisInterfaceStatus as InterfaceStatus
+
+from iris_misp_module.misp_handler.misp_helper import chunks, normalize_value
+
+
+class MISPBulkCheckpoint:
+    """
+    Records the IOCs already enriched by a bulk job in a SQLite database, so a job which crashed resumes where it
+    stopped. The database can be shared by the IRIS workers of a host.
+
+    :param path: Path of the SQLite database
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS misp_bulk_checkpoint ("
+                                     "job_id TEXT NOT NULL, "
+                                     "ioc_id INTEGER NOT NULL, "
+                                     "PRIMARY KEY (job_id, ioc_id))")
+
+    def load(self, job_id):
+        """
+        Returns the ids of the IOCs already enriched by a job
+
+        :param job_id: Job identifier
+        :return: set
+        """
+        rows = self._connection.execute("SELECT ioc_id FROM misp_bulk_checkpoint WHERE job_id = ?", (job_id,))
+        return {row[0] for row in rows}
+
+    def save(self, job_id, ioc_ids):
+        """
+        Records IOCs as enriched by a job
+
+        :param job_id: Job identifier
+        :param ioc_ids: Ids of the enriched IOCs
+        """
+        with self._connection:
+            self._connection.executemany("INSERT OR IGNORE INTO misp_bulk_checkpoint (job_id, ioc_id) VALUES (?, ?)",
+                                         [(job_id, ioc_id) for ioc_id in ioc_ids])
+
+    def clear(self, job_id):
+        """
+        Drops the progress of a completed job
+
+        :param job_id: Job identifier
+        """
+        with self._connection:
+            self._connection.execute("DELETE FROM misp_bulk_checkpoint WHERE job_id = ?", (job_id,))
+
+    def close(self):
+        self._connection.close()
+
+
+class MISPBulkEnrichment:
+    """
+    Enriches a large set of IOCs, such as all the IOCs of one or several cases, as a single batch job.
+
+    IOCs are sorted by normalized lookup so identical values end up in the same chunk, then each chunk is looked up
+    at once with MispHandler.prefetch_reports, which dedupes and batches the values, and the reports are written
+    IOC by IOC. Progress is checkpointed after each chunk. IOCs whose enrichment failed are not checkpointed, and
+    the checkpoint of a job is kept until all its IOCs are enriched, so the next run of the job retries them.
+
+    :param misp_handler: MispHandler with a loaded MISP instance
+    :param dispatcher: Callable (misp_handler, ioc) -> IIStatus handling a single IOC
+    :param logger: Logger
+    :param checkpoint: MISPBulkCheckpoint, or None to disable checkpointing
+    :param chunk_size: Number of IOCs looked up at once
+    :param commit: Callable committing the IOCs written so far, called before each checkpoint
+    """
+
+    def __init__(self, misp_handler, dispatcher, logger, checkpoint=None, chunk_size=500, commit=None):
+        self.misp_handler = misp_handler
+        self.dispatcher = dispatcher
+        self.log = logger
+        self.checkpoint = checkpoint
+        self.chunk_size = chunk_size
+        self.commit = commit
+
+    @staticmethod
+    def job_id(case_ids):
+        """
+        Returns the identifier of a job enriching a set of cases
+
+        :param case_ids: Ids of the cases
+        :return: str
+        """
+        raw = ','.join(str(case_id) for case_id in sorted(case_ids))
+        return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+    def run(self, job_id, iocs) -> InterfaceStatus.IIStatus:
+        """
+        Runs the job
+
+        :param job_id: Job identifier, used to resume a previous run
+        :param iocs: List of IOC instances
+        :return: IIStatus, with the job statistics as data
+        """
+        start = time.monotonic()
+        done = self.checkpoint.load(job_id) if self.checkpoint else set()
+        pending = [ioc for ioc in iocs if ioc.ioc_id not in done]
+        if done:
+            self.log.info(f'Resuming job {job_id}: {len(done)} IOCs already enriched, {len(pending)} left')
+
+        # Lookups are compared normalized, as the MISPClient does
+        lookups = {id(ioc): sorted((category, normalize_value(value))
+                                   for category, value in self.misp_handler.get_ioc_lookups(ioc))
+                   for ioc in pending}
+        pending.sort(key=lambda ioc: lookups[id(ioc)])
+        unique_values = {lookup for ioc_lookups in lookups.values() for lookup in ioc_lookups}
+
+        in_status = InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeNoError)
+        failed = 0
+        for chunk in chunks(pending, self.chunk_size):
+            self.misp_handler.clear_reports()
+            self.misp_handler.prefetch_reports(chunk)
+
+            enriched = []
+            for ioc in chunk:
+                status = self.dispatcher(self.misp_handler, ioc)
+                if status is not None:
+                    in_status = InterfaceStatus.merge_status(in_status, status)
+
+                # Unsupported IOC types have nothing to retry
+                if status is None or status.is_success():
+                    enriched.append(ioc.ioc_id)
+                else:
+                    failed += 1
+
+            if self.commit is not None:
+                self.commit()
+            if self.checkpoint is not None:
+                self.checkpoint.save(job_id, enriched)
+
+        self.misp_handler.clear_reports()
+        if self.checkpoint is not None:
+            if failed:
+                self.log.warning(f'Enrichment of {failed} IOCs failed, they are retried by the next run of job '
+                                 f'{job_id}')
+            else:
+                self.checkpoint.clear(job_id)
+
+        duration = time.monotonic() - start
+        stats = {
+            'iocs': len(pending),
+            'resumed': len(done),
+            'failed': failed,
+            'unique_values': len(unique_values),
+            'duration': round(duration, 3),
+            'iocs_per_second': round(len(pending) / duration, 2) if duration > 0 else None
+        }
+        self.log.info(f'Enriched {stats["iocs"]} IOCs ({stats["unique_values"]} unique values) in '
+                      f'{stats["duration"]}s, {stats["iocs_per_second"]} IOCs/s')
+
+        return in_status(data=stats)
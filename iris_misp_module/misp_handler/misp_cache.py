@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+#
+#  IRIS MISP Module Source Code
+#  contact@dfir-iris.org
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class MISPLookupCache:
+    """
+    In-memory cache of MISP search results, with TTL expiry and LRU eviction.
+
+    Entries are keyed by (instance URL, search category, normalized value). Results without any hit are kept for
+    negative_ttl, which is usually shorter than ttl so new MISP data shows up quickly for unknown indicators.
+
+    :param ttl: Lifetime in seconds of a result with hits
+    :param negative_ttl: Lifetime in seconds of a result without hits
+    :param max_entries: Maximum number of cached results
+    :param max_bytes: Maximum size of the cached results, computed on their JSON serialization
+    """
+
+    def __init__(self, ttl=3600, negative_ttl=300, max_entries=10000, max_bytes=64 * 1024 * 1024):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Returns a cached result, or None if the key is unknown or expired
+
+        :param key: Cache key
+        :return: Cached result or None
+        """
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+
+            expires_at, size, value = item
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        Caches a result entry. Entries carrying an error are not cached.
+
+        :param key: Cache key
+        :param value: Result entry, as returned for an instance by MISPClient
+        :return: Nothing
+        """
+        if value.get('error'):
+            return
+
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+
+        ttl = self.ttl if value.get('result') else self.negative_ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (time.monotonic() + ttl, size, value)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        """
+        Drops all the cached results
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """
+        Returns the cache counters, to help sizing the cache
+
+        :return: dict
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes
+            }
+
+
+class MISPSQLiteCache:
+    """
+    Persistent cache of MISP search results, stored in a SQLite database. The database runs in WAL mode so the
+    IRIS workers of a host can share it: readers never block and writers only wait for each other briefly.
+
+    Entries follow the same rules as MISPLookupCache. Expired and least recently used entries are removed by a
+    compaction which runs at most every compact_interval seconds, from whichever worker writes first.
+
+    :param path: Path of the SQLite database
+    :param ttl: Lifetime in seconds of a result with hits
+    :param negative_ttl: Lifetime in seconds of a result without hits
+    :param max_entries: Maximum number of cached results
+    :param max_bytes: Maximum size of the cached results, computed on their JSON serialization
+    :param compact_interval: Minimum time in seconds between two compactions
+    """
+
+    def __init__(self, path, ttl=3600, negative_ttl=300, max_entries=10000, max_bytes=64 * 1024 * 1024,
+                 compact_interval=300):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.compact_interval = compact_interval
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._last_compact = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        connection = self._connection()
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS misp_cache ("
+                               "key TEXT PRIMARY KEY, "
+                               "value TEXT NOT NULL, "
+                               "size INTEGER NOT NULL, "
+                               "expires_at REAL NOT NULL, "
+                               "accessed_at REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS misp_cache_accessed ON misp_cache (accessed_at)")
+
+    def _connection(self):
+        """
+        Returns the SQLite connection of the current thread
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+
+        return connection
+
+    @staticmethod
+    def _key(key):
+        return json.dumps(key, default=str)
+
+    def get(self, key):
+        """
+        Returns a cached result, or None if the key is unknown or expired
+
+        :param key: Cache key
+        :return: Cached result or None
+        """
+        now = time.time()
+        try:
+            connection = self._connection()
+            row = connection.execute("SELECT value, expires_at, accessed_at FROM misp_cache WHERE key = ?",
+                                     (self._key(key),)).fetchone()
+
+            if row is None or row[1] < now:
+                with self._lock:
+                    self.misses += 1
+                return None
+
+            # Access times are only used for eviction, so they are not refreshed on every read
+            if now - row[2] > 60:
+                with connection:
+                    connection.execute("UPDATE misp_cache SET accessed_at = ? WHERE key = ?", (now, self._key(key)))
+
+        except sqlite3.Error:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """
+        Caches a result entry. Entries carrying an error are not cached.
+
+        :param key: Cache key
+        :param value: Result entry, as returned for an instance by MISPClient
+        :return: Nothing
+        """
+        if value.get('error'):
+            return
+
+        raw = json.dumps(value, default=str)
+        if len(raw) > self.max_bytes:
+            return
+
+        now = time.time()
+        ttl = self.ttl if value.get('result') else self.negative_ttl
+        try:
+            connection = self._connection()
+            with connection:
+                connection.execute("INSERT OR REPLACE INTO misp_cache (key, value, size, expires_at, accessed_at) "
+                                   "VALUES (?, ?, ?, ?, ?)", (self._key(key), raw, len(raw), now + ttl, now))
+
+            if now - self._last_compact > self.compact_interval:
+                self.compact()
+
+        except sqlite3.Error:
+            return
+
+    def compact(self):
+        """
+        Removes the expired entries, then the least recently used ones until the cache fits its limits, and
+        truncates the WAL file.
+        """
+        self._last_compact = time.time()
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM misp_cache WHERE expires_at < ?", (self._last_compact,))
+
+            count, size = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM misp_cache").fetchone()
+            if count > self.max_entries or size > self.max_bytes:
+                evicted = 0
+                rows = connection.execute("SELECT key, size FROM misp_cache ORDER BY accessed_at").fetchall()
+                for row_key, row_size in rows:
+                    if count <= self.max_entries and size <= self.max_bytes:
+                        break
+                    connection.execute("DELETE FROM misp_cache WHERE key = ?", (row_key,))
+                    count -= 1
+                    size -= row_size
+                    evicted += 1
+
+                with self._lock:
+                    self.evictions += evicted
+
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def clear(self):
+        """
+        Drops all the cached results
+        """
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM misp_cache")
+
+    def stats(self):
+        """
+        Returns the cache counters, to help sizing the cache. Hits and misses are counted for this process only.
+
+        :return: dict
+        """
+        try:
+            count, size = self._connection().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) "
+                                                     "FROM misp_cache").fetchone()
+        except sqlite3.Error:
+            count, size = None, None
+
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': count,
+                'bytes': size
+            }
+
+
+def build_lookup_cache(path=None, **kwargs):
+    """
+    Builds the cache of MISP search results. A persistent SQLite cache is used when a path is given,
+    otherwise an in-memory cache.
+
+    :param path: Path of the SQLite database, or None
+    :param kwargs: Cache limits, see MISPLookupCache
+    :return: MISPLookupCache or MISPSQLiteCache
+    """
+    if path:
+        return MISPSQLiteCache(path=path, **kwargs)
+
+    return MISPLookupCache(**kwargs)
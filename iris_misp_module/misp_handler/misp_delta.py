@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+#
+#  IRIS MISP Module Source Code
+#  contact@dfir-iris.org
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import json
+import sqlite3
+import threading
+import time
+
+
+def merge_events(previous, delta):
+    """
+    Merges the events returned by a delta search into the previous result of the same search. Events are matched
+    on their id: fields of a changed event are replaced, and its matching attributes are merged on their id, as
+    a delta search in attributes mode only returns the changed attributes.
+
+    :param previous: Previous list of events
+    :param delta: Events changed since the previous search
+    :return: list of events
+    """
+    events = {str(event.get('id')): event for event in previous}
+
+    for event in delta:
+        event_id = str(event.get('id'))
+        old_event = events.get(event_id)
+        if old_event is not None and 'Attribute' in old_event and 'Attribute' in event:
+            attributes = {str(attribute.get('id')): attribute for attribute in old_event['Attribute']}
+            attributes.update({str(attribute.get('id')): attribute for attribute in event['Attribute']})
+            event = dict(event, Attribute=list(attributes.values()))
+
+        events[event_id] = event
+
+    return list(events.values())
+
+
+class MISPDeltaStore:
+    """
+    Persistent record of the last time each value was searched on each MISP instance, with the result of that
+    search, so the next search only fetches the events changed since then. The database runs in WAL mode so the
+    IRIS workers of a host can share it.
+
+    A delta search cannot see events which stopped matching a value, so a full search is run again once the
+    last one is older than full_interval seconds.
+
+    :param path: Path of the SQLite database
+    :param full_interval: Maximum age in seconds of the last full search of a value
+    :param max_entries: Maximum number of recorded searches, the least recently used ones are dropped first
+    :param compact_interval: Minimum time in seconds between two compactions
+    """
+
+    def __init__(self, path, full_interval=86400, max_entries=100000, compact_interval=300):
+        self.path = path
+        self.full_interval = full_interval
+        self.max_entries = max_entries
+        self.compact_interval = compact_interval
+
+        self._local = threading.local()
+        self._last_compact = 0
+
+        connection = self._connection()
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS misp_delta ("
+                               "key TEXT PRIMARY KEY, "
+                               "result TEXT NOT NULL, "
+                               "checked_at REAL NOT NULL, "
+                               "full_at REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS misp_delta_checked ON misp_delta (checked_at)")
+
+    def _connection(self):
+        """
+        Returns the SQLite connection of the current thread
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+
+        return connection
+
+    @staticmethod
+    def _key(key):
+        return json.dumps(key, default=str)
+
+    def get(self, key):
+        """
+        Returns the last search of a value, if a delta search can be based on it
+
+        :param key: (instance URL, search category, normalized value)
+        :return: (checked_at, full_at, events), or None if a full search is needed
+        """
+        try:
+            row = self._connection().execute("SELECT result, checked_at, full_at FROM misp_delta WHERE key = ?",
+                                             (self._key(key),)).fetchone()
+        except sqlite3.Error:
+            return None
+
+        if row is None or time.time() - row[2] > self.full_interval:
+            return None
+
+        return row[1], row[2], json.loads(row[0])
+
+    def set(self, key, checked_at, full_at, events):
+        """
+        Records a search of a value
+
+        :param key: (instance URL, search category, normalized value)
+        :param checked_at: Time the search started at
+        :param full_at: Time the last full search started at
+        :param events: Complete result of the search, merged with the previous one for a delta search
+        :return: Nothing
+        """
+        try:
+            connection = self._connection()
+            with connection:
+                connection.execute("INSERT OR REPLACE INTO misp_delta (key, result, checked_at, full_at) "
+                                   "VALUES (?, ?, ?, ?)",
+                                   (self._key(key), json.dumps(events, default=str), checked_at, full_at))
+
+            if time.time() - self._last_compact > self.compact_interval:
+                self.compact()
+
+        except sqlite3.Error:
+            return
+
+    def compact(self):
+        """
+        Removes the searches too old to base a delta search on, then the least recently checked ones until the
+        store fits max_entries
+        """
+        self._last_compact = time.time()
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM misp_delta WHERE full_at < ?", (self._last_compact - self.full_interval,))
+            connection.execute("DELETE FROM misp_delta WHERE key IN (SELECT key FROM misp_delta "
+                               "ORDER BY checked_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
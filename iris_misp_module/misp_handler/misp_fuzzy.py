@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+#
+#  IRIS MISP Module Source Code
+#  contact@dfir-iris.org
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import re
+from array import array
+from bisect import bisect_left
+from itertools import product
+
+from iris_misp_module.misp_handler.misp_index import MISPAttributeIndex
+
+SSDEEP_TYPES = ['ssdeep', 'filename|ssdeep']
+TLSH_TYPES = ['tlsh', 'filename|tlsh']
+
+SSDEEP_PATTERN = re.compile(r'^(\d+):([A-Za-z0-9/+]+):([A-Za-z0-9/+]+)(?:,.*)?$')
+TLSH_PATTERN = re.compile(r'^(?:t1)?([0-9a-f]{70})$', re.IGNORECASE)
+
+# Constants of the ssdeep scoring
+ROLLING_WINDOW = 7
+MIN_BLOCKSIZE = 3
+SPAMSUM_LENGTH = 64
+
+_REPEATED_CHARACTERS = re.compile(r'(.)\1{3,}')
+
+
+def _swap_nibbles(byte):
+    return ((byte & 0xF0) >> 4) | ((byte & 0x0F) << 4)
+
+
+def _bit_pairs_difference(x, y):
+    difference = 0
+    for _ in range(4):
+        distance = abs((x & 3) - (y & 3))
+        difference += 6 if distance == 3 else distance
+        x >>= 2
+        y >>= 2
+    return difference
+
+
+# Distance between the four 2 bits buckets of two TLSH body bytes, indexed by x << 8 | y
+_BODY_DIFFERENCES = [_bit_pairs_difference(x, y) for x in range(256) for y in range(256)]
+
+
+def parse_ssdeep(value):
+    """
+    Parses an ssdeep hash. Runs of more than three identical characters are shortened to three, as when ssdeep
+    compares hashes.
+
+    :param value: ssdeep hash
+    :return: tuple (block size, first signature, second signature), or None if the value is not an ssdeep hash
+    """
+    match = SSDEEP_PATTERN.match(value.strip())
+    if match is None:
+        return None
+
+    return (int(match.group(1)), _REPEATED_CHARACTERS.sub(r'\1\1\1', match.group(2)),
+            _REPEATED_CHARACTERS.sub(r'\1\1\1', match.group(3)))
+
+
+def _grams(signature):
+    return {signature[idx:idx + ROLLING_WINDOW] for idx in range(len(signature) - ROLLING_WINDOW + 1)}
+
+
+def _edit_distance(s1, s2):
+    """
+    Edit distance used by ssdeep: insertions and deletions cost 1, substitutions 2
+    """
+    previous = list(range(len(s2) + 1))
+    for i, c1 in enumerate(s1, 1):
+        current = [i]
+        for j, c2 in enumerate(s2, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (0 if c1 == c2 else 2)))
+        previous = current
+    return previous[-1]
+
+
+def _score_signatures(s1, s2, block_size):
+    if len(s1) > SPAMSUM_LENGTH or len(s2) > SPAMSUM_LENGTH or not _grams(s1) & _grams(s2):
+        return 0
+
+    score = _edit_distance(s1, s2) * SPAMSUM_LENGTH // (len(s1) + len(s2))
+    score = 100 * score // SPAMSUM_LENGTH
+    if score >= 100:
+        return 0
+
+    score = 100 - score
+    if block_size >= (99 + ROLLING_WINDOW) // ROLLING_WINDOW * MIN_BLOCKSIZE:
+        return score
+    return min(score, block_size // MIN_BLOCKSIZE * min(len(s1), len(s2)))
+
+
+def ssdeep_compare(hash1, hash2):
+    """
+    Returns the ssdeep similarity score of two parsed ssdeep hashes, from 0 to 100
+
+    :param hash1: Hash parsed by parse_ssdeep
+    :param hash2: Hash parsed by parse_ssdeep
+    :return: int
+    """
+    block_size1, first1, second1 = hash1
+    block_size2, first2, second2 = hash2
+
+    if block_size1 == block_size2 and first1 == first2:
+        return 100
+    if block_size1 == block_size2:
+        return max(_score_signatures(first1, first2, block_size1),
+                   _score_signatures(second1, second2, block_size1 * 2))
+    if block_size1 == block_size2 * 2:
+        return _score_signatures(first1, second2, block_size1)
+    if block_size2 == block_size1 * 2:
+        return _score_signatures(second1, first2, block_size2)
+    return 0
+
+
+def parse_tlsh(value):
+    """
+    Parses a TLSH hash, with or without its T1 version prefix
+
+    :param value: TLSH hash
+    :return: tuple (checksum, L value, Q1 ratio, Q2 ratio, body), or None if the value is not a TLSH hash
+    """
+    match = TLSH_PATTERN.match(value.strip())
+    if match is None:
+        return None
+
+    raw = bytes.fromhex(match.group(1))
+    q_ratios = _swap_nibbles(raw[2])
+    return _swap_nibbles(raw[0]), _swap_nibbles(raw[1]), q_ratios & 0x0F, q_ratios >> 4, raw[3:]
+
+
+def _mod_difference(x, y, modulus):
+    difference = abs(x - y)
+    return min(difference, modulus - difference)
+
+
+def _header_cost(difference):
+    """
+    Distance contributed by a difference of L value or of Q ratio
+    """
+    return difference if difference <= 1 else (difference - 1) * 12
+
+
+def tlsh_distance(hash1, hash2):
+    """
+    Returns the TLSH distance of two parsed TLSH hashes, 0 for identical files and growing with differences
+
+    :param hash1: Hash parsed by parse_tlsh
+    :param hash2: Hash parsed by parse_tlsh
+    :return: int
+    """
+    checksum1, l_value1, q1_ratio1, q2_ratio1, body1 = hash1
+    checksum2, l_value2, q1_ratio2, q2_ratio2, body2 = hash2
+
+    l_difference = _mod_difference(l_value1, l_value2, 256)
+    distance = l_difference if l_difference <= 1 else l_difference * 12
+    distance += _header_cost(_mod_difference(q1_ratio1, q1_ratio2, 16))
+    distance += _header_cost(_mod_difference(q2_ratio1, q2_ratio2, 16))
+    distance += checksum1 != checksum2
+
+    return distance + sum(_BODY_DIFFERENCES[x << 8 | y] for x, y in zip(body1, body2))
+
+
+class SSDeepIndex:
+    """
+    Similarity index of ssdeep hashes. ssdeep only scores two signatures above 0 when they share a 7 characters
+    substring at compatible block sizes, so each hash is indexed under the (block size, 7-gram) keys of both its
+    signatures, and a query only scores the hashes sharing one of these keys instead of scanning all of them.
+
+    A hash has up to 84 keys, so rather than a dict of lists the postings are packed by build in a single sorted
+    array of 64 bits integers, the hash of the key followed by the position of the indexed hash, looked up by
+    bisection. Colliding keys only add candidates, which are scored like the others. Hashes added after the first
+    build are kept in a dict of postings until the next one.
+    """
+
+    def __init__(self):
+        self._hashes = []
+        self._positions = {}
+        # Sorted postings, bits of the position in each posting and number of hashes they cover
+        self._packed = (array('Q'), 1, 0)
+        self._recent = {}
+        self._built = False
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def __contains__(self, value):
+        return value in self._positions
+
+    @property
+    def recent(self):
+        """
+        Number of hashes added since the last build
+        """
+        return len(self._hashes) - self._packed[2]
+
+    @staticmethod
+    def _keys(parsed):
+        block_size, first, second = parsed
+        return {hash((block_size, gram)) for gram in _grams(first)} | \
+            {hash((block_size * 2, gram)) for gram in _grams(second)}
+
+    def add(self, value):
+        """
+        Adds an ssdeep hash. The hashes added before the first build are only searchable once it is done.
+
+        :param value: ssdeep hash
+        """
+        parsed = parse_ssdeep(value)
+        if parsed is None or value in self._positions:
+            return
+
+        position = len(self._hashes)
+        self._hashes.append((value, parsed))
+        self._positions[value] = position
+        if self._built:
+            for key in self._keys(parsed):
+                self._recent.setdefault(key, []).append(position)
+
+    def build(self):
+        """
+        Packs the postings of all the hashes added
+        """
+        count = len(self._hashes)
+        bits = max(1, count.bit_length())
+        key_mask = (1 << (64 - bits)) - 1
+
+        # Postings are spread by their top byte in arrays sorted one at a time, so they are never all held as ints
+        buckets = [array('Q') for _ in range(256)]
+        for position, (_, parsed) in enumerate(self._hashes[:count]):
+            for key in self._keys(parsed):
+                posting = (key & key_mask) << bits | position
+                buckets[posting >> 56].append(posting)
+
+        postings = array('Q')
+        for idx, bucket in enumerate(buckets):
+            postings.extend(sorted(bucket))
+            buckets[idx] = None
+
+        self._packed = (postings, bits, count)
+        self._recent = {key: [position for position in positions if position >= count]
+                        for key, positions in self._recent.items() if positions[-1] >= count}
+        self._built = True
+
+    def query(self, value, threshold=60):
+        """
+        Returns the hashes similar to a hash
+
+        :param value: ssdeep hash
+        :param threshold: Minimum score
+        :return: list of (hash, score), best first
+        """
+        parsed = parse_ssdeep(value)
+        if parsed is None:
+            return []
+
+        postings, bits, _ = self._packed
+        key_mask = (1 << (64 - bits)) - 1
+        position_mask = (1 << bits) - 1
+        candidates = set()
+        for key in self._keys(parsed):
+            candidates.update(self._recent.get(key, ()))
+
+            key &= key_mask
+            idx = bisect_left(postings, key << bits)
+            while idx < len(postings) and postings[idx] >> bits == key:
+                candidates.add(postings[idx] & position_mask)
+                idx += 1
+
+        matches = []
+        for position in candidates:
+            candidate, candidate_parsed = self._hashes[position]
+            score = ssdeep_compare(parsed, candidate_parsed)
+            if score >= threshold:
+                matches.append((candidate, score))
+        return sorted(matches, key=lambda match: -match[1])
+
+
+class TLSHIndex:
+    """
+    Similarity index of TLSH hashes. Hashes are bucketed by their L value and Q ratios, which alone add a known
+    amount to the distance, so a query only computes the distance to the hashes of the buckets close enough to
+    stay under the threshold.
+    """
+
+    def __init__(self):
+        self._hashes = {}
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def __contains__(self, value):
+        return value in self._hashes
+
+    def add(self, value):
+        """
+        Adds a TLSH hash
+
+        :param value: TLSH hash
+        """
+        parsed = parse_tlsh(value)
+        if parsed is None or value in self._hashes:
+            return
+
+        self._hashes[value] = parsed
+        self._buckets.setdefault(parsed[1:4], []).append(value)
+
+    def query(self, value, threshold=40):
+        """
+        Returns the hashes close to a hash
+
+        :param value: TLSH hash
+        :param threshold: Maximum distance
+        :return: list of (hash, distance), closest first
+        """
+        parsed = parse_tlsh(value)
+        if parsed is None:
+            return []
+
+        _, l_value, q1_ratio, q2_ratio, _ = parsed
+        l_range = range(-(threshold // 12 + 1), threshold // 12 + 2)
+        q_range = range(-min(8, threshold // 12 + 1), min(8, threshold // 12 + 1) + 1)
+
+        # Deltas wrap around with large thresholds, each bucket must only be scanned once
+        buckets = set()
+        for l_delta, q1_delta, q2_delta in product(l_range, q_range, q_range):
+            l_cost = abs(l_delta) if abs(l_delta) <= 1 else abs(l_delta) * 12
+            if l_cost + _header_cost(abs(q1_delta)) + _header_cost(abs(q2_delta)) <= threshold:
+                buckets.add(((l_value + l_delta) % 256, (q1_ratio + q1_delta) % 16, (q2_ratio + q2_delta) % 16))
+
+        matches = []
+        for bucket in buckets:
+            for candidate in self._buckets.get(bucket, ()):
+                distance = tlsh_distance(parsed, self._hashes[candidate])
+                if distance <= threshold:
+                    matches.append((candidate, distance))
+
+        return sorted(matches, key=lambda match: match[1])
+
+
+class MISPFuzzyHashIndex(MISPAttributeIndex):
+    """
+    Local similarity index of the ssdeep and TLSH attributes of a MISP instance. MISP only matches fuzzy hashes by
+    value, the attributes are pulled like in MISPAttributeIndex and kept in an SSDeepIndex and a TLSHIndex updated
+    after each sync, so the hashes close to a searched one are found without a full scan.
+
+    :param connection: PyMISP connection of the instance
+    :param page_size: Number of attributes pulled per request
+    :param full_sync_interval: Time in seconds between two full pulls
+    """
+
+    def __init__(self, connection, page_size=5000, full_sync_interval=86400):
+        super().__init__(connection, {'ssdeep': SSDEEP_TYPES, 'tlsh': TLSH_TYPES}, page_size=page_size,
+                         full_sync_interval=full_sync_interval)
+        self._similarity = {'ssdeep': SSDeepIndex(), 'tlsh': TLSHIndex()}
+
+    def _apply(self, values, attribute):
+        """
+        Adds or removes a fuzzy hash attribute from a values mapping. ssdeep hashes are case-sensitive, so unlike
+        other attributes the values are not normalized.
+
+        :param values: dict of hash type -> hash -> event ids
+        :param attribute: Attribute dict
+        :return: Nothing
+        """
+        event_id = int(attribute.get('event_id'))
+        removed = attribute.get('deleted') in (True, 1, '1')
+        value = attribute.get('value', '').split('|')[-1].strip()
+
+        for hash_type in self._type_categories.get(attribute.get('type'), []):
+            if hash_type == 'tlsh':
+                value = value.lower()
+            hashes = values[hash_type]
+            if removed:
+                if value in hashes:
+                    hashes[value].discard(event_id)
+                    if not hashes[value]:
+                        del hashes[value]
+            else:
+                hashes.setdefault(value, set()).add(event_id)
+
+    def sync(self):
+        """
+        Pulls the fuzzy hash attributes modified since the last sync and updates the similarity indexes. They are
+        built again after a full pull, otherwise the new hashes are added to them, and the postings of the ssdeep
+        index are packed again once a tenth of its hashes were added since the last build. Removed hashes stay in
+        the similarity indexes until the next full pull, but are no longer reported.
+
+        :return: Number of attributes pulled
+        """
+        last_full_sync = self._last_full_sync
+        count = super().sync()
+        if not count and self._last_full_sync == last_full_sync:
+            return count
+
+        with self._lock:
+            hashes = {hash_type: list(values) for hash_type, values in self._values.items()}
+
+        if self._last_full_sync != last_full_sync:
+            similarity = {'ssdeep': SSDeepIndex(), 'tlsh': TLSHIndex()}
+        else:
+            similarity = self._similarity
+
+        for hash_type, values in hashes.items():
+            for value in values:
+                similarity[hash_type].add(value)
+
+        ssdeep_index = similarity['ssdeep']
+        if similarity is not self._similarity or ssdeep_index.recent > max(1000, len(ssdeep_index) // 10):
+            ssdeep_index.build()
+        self._similarity = similarity
+
+        return count
+
+    def lookup_similar(self, value, ssdeep_threshold=60, tlsh_threshold=40, limit=20):
+        """
+        Returns the hashes of the instance similar to an ssdeep or TLSH hash, the hash itself excluded
+
+        :param value: ssdeep or TLSH hash
+        :param ssdeep_threshold: Minimum ssdeep score
+        :param tlsh_threshold: Maximum TLSH distance
+        :param limit: Maximum number of hashes returned
+        :return: list of {'value', 'type', 'score' or 'distance', 'event_ids'}, most similar first, or None if the
+                 value is not a fuzzy hash or the index is not ready yet
+        """
+        if not self.ready:
+            return None
+
+        if parse_ssdeep(value) is not None:
+            hash_type, parse, measure = 'ssdeep', parse_ssdeep, 'score'
+            matches = self._similarity['ssdeep'].query(value, ssdeep_threshold)
+        elif parse_tlsh(value) is not None:
+            hash_type, parse, measure = 'tlsh', parse_tlsh, 'distance'
+            matches = self._similarity['tlsh'].query(value, tlsh_threshold)
+        else:
+            return None
+
+        # The searched hash itself is already matched by the MISP search, whatever its case or TLSH prefix
+        parsed = parse(value)
+        similar = []
+        with self._lock:
+            hashes = self._values[hash_type]
+            for match, similarity in matches:
+                if match in hashes and parse(match) != parsed:
+                    similar.append({'value': match, 'type': hash_type, measure: similarity,
+                                    'event_ids': sorted(hashes[match])})
+
+        return similar[:limit]
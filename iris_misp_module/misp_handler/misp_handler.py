@@ -18,14 +18,25 @@
 #  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 import json
 import logging as log
+import os
+import tempfile
 import traceback
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import iris_interface.IrisInterfaceStatus as InterfaceStatus
 from app.datamgmt.manage.manage_attribute_db import add_tab_attribute_field
 from iris_interface import IrisInterfaceStatus
-from jinja2 import Template
 
-from iris_misp_module.misp_handler.mispclient import MISPClient, MISPClientError
+from iris_misp_module.IrisMISPConfig import default_report_template
+from iris_misp_module.misp_handler.misp_helper import normalize_value
+from iris_misp_module.misp_handler.misp_metrics import metrics
+from iris_misp_module.misp_handler.misp_pool import MISPClientPool
+from iris_misp_module.misp_handler.misp_report import render_compact_report, report_fingerprint, \
+    embed_fingerprint, read_fingerprint
+from iris_misp_module.misp_handler.misp_template import MISPTemplateCache
+from iris_misp_module.misp_handler.misp_types import get_type_lookups
+from iris_misp_module.misp_handler.mispclient import MISPClientError
 
 
 class MispHandler:
@@ -35,6 +46,7 @@ class MispHandler:
         self.https_proxy = self.mod_config.get('misp_https_proxy')
         self.misp = None
         self.log = logger
+        self._reports = {}
 
     def _load_misp_config(self):
         try:
@@ -44,9 +56,101 @@ class MispHandler:
             self.log.error(f"Error parsing MISP configuration: {e}")
             return None
 
+    def _load_cache_config(self):
+        """
+        Returns the settings of the MISP results cache, or None if the cache is disabled
+        """
+        if not self.mod_config.get('misp_cache_enabled'):
+            return None
+
+        return {
+            'path': self.mod_config.get('misp_cache_path') or None,
+            'ttl': int(self.mod_config.get('misp_cache_ttl') or 3600),
+            'negative_ttl': int(self.mod_config.get('misp_cache_negative_ttl') or 300),
+            'max_entries': int(self.mod_config.get('misp_cache_max_entries') or 10000),
+            'max_bytes': int(self.mod_config.get('misp_cache_max_size') or 64) * 1024 * 1024
+        }
+
+    def _load_index_interval(self):
+        """
+        Returns the sync interval of the local attribute index, or None if the index is disabled
+        """
+        if not self.mod_config.get('misp_local_index_enabled'):
+            return None
+
+        return int(self.mod_config.get('misp_local_index_interval') or 300)
+
+    def _load_network_index_interval(self):
+        """
+        Returns the sync interval of the local network index, or None if the index is disabled
+        """
+        if not self.mod_config.get('misp_network_index_enabled'):
+            return None
+
+        return int(self.mod_config.get('misp_network_index_interval') or 300)
+
+    def _load_fuzzy_index_config(self):
+        """
+        Returns the settings of the local fuzzy hash similarity index, or None if the index is disabled
+        """
+        if not self.mod_config.get('misp_fuzzy_index_enabled'):
+            return None
+
+        return {
+            'interval': int(self.mod_config.get('misp_fuzzy_index_interval') or 300),
+            'ssdeep_threshold': int(self.mod_config.get('misp_fuzzy_ssdeep_threshold') or 60),
+            'tlsh_threshold': int(self.mod_config.get('misp_fuzzy_tlsh_threshold') or 40)
+        }
+
+    def _load_prefilter_config(self):
+        """
+        Returns the settings of the Bloom filter prefilter, or None if the prefilter is disabled
+        """
+        if not self.mod_config.get('misp_prefilter_enabled'):
+            return None
+
+        try:
+            fp_rate = float(self.mod_config.get('misp_prefilter_fp_rate') or 0.01)
+        except ValueError:
+            self.log.error('Invalid prefilter false positive rate, using 0.01')
+            fp_rate = 0.01
+
+        return {
+            'fp_rate': fp_rate,
+            'max_bytes': int(self.mod_config.get('misp_prefilter_max_size') or 16) * 1024 * 1024,
+            'interval': int(self.mod_config.get('misp_prefilter_interval') or 3600)
+        }
+
+    def _load_warninglist_config(self):
+        """
+        Returns the settings of the local warninglists, or None if they are disabled
+        """
+        if not self.mod_config.get('misp_warninglist_enabled') or not self.mod_config.get('misp_warninglist_path'):
+            return None
+
+        return {
+            'path': self.mod_config.get('misp_warninglist_path'),
+            'interval': int(self.mod_config.get('misp_warninglist_interval') or 3600)
+        }
+
+    def _load_delta_config(self):
+        """
+        Returns the settings of the delta searches store, or None if delta searches are disabled
+        """
+        if not self.mod_config.get('misp_delta_enabled'):
+            return None
+
+        return {
+            'path': self.mod_config.get('misp_delta_path') or os.path.join(tempfile.gettempdir(),
+                                                                            'iris_misp_delta.sqlite'),
+            'full_interval': int(self.mod_config.get('misp_delta_full_interval') or 86400),
+            'max_entries': int(self.mod_config.get('misp_delta_max_entries') or 100000)
+        }
+
     def load_misp_instance(self):
         """
-        Initiates MISP(s) instance communication
+        Initiates MISP(s) instance communication. The MISPClient is taken from the process-wide pool, so
+        connections are only established again when the configuration changes.
         :returns MISPClient object
         """
 
@@ -58,11 +162,18 @@ class MispHandler:
 
             self.misp = {
                 'type': misp_config.get('type', 'public'),
-                'misp': MISPClient(url=misp_config.get('url', None),
-                                   key=misp_config.get('key', None),
-                                   ssl=misp_config.get('ssl', None),
-                                   name=misp_config.get('name', None),
-                                   proxies={'http': self.http_proxy, 'https': self.https_proxy})
+                'misp': MISPClientPool.get_client(misp_config=misp_config,
+                                                  proxies={'http': self.http_proxy, 'https': self.https_proxy},
+                                                  cache_config=self._load_cache_config(),
+                                                  index_interval=self._load_index_interval(),
+                                                  network_index_interval=self._load_network_index_interval(),
+                                                  fuzzy_index_config=self._load_fuzzy_index_config(),
+                                                  prefilter_config=self._load_prefilter_config(),
+                                                  warninglist_config=self._load_warninglist_config(),
+                                                  search_mode=self.mod_config.get('misp_search_mode') or 'events',
+                                                  search_limit=int(self.mod_config.get('misp_search_limit') or 0),
+                                                  streaming=bool(self.mod_config.get('misp_streaming_enabled')),
+                                                  delta_config=self._load_delta_config())
             }
 
             return self.misp
@@ -73,12 +184,183 @@ class MispHandler:
             self.log.error(f"Type Error initiating MISP instances {te}")
             return None
 
+    def get_cache_stats(self):
+        """
+        Returns the hit/miss counters of the MISP results cache, or None if the cache is disabled
+        """
+        if not self.misp or self.misp.get("misp").cache is None:
+            return None
+
+        return self.misp.get("misp").cache.stats()
+
+    @staticmethod
+    def get_write_stats():
+        """
+        Returns the number of reports written and of writes skipped because the report was unchanged, since
+        the module was loaded
+        """
+        stats = {'written': 0, 'skipped': 0}
+        for counter in metrics.snapshot()['counters']:
+            if counter['name'] == 'misp_report_writes_total':
+                outcome = counter['labels'].get('outcome')
+                stats[outcome] = stats.get(outcome, 0) + counter['value']
+        return stats
+
     def get_misp_instance(self):
         if len(self.misp) == 0:
             self.misp = self.load_misp_instance()
 
         return self.misp
 
+    @staticmethod
+    def get_ioc_lookups(ioc):
+        """
+        Returns the MISP lookups needed to enrich an IOC, as a list of (search category, value). Parts missing
+        from a composite value are left out.
+
+        :param ioc: IOC instance
+        :return: list
+        """
+        lookups = [(lookup.category, lookup.extract(ioc.ioc_value))
+                   for lookup in get_type_lookups(ioc.ioc_type.type_name)]
+        return [(category, value) for category, value in lookups if value is not None]
+
+    def prefetch_reports(self, iocs):
+        """
+        Looks up the IOCs of a bulk hook before they are handled, and keeps the reports for the handle_*
+        methods, which then only render and write them.
+
+        Each (category, value) is only looked up once, however many IOCs hold it: the same hash as md5 and as
+        filename|md5, or the same IP as ip-dst, ip-dst|port and in a domain|ip. Values are compared normalized.
+        Values sharing a search category are looked up with batched multi-value queries, and the remaining ones
+        with single searches. All these lookups run concurrently on at most misp_lookup_workers threads. If the
+        asynchronous client is enabled and supports the configured features, all values are instead looked up one
+        by one with many lookups in flight.
+
+        :param iocs: List of IOC instances
+        :return: Nothing
+        """
+        if not self.misp:
+            return
+
+        lookups = defaultdict(dict)
+        requested = 0
+        for ioc in iocs:
+            for category, value in self.get_ioc_lookups(ioc):
+                requested += 1
+                key = normalize_value(value)
+                if (category, key) not in self._reports:
+                    lookups[category].setdefault(key, value)
+
+        unique = sum(len(values) for values in lookups.values())
+        if requested > unique:
+            self.log.info(f'{requested} lookups coalesced into {unique} unique values')
+            metrics.increment('misp_deduplicated_lookups_total', requested - unique)
+
+        if self.mod_config.get('misp_async_enabled') and self._async_supported():
+            self._prefetch_reports_async([(category, value) for category, values in lookups.items()
+                                          for value in values.values()])
+            return
+
+        misp = self.misp.get("misp")
+        workers = int(self.mod_config.get('misp_lookup_workers') or 8)
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='misp_lookup') as executor:
+            futures = {}
+            for category, values in lookups.items():
+                if len(values) > 1:
+                    self.log.info(f'Batch searching {len(values)} {category} values')
+                    futures[executor.submit(misp.search_batch, category, values.values())] = (category, None)
+                else:
+                    for value in values.values():
+                        futures[executor.submit(getattr(misp, f'search_{category}'), value)] = (category, value)
+
+            for future in as_completed(futures):
+                category, value = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    self.log.error(f'Error looking up {category} {value or "values"}: {e}')
+                    continue
+
+                if value is None:
+                    for batch_value, report in result.items():
+                        self._reports[(category, batch_value)] = report
+                else:
+                    self._reports[(category, normalize_value(value))] = result
+
+    def clear_reports(self):
+        """
+        Drops the prefetched reports
+
+        :return: Nothing
+        """
+        self._reports.clear()
+
+    def _async_supported(self):
+        """
+        Tells whether the asynchronous client can serve the lookups. It goes through the circuit breakers and
+        limits of the MISPClient but only sends plain event searches, so it is not used when a feature of the
+        MISPClient skipping, restricting or post-processing the searches is enabled.
+
+        :return: bool
+        """
+        features = {
+            'warninglists': self._load_warninglist_config(),
+            'local index': self._load_index_interval(),
+            'prefilter': self._load_prefilter_config(),
+            'attributes search mode': (self.mod_config.get('misp_search_mode') or 'events') != 'events',
+            'streaming': self.mod_config.get('misp_streaming_enabled'),
+            'delta searches': self._load_delta_config(),
+            'network index': self._load_network_index_interval(),
+            'fuzzy hash index': self._load_fuzzy_index_config()
+        }
+        enabled = [feature for feature, setting in features.items() if setting]
+        if enabled:
+            self.log.info(f'Asynchronous lookups disabled, not supported with: {", ".join(enabled)}')
+            return False
+
+        return True
+
+    def _prefetch_reports_async(self, lookups):
+        """
+        Looks up values with the asynchronous client, from the current thread. The client is taken from the
+        process-wide pool, so its connections are reused between bulk hooks.
+
+        :param lookups: List of (category, value)
+        :return: Nothing
+        """
+        misp_config = self._load_misp_config()
+        concurrency = int(self.mod_config.get('misp_async_concurrency') or 100)
+
+        try:
+            client = MISPClientPool.get_async_client(misp_config=misp_config,
+                                                     proxies={'http': self.http_proxy, 'https': self.https_proxy},
+                                                     client=self.misp.get("misp"),
+                                                     limit=concurrency)
+        except MISPClientError as e:
+            self.log.error(f"MISPClient Error initiating asynchronous client {e}")
+            return
+
+        self.log.info(f'Asynchronously searching {len(lookups)} values')
+        self._reports.update(client.run_many(lookups, concurrency=concurrency))
+
+    def _get_report(self, category, value):
+        """
+        Returns the MISP report of a value, from the prefetched reports if available. Reports looked up here are
+        kept with the prefetched ones, so a value appearing in several IOCs is only looked up once.
+
+        :param category: Search category
+        :param value: Value to look up
+        :return: list
+        """
+        key = (category, normalize_value(value))
+        report = self._reports.get(key)
+        if report is None:
+            report = self._reports[key] = getattr(self.misp.get("misp"), f'search_{category}')(value)
+
+        return report
+
     def gen_report_from_template(self, html_template, misp_report) -> IrisInterfaceStatus:
         """
         Generates an HTML report for Domain, displayed as an attribute in the IOC
@@ -87,7 +369,13 @@ class MispHandler:
         :param misp_report: The JSON report fetched with MISP API
         :return: IrisInterfaceStatus
         """
-        template = Template(html_template)
+        try:
+            template = MISPTemplateCache.get(html_template)
+
+        except Exception:
+            log.error(traceback.format_exc())
+            return IrisInterfaceStatus.I2Error(traceback.format_exc())
+
         context = misp_report
         pre_render = dict({"results": []})
 
@@ -105,43 +393,127 @@ class MispHandler:
 
         return IrisInterfaceStatus.I2Success(data=rendered)
 
+    def gen_compact_report(self, misp_report) -> IrisInterfaceStatus:
+        """
+        Generates a size-bounded HTML report, made of a summary table per instance and of the raw results as
+        compact JSON, truncated to misp_report_max_size kilobytes
+
+        :param misp_report: The JSON report fetched with MISP API
+        :return: IrisInterfaceStatus
+        """
+        max_bytes = int(self.mod_config.get('misp_report_max_size') or 256) * 1024
+        top_events = int(self.mod_config.get('misp_report_top_events') or 10)
+
+        try:
+            rendered = render_compact_report(misp_report, max_bytes=max_bytes, top_events=top_events)
+
+        except Exception:
+            log.error(traceback.format_exc())
+            return IrisInterfaceStatus.I2Error(traceback.format_exc())
+
+        return IrisInterfaceStatus.I2Success(data=rendered)
+
+    def _report_settings(self, html_report_template):
+        """
+        Returns the settings a rendered report depends on, part of its fingerprint
+
+        :param html_report_template: Template of the report
+        :return: dict
+        """
+        if self.mod_config.get('misp_report_mode') == 'compact':
+            return {'mode': 'compact',
+                    'max_size': self.mod_config.get('misp_report_max_size'),
+                    'top_events': self.mod_config.get('misp_report_top_events')}
+
+        return {'mode': 'full', 'template': html_report_template}
+
     def _handle_misp_report(self, ioc, report, html_report_template):
         """
         Handle the MISP report response, adds the report as attribute and attaches a tag on hit
         """
 
+        ioc_type = ioc.ioc_type.type_name if getattr(ioc, 'ioc_type', None) is not None else None
+
         if self.mod_config.get('misp_report_as_attribute') is True:
-            self.log.info('Adding new attribute MISP Report to IOC')
+            fingerprint = report_fingerprint(report, self._report_settings(html_report_template))
+            stored_report = ((ioc.custom_attributes or {}).get('MISP Report') or {}).get('HTML report') or {}
+
+            if read_fingerprint(stored_report.get('value')) == fingerprint:
+                self.log.info('MISP report unchanged. Skipped rendering and writing it')
+                metrics.increment('misp_report_writes_total', outcome='skipped', ioc_type=ioc_type)
 
-            status = self.gen_report_from_template(
-                html_template=html_report_template,
-                misp_report=report)
+            else:
+                self.log.info('Adding new attribute MISP Report to IOC')
 
-            if not status.is_success():
-                return status
+                with metrics.timer('render', ioc_type=ioc_type):
+                    if self.mod_config.get('misp_report_mode') == 'compact':
+                        status = self.gen_compact_report(misp_report=report)
+                    else:
+                        status = self.gen_report_from_template(
+                            html_template=html_report_template,
+                            misp_report=report)
 
-            rendered_report = status.get_data()
+                if not status.is_success():
+                    return status
 
-            try:
-                add_tab_attribute_field(ioc, tab_name='MISP Report', field_name="HTML report", field_type="html",
-                                        field_value=rendered_report)
+                rendered_report = embed_fingerprint(status.get_data(), fingerprint)
 
-            except Exception:
-                self.log.error(traceback.format_exc())
-                return InterfaceStatus.I2Error(traceback.format_exc())
+                try:
+                    with metrics.timer('attribute_write', ioc_type=ioc_type):
+                        add_tab_attribute_field(ioc, tab_name='MISP Report', field_name="HTML report",
+                                                field_type="html", field_value=rendered_report)
+
+                except Exception:
+                    self.log.error(traceback.format_exc())
+                    return InterfaceStatus.I2Error(traceback.format_exc())
+
+                metrics.increment('misp_report_writes_total', outcome='written', ioc_type=ioc_type)
         else:
             self.log.info('Skipped adding attribute report. Option disabled')
 
-        # Check if we have any hits, and add/remove tag
-        hits = [r for r in report if r.get('result')]
+        # Check if we have any hits, and add/remove tag. Tags are only assigned when they change
+        hits = [r for r in report if r.get('result') or r.get('networks')]
+        ioc_tags = ioc.ioc_tags or ''
+        tags = [tag.strip() for tag in ioc_tags.split(',') if tag.strip() and tag.strip() != 'misp:hit']
         if len(hits) > 0:
-            if "misp:hit" not in ioc.ioc_tags:
-                ioc.ioc_tags = f"{ioc.ioc_tags},misp:hit"
-        else:
-            ioc.ioc_tags = ioc.ioc_tags.replace("misp:hit", "")
+            tags.append('misp:hit')
+        if ','.join(tags) != ioc_tags:
+            ioc.ioc_tags = ','.join(tags)
 
         return InterfaceStatus.I2Success("Successfully processed IOC")
 
+    def handle_ioc(self, ioc):
+        """
+        Handles an IOC of any supported type and adds MISP insights. The lookups of the IOC type are read from the
+        precomputed IOC_TYPE_LOOKUPS table. Composite values such as domain|ip are looked up per part, and get a
+        single report holding the results of all the parts, rendered with the template of the first one.
+
+        :param ioc: IOC instance
+        :return: IIStatus, or None if the IOC type is not handled
+        """
+        lookups = get_type_lookups(ioc.ioc_type.type_name)
+        if not lookups:
+            return None
+
+        # Parts missing from a composite value are skipped
+        values = [(lookup, lookup.extract(ioc.ioc_value)) for lookup in lookups]
+        values = [(lookup, value) for lookup, value in values if value is not None]
+        if not values:
+            return InterfaceStatus.I2Success(f"No value to look up in IOC {ioc.ioc_value}")
+
+        report = []
+        for lookup, value in values:
+            self.log.info(f'Getting {lookup.category} report for {value}')
+            entries = self._get_report(lookup.category, value)
+            if len(values) > 1:
+                # Each instance is listed once per part, named after the value searched
+                entries = [dict(entry, name=f"{entry.get('name')} ({value})") for entry in entries]
+            report.extend(entries)
+
+        # Configurations saved before a template was added do not hold it yet
+        html_report_template = self.mod_config.get(lookups[0].template) or default_report_template
+        return self._handle_misp_report(ioc, report, html_report_template)
+
     def handle_misp_domain(self, ioc):
         """
         Handles an IOC of type domain and adds MISP insights
@@ -151,7 +523,7 @@ class MispHandler:
         """
 
         self.log.info(f'Getting domain report for {ioc.ioc_value}')
-        report = self.misp.get("misp").search_domain(ioc.ioc_value)
+        report = self._get_report('domain', ioc.ioc_value)
 
         return self._handle_misp_report(ioc, report, self.mod_config.get('misp_domain_report_template'))
 
@@ -164,7 +536,7 @@ class MispHandler:
         """
 
         self.log.info(f'Getting IP report for {ioc.ioc_value}')
-        report = self.misp.get("misp").search_ip(ioc.ioc_value)
+        report = self._get_report('ip', ioc.ioc_value)
 
         return self._handle_misp_report(ioc, report, self.mod_config.get('misp_ip_report_template'))
 
@@ -177,7 +549,7 @@ class MispHandler:
         """
 
         self.log.info(f'Getting hash report for {ioc.ioc_value}')
-        report = self.misp.get("misp").search_hash(ioc.ioc_value)
+        report = self._get_report('hash', ioc.ioc_value)
 
         return self._handle_misp_report(ioc, report, self.mod_config.get('misp_hash_report_template'))
 
@@ -189,18 +561,7 @@ class MispHandler:
         :return: IIStatus
         """
 
-        self.log.info(f'Getting domain|ip report for {ioc.ioc_value}')
-        domain, ip = ioc.ioc_value.split('|')
-        domain_report = self.misp.get("misp").search_domain(domain)
-        ip_report = self.misp.get("misp").search_domain(ip)
-
-        domain_result = self._handle_misp_report(ioc, domain_report, self.mod_config.get('misp_domain_report_template'))
-        if not domain_result.is_success():
-            return domain_result
-
-        ip_result = self._handle_misp_report(ioc, ip_report, self.mod_config.get('misp_ip_report_template'))
-
-        return ip_result
+        return self.handle_ioc(ioc)
 
     def handle_misp_ja3(self, ioc):
         """
@@ -211,6 +572,6 @@ class MispHandler:
         """
 
         self.log.info(f'Getting JA3 report for {ioc.ioc_value}')
-        report = self.misp.get("misp").search_ja3(ioc.ioc_value)
+        report = self._get_report('ja3', ioc.ioc_value)
 
         return self._handle_misp_report(ioc, report, self.mod_config.get('misp_ja3_report_template'))
@@ -16,4 +16,108 @@
 #  You should have received a copy of the GNU Lesser General Public License
 #  along with this program; if not, write to the Free Software Foundation,
 #  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import threading
+from concurrent.futures import Future
 
+from iris_misp_module.misp_handler.misp_metrics import metrics
+
+
+def normalize_value(value):
+    """
+    Normalizes an IOC value so that equivalent values share the same lookup. MISP value matching is
+    case-insensitive, so values are compared lowercase.
+
+    :param value: IOC value
+    :return: str
+    """
+    return str(value).strip().lower()
+
+
+def chunks(values, size):
+    """
+    Splits values in lists of at most size elements
+
+    :param values: Iterable of values
+    :param size: Maximum size of a chunk
+    :return: Generator of lists
+    """
+    values = list(values)
+    for idx in range(0, len(values), size):
+        yield values[idx:idx + size]
+
+
+class SingleFlight:
+    """
+    Coalesces identical lookups running concurrently: the first thread asking for a key runs the lookup, and the
+    threads asking for the same key while it runs wait for its result instead of sending the same query again.
+    Results are not kept once the lookup completes, caching them is left to the lookup cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Returns func(*args, **kwargs), or the result of the identical call already running for key
+
+        :param key: Key identifying the lookup, e.g (category, normalized value)
+        :param func: Lookup function
+        :return: Result of func
+        """
+        owned, waiting = self.claim([key])
+        if waiting:
+            return waiting[key].result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            self.resolve(owned, exception=e)
+            raise
+
+        self.resolve(owned, results={key: result})
+        return result
+
+    def claim(self, keys):
+        """
+        Claims the lookup of several keys. The caller must run the lookups of the owned keys and call resolve with
+        their results, the other keys are already being looked up by other threads.
+
+        :param keys: Iterable of keys
+        :return: tuple of dicts key -> Future, the owned keys and the keys to wait for
+        """
+        owned = {}
+        waiting = {}
+        with self._lock:
+            for key in keys:
+                future = self._calls.get(key)
+                if future is None:
+                    owned[key] = self._calls[key] = Future()
+                else:
+                    waiting[key] = future
+
+        if waiting:
+            metrics.increment('misp_coalesced_lookups_total', len(waiting))
+        return owned, waiting
+
+    def resolve(self, owned, results=None, exception=None):
+        """
+        Publishes the results of owned keys to the waiting threads and releases the keys. Keys missing from
+        results get the exception, or an empty result.
+
+        :param owned: dict key -> Future returned by claim
+        :param results: dict key -> result
+        :param exception: Exception raised by the lookup, if any
+        """
+        results = results or {}
+        with self._lock:
+            for key in owned:
+                self._calls.pop(key, None)
+
+        for key, future in owned.items():
+            if key in results:
+                future.set_result(results[key])
+            elif exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(None)
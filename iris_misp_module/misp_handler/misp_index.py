@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+#
+#  IRIS MISP Module Source Code
+#  contact@dfir-iris.org
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import logging
+import threading
+import time
+
+from iris_misp_module.misp_handler.misp_helper import normalize_value
+
+log = logging.getLogger(__name__)
+
+
+def iter_attributes(connection, type_attribute, timestamp=None, page_size=5000, deleted=False, value=None):
+    """
+    Iterates over the attributes of a MISP instance with paginated attribute-level searches
+
+    :param connection: PyMISP connection
+    :param type_attribute: attribute types to pull
+    :param timestamp: Only pull attributes modified since this timestamp
+    :param page_size: Number of attributes per page
+    :param deleted: Also pull soft-deleted attributes, to remove them from local structures
+    :param value: Only pull attributes matching this value, % being a wildcard
+    :return: Generator of attribute dicts
+    """
+    page = 1
+    while True:
+        response = connection.search(controller='attributes', type_attribute=type_attribute, value=value,
+                                     timestamp=timestamp, limit=page_size, page=page,
+                                     deleted=[0, 1] if deleted else None)
+        if isinstance(response, dict) and response.get('errors'):
+            raise RuntimeError(response.get('errors'))
+
+        attributes = response.get('Attribute', []) if isinstance(response, dict) else []
+        for attribute in attributes:
+            yield attribute
+
+        if len(attributes) < page_size:
+            return
+        page += 1
+
+
+def attribute_values(value):
+    """
+    Returns the normalized values an attribute matches on. Composite values such as domain|ip match on the
+    whole value and on each part.
+
+    :param value: Attribute value
+    :return: list
+    """
+    values = [normalize_value(value)]
+    if '|' in value:
+        values.extend(normalize_value(part) for part in value.split('|'))
+    return values
+
+
+class MISPAttributeIndex:
+    """
+    Local index of the attribute values of a MISP instance. It maps each normalized value of the indexed search
+    categories to the ids of the events containing it, so a lookup is a dict membership test and the server is
+    only queried for values known to be present.
+
+    The index is filled by a full pull of the attributes, then kept up to date with incremental pulls of the
+    attributes modified since the last one. A full pull is done again every full_sync_interval seconds to drop
+    attributes of deleted events.
+
+    :param connection: PyMISP connection of the instance
+    :param category_types: dict of search category -> attribute types to index
+    :param page_size: Number of attributes pulled per request
+    :param full_sync_interval: Time in seconds between two full pulls
+    """
+    # Value pattern of the pulled attributes, None to pull all the attributes of the indexed types
+    value_filter = None
+
+    def __init__(self, connection, category_types, page_size=5000, full_sync_interval=86400):
+        self.connection = connection
+        self.category_types = category_types
+        self.page_size = page_size
+        self.full_sync_interval = full_sync_interval
+
+        self._type_categories = {}
+        for category, types in category_types.items():
+            for attribute_type in types:
+                self._type_categories.setdefault(attribute_type, []).append(category)
+
+        self._lock = threading.Lock()
+        self._values = {category: {} for category in category_types}
+        self._last_timestamp = None
+        self._last_full_sync = 0
+        self.ready = False
+
+    def _apply(self, values, attribute):
+        """
+        Adds or removes an attribute from a values mapping
+
+        :param values: dict of category -> value -> event ids
+        :param attribute: Attribute dict
+        :return: Nothing
+        """
+        event_id = int(attribute.get('event_id'))
+        removed = attribute.get('deleted') in (True, 1, '1')
+
+        for category in self._type_categories.get(attribute.get('type'), []):
+            category_values = values[category]
+            for value in attribute_values(attribute.get('value', '')):
+                event_ids = category_values.get(value)
+                if removed:
+                    if event_ids is not None:
+                        event_ids.discard(event_id)
+                        if not event_ids:
+                            del category_values[value]
+                elif event_ids is None:
+                    category_values[value] = {event_id}
+                else:
+                    event_ids.add(event_id)
+
+    def sync(self):
+        """
+        Pulls the attributes modified since the last sync, or all of them when a full sync is due
+
+        :return: Number of attributes pulled
+        """
+        now = time.time()
+        full = self._last_timestamp is None or now - self._last_full_sync > self.full_sync_interval
+        types = sorted(self._type_categories)
+
+        if full:
+            values = {category: {} for category in self.category_types}
+            last_timestamp = 0
+            count = 0
+            for attribute in iter_attributes(self.connection, types, page_size=self.page_size,
+                                             value=self.value_filter):
+                self._apply(values, attribute)
+                last_timestamp = max(last_timestamp, int(attribute.get('timestamp', 0)))
+                count += 1
+
+            with self._lock:
+                self._values = values
+                self._last_timestamp = last_timestamp
+                self._last_full_sync = now
+                self.ready = True
+
+            return count
+
+        count = 0
+        last_timestamp = self._last_timestamp
+        for attribute in iter_attributes(self.connection, types, timestamp=self._last_timestamp,
+                                         page_size=self.page_size, deleted=True, value=self.value_filter):
+            with self._lock:
+                self._apply(self._values, attribute)
+            last_timestamp = max(last_timestamp, int(attribute.get('timestamp', 0)))
+            count += 1
+
+        self._last_timestamp = last_timestamp
+        return count
+
+    def lookup(self, category, value):
+        """
+        Returns the ids of the events containing a value
+
+        :param category: Search category
+        :param value: Value to look up
+        :return: set of event ids, or None if the index cannot answer for this category yet
+        """
+        if not self.ready or category not in self._values:
+            return None
+
+        return set(self._values[category].get(normalize_value(value), ()))
+
+    def stats(self):
+        """
+        Returns the number of indexed values per category
+
+        :return: dict
+        """
+        return {category: len(values) for category, values in self._values.items()}
+
+
+class MISPIndexSyncThread(threading.Thread):
+    """
+    Background thread keeping a set of attribute indexes up to date
+
+    :param indexes: List of MISPAttributeIndex
+    :param interval: Time in seconds between two syncs
+    """
+
+    def __init__(self, indexes, interval=300):
+        super().__init__(name='misp_index_sync', daemon=True)
+        self.indexes = indexes
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            for index in self.indexes:
+                try:
+                    count = index.sync()
+                    log.debug(f'Synced {count} attributes from {index.connection.root_url}')
+
+                except Exception as e:
+                    log.warning(f'Unable to sync attribute index of {index.connection.root_url}: {e}')
+
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
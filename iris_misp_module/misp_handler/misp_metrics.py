@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+#
+#  IRIS MISP Module Source Code
+#  contact@dfir-iris.org
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+STAGE_DURATION = 'misp_stage_duration_seconds'
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class MISPMetrics:
+    """
+    Process-wide counters, gauges and histograms of the module. Each series is identified by its name and labels,
+    such as the MISP instance or the IOC type.
+
+    Stages timed in the misp_stage_duration_seconds histogram:
+
+    - client_init: creation of a MISPClient, including the round trip to each instance
+    - search: search of a value on an instance, HTTP request and cleaning of the events included
+    - search_http: HTTP request and JSON parsing of a search, or the whole search when streaming
+    - clean: stripping of the events returned by a search
+    - render: rendering of a report, including template_compile
+    - template_compile: compilation of a report template, on template cache misses only
+    - attribute_write: write of the report attribute on the IOC
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    @staticmethod
+    def _series(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items() if value is not None))
+
+    def increment(self, name, value=1, **labels):
+        """
+        Increments a counter
+
+        :param name: Counter name
+        :param value: Increment
+        :param labels: Labels of the series
+        """
+        series = self._series(name, labels)
+        with self._lock:
+            self._counters[series] = self._counters.get(series, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """
+        Sets the current value of a gauge
+
+        :param name: Gauge name
+        :param value: Value
+        :param labels: Labels of the series
+        """
+        series = self._series(name, labels)
+        with self._lock:
+            self._gauges[series] = value
+
+    def observe(self, name, value, **labels):
+        """
+        Records a value in a histogram
+
+        :param name: Histogram name
+        :param value: Observed value
+        :param labels: Labels of the series
+        """
+        series = self._series(name, labels)
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(series)
+            if histogram is None:
+                histogram = self._histograms[series] = {'count': 0, 'sum': 0.0,
+                                                        'buckets': [0] * (len(self.buckets) + 1)}
+            histogram['count'] += 1
+            histogram['sum'] += value
+            histogram['buckets'][bucket] += 1
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        """
+        Times the enclosed block as a stage of the misp_stage_duration_seconds histogram
+
+        :param stage: Stage name
+        :param labels: Labels of the series, such as instance or ioc_type
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(STAGE_DURATION, time.perf_counter() - start, stage=stage, **labels)
+
+    def snapshot(self):
+        """
+        Returns the current value of all the series
+
+        :return: dict with counters, gauges and histograms lists
+        """
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in self._counters.items()]
+            gauges = [{'name': name, 'labels': dict(labels), 'value': value}
+                      for (name, labels), value in self._gauges.items()]
+            histograms = [{'name': name, 'labels': dict(labels), 'count': histogram['count'],
+                           'sum': histogram['sum'], 'buckets': list(histogram['buckets'])}
+                          for (name, labels), histogram in self._histograms.items()]
+
+        return {'counters': counters, 'gauges': gauges, 'histograms': histograms}
+
+    def summary(self):
+        """
+        Returns a short view of the stage durations, suited to logs
+
+        :return: dict of stage -> {'count', 'total'} summed over all the labels
+        """
+        stages = {}
+        for histogram in self.snapshot()['histograms']:
+            if histogram['name'] != STAGE_DURATION:
+                continue
+            stage = stages.setdefault(histogram['labels'].get('stage'), {'count': 0, 'total': 0.0})
+            stage['count'] += histogram['count']
+            stage['total'] = round(stage['total'] + histogram['sum'], 6)
+
+        return stages
+
+    @staticmethod
+    def _format_labels(labels, extra=None):
+        items = list(labels.items()) + (list(extra.items()) if extra else [])
+        if not items:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+        return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + '}'
+
+    def prometheus(self):
+        """
+        Exports all the series in the Prometheus text format
+
+        :return: str
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        for kind, series in [('counter', snapshot['counters']), ('gauge', snapshot['gauges'])]:
+            for name in sorted({serie['name'] for serie in series}):
+                lines.append(f'# TYPE {name} {kind}')
+                for serie in series:
+                    if serie['name'] == name:
+                        lines.append(f'{name}{self._format_labels(serie["labels"])} {serie["value"]}')
+
+        for name in sorted({histogram['name'] for histogram in snapshot['histograms']}):
+            lines.append(f'# TYPE {name} histogram')
+            for histogram in snapshot['histograms']:
+                if histogram['name'] != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(self.buckets) + ['+Inf'], histogram['buckets']):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{self._format_labels(histogram["labels"], {"le": bound})} '
+                                 f'{cumulative}')
+                lines.append(f'{name}_sum{self._format_labels(histogram["labels"])} {histogram["sum"]}')
+                lines.append(f'{name}_count{self._format_labels(histogram["labels"])} {histogram["count"]}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """
+        Writes the Prometheus export to a file, atomically so a collector never reads a partial file
+
+        :param path: Path of the file, e.g in the textfile directory of the node exporter
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.misp_metrics')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.prometheus())
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def reset(self):
+        """
+        Drops all the series
+        """
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+
+metrics = MISPMetrics()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+#
+#  IRIS MISP Module Source Code
+#  contact@dfir-iris.org
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import ipaddress
+from bisect import bisect_right
+
+from iris_misp_module.misp_handler.misp_index import MISPAttributeIndex
+
+NETWORK_TYPES = ['ip-src', 'ip-dst']
+
+
+class CIDRIntervalIndex:
+    """
+    Index of IP networks answering which networks hold an address in O(log n).
+
+    Networks are stored as sorted [start, end] integer intervals. CIDR blocks are either nested or disjoint, so
+    each interval keeps a link to the closest interval containing it: a lookup finds the last interval starting
+    before the address, then walks up these links, at most once per prefix length, until one contains it.
+    """
+
+    def __init__(self):
+        self._pending = {4: {}, 6: {}}
+        self._starts = {4: [], 6: []}
+        self._ends = {4: [], 6: []}
+        self._names = {4: [], 6: []}
+        self._parents = {4: [], 6: []}
+
+    def __len__(self):
+        return sum(len(starts) for starts in self._starts.values())
+
+    def add(self, network, name):
+        """
+        Adds a network. build must be called once all the networks are added.
+
+        :param network: Network in CIDR notation, or a single address
+        :param name: Name associated with the network, e.g the warninglist holding it
+        """
+        network = ipaddress.ip_network(network.strip(), strict=False)
+        interval = (int(network.network_address), int(network.broadcast_address))
+        self._pending[network.version].setdefault(interval, set()).add(name)
+
+    def build(self):
+        """
+        Sorts the networks added and links each of them to its closest parent
+        """
+        for version, intervals in self._pending.items():
+            # Parents sort before their children: by start, then by decreasing end
+            ordered = sorted(intervals.items(), key=lambda item: (item[0][0], -item[0][1]))
+            starts = self._starts[version] = [start for (start, _), _ in ordered]
+            ends = self._ends[version] = [end for (_, end), _ in ordered]
+            self._names[version] = [sorted(names) for _, names in ordered]
+
+            parents = self._parents[version] = []
+            stack = []
+            for idx, start in enumerate(starts):
+                while stack and ends[stack[-1]] < start:
+                    stack.pop()
+                parents.append(stack[-1] if stack else -1)
+                stack.append(idx)
+
+        self._pending = {4: {}, 6: {}}
+
+    def _find(self, address):
+        """
+        Returns the IP version of an address and the position of the most specific network holding it, -1 if none
+        """
+        try:
+            address = ipaddress.ip_address(address.strip())
+        except ValueError:
+            return None, -1
+
+        value = int(address)
+        ends = self._ends[address.version]
+        parents = self._parents[address.version]
+
+        idx = bisect_right(self._starts[address.version], value) - 1
+        while idx >= 0 and ends[idx] < value:
+            idx = parents[idx]
+
+        return address.version, idx
+
+    def lookup(self, address):
+        """
+        Returns the names of the most specific network holding an address
+
+        :param address: IP address
+        :return: list of names, or None if no network holds it or the address is invalid
+        """
+        version, idx = self._find(address)
+        return self._names[version][idx] if idx >= 0 else None
+
+    def lookup_all(self, address):
+        """
+        Returns the names of all the networks holding an address, from the most specific one
+
+        :param address: IP address
+        :return: list of names
+        """
+        version, idx = self._find(address)
+        names = []
+        while idx >= 0:
+            names.extend(self._names[version][idx])
+            idx = self._parents[version][idx]
+        return names
+
+
+class MISPNetworkIndex(MISPAttributeIndex):
+    """
+    Local index of the network attributes of a MISP instance, the ip-src and ip-dst attributes holding a CIDR
+    block such as 203.0.113.0/24. MISP only matches an IP searched by value against attributes of the same value,
+    so IPs inside these networks are matched locally instead: the networks are kept in a CIDRIntervalIndex rebuilt
+    after each sync, and a lookup returns the networks holding an IP, and the events they belong to, in O(log n).
+
+    The attributes are pulled like in MISPAttributeIndex, restricted to values containing a slash.
+
+    :param connection: PyMISP connection of the instance
+    :param page_size: Number of attributes pulled per request
+    :param full_sync_interval: Time in seconds between two full pulls
+    """
+    value_filter = '%/%'
+
+    def __init__(self, connection, page_size=5000, full_sync_interval=86400):
+        super().__init__(connection, {'ip': NETWORK_TYPES}, page_size=page_size,
+                         full_sync_interval=full_sync_interval)
+        self._networks = CIDRIntervalIndex()
+
+    def _apply(self, values, attribute):
+        """
+        Adds or removes a network attribute from a values mapping. Attributes which are not networks are ignored.
+
+        :param values: dict of category -> network -> event ids
+        :param attribute: Attribute dict
+        :return: Nothing
+        """
+        value = attribute.get('value', '')
+        if attribute.get('type') not in NETWORK_TYPES or '/' not in value:
+            return
+
+        try:
+            network = str(ipaddress.ip_network(value.strip(), strict=False))
+        except ValueError:
+            return
+
+        super()._apply(values, dict(attribute, value=network))
+
+    def sync(self):
+        """
+        Pulls the network attributes modified since the last sync and rebuilds the interval index if any changed
+
+        :return: Number of attributes pulled
+        """
+        count = super().sync()
+        if count or not len(self._networks):
+            with self._lock:
+                networks = list(self._values['ip'])
+
+            index = CIDRIntervalIndex()
+            for network in networks:
+                index.add(network, network)
+            index.build()
+            self._networks = index
+
+        return count
+
+    def lookup_networks(self, address):
+        """
+        Returns the networks holding an address and the ids of the events they belong to
+
+        :param address: IP address
+        :return: list of {'network', 'event_ids'} from the most specific network, or None if the index is not
+                 ready yet
+        """
+        if not self.ready:
+            return None
+
+        networks = self._networks.lookup_all(address)
+        with self._lock:
+            values = self._values['ip']
+            return [{'network': network, 'event_ids': sorted(values[network])}
+                    for network in networks if network in values]
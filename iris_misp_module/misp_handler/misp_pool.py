@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+#
+#  IRIS MISP Module Source Code
+#  contact@dfir-iris.org
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import hashlib
+import json
+import threading
+
+from iris_misp_module.misp_handler.misp_aioclient import AsyncMISPClient
+from iris_misp_module.misp_handler.misp_cache import build_lookup_cache
+from iris_misp_module.misp_handler.misp_metrics import metrics
+from iris_misp_module.misp_handler.mispclient import MISPClient
+
+
+class MISPClientPool:
+    """
+    Process-wide pool of MISPClient objects. Creating a MISPClient opens new HTTP sessions and does a round trip
+    to every configured instance, so clients are kept alive between hooks and only rebuilt when the MISP
+    configuration or the proxies change. AsyncMISPClient objects are pooled the same way, to keep their
+    connections open between bulk hooks.
+    """
+    _lock = threading.Lock()
+    _clients = {}
+    _async_clients = {}
+
+    @staticmethod
+    def _config_key(misp_config, proxies, cache_config, client_options):
+        """
+        Computes the key identifying a MISP configuration
+
+        :param misp_config: Parsed MISP configuration
+        :param proxies: Proxies dict
+        :param cache_config: Cache settings
+        :param client_options: Module-wide options of the MISPClient
+        :return: str
+        """
+        raw = json.dumps({'config': misp_config, 'proxies': proxies, 'cache': cache_config,
+                          'options': client_options}, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    @classmethod
+    def get_client(cls, misp_config, proxies, cache_config=None, **client_options) -> MISPClient:
+        """
+        Returns the MISPClient matching the configuration, creating it if needed. Clients built from a previous
+        configuration are closed and dropped.
+
+        :param misp_config: Parsed MISP configuration
+        :param proxies: Proxies dict
+        :param cache_config: Keyword arguments of build_lookup_cache, or None to disable the cache
+        :param client_options: Module-wide keyword arguments of MISPClient, such as index_interval
+        :return: MISPClient
+        """
+        key = cls._config_key(misp_config, proxies, cache_config, client_options)
+
+        with cls._lock:
+            client = cls._clients.get(key)
+            if client is not None:
+                return client
+
+            with metrics.timer('client_init'):
+                client = MISPClient(url=misp_config.get('url', None),
+                                    key=misp_config.get('key', None),
+                                    ssl=misp_config.get('ssl', None),
+                                    name=misp_config.get('name', None),
+                                    proxies=proxies,
+                                    pool_size=misp_config.get('pool_size', 10),
+                                    timeout=misp_config.get('timeout', None),
+                                    fanout=misp_config.get('fanout', True),
+                                    batch_size=misp_config.get('batch_size', 100),
+                                    breaker_threshold=misp_config.get('breaker_threshold', 5),
+                                    breaker_cooldown=misp_config.get('breaker_cooldown', 30),
+                                    rate_limit=misp_config.get('rate_limit', None),
+                                    rate_burst=misp_config.get('rate_burst', None),
+                                    max_concurrency=misp_config.get('max_concurrency', None),
+                                    min_concurrency=misp_config.get('min_concurrency', 1),
+                                    latency_target=misp_config.get('latency_target', None),
+                                    cache=build_lookup_cache(**cache_config) if cache_config else None,
+                                    **client_options)
+
+            for old_client in cls._clients.values():
+                old_client.close()
+
+            cls._clients = {key: client}
+
+            return client
+
+    @classmethod
+    def get_async_client(cls, misp_config, proxies, client, limit=100) -> AsyncMISPClient:
+        """
+        Returns the AsyncMISPClient matching the configuration, creating it if needed. It shares the cache,
+        circuit breakers and limits of the MISPClient of the same configuration. Clients built from a previous
+        configuration are closed and dropped.
+
+        :param misp_config: Parsed MISP configuration
+        :param proxies: Proxies dict
+        :param client: MISPClient of the configuration, as returned by get_client
+        :param limit: Maximum number of concurrent connections
+        :return: AsyncMISPClient
+        """
+        # The MISPClient changes whenever the configuration or its options change
+        key = cls._config_key(misp_config, proxies, None, {'limit': limit, 'client': id(client)})
+
+        with cls._lock:
+            async_client = cls._async_clients.get(key)
+            if async_client is not None:
+                return async_client
+
+            async_client = AsyncMISPClient(url=misp_config.get('url', None),
+                                           key=misp_config.get('key', None),
+                                           ssl=misp_config.get('ssl', None),
+                                           name=misp_config.get('name', None),
+                                           proxies=proxies,
+                                           limit=limit,
+                                           timeout=misp_config.get('timeout', None),
+                                           cache=client.cache,
+                                           breakers=client._breakers,
+                                           limiters=client._limiters)
+
+            for old_client in cls._async_clients.values():
+                old_client.close()
+
+            cls._async_clients = {key: async_client}
+
+            return async_client
+
+    @classmethod
+    def clear(cls):
+        """
+        Closes and drops all the pooled clients
+        """
+        with cls._lock:
+            for client in [*cls._clients.values(), *cls._async_clients.values()]:
+                client.close()
+
+            cls._clients = {}
+            cls._async_clients = {}
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+#
+#  IRIS MISP Module Source Code
+#  contact@dfir-iris.org
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import hashlib
+import json
+import re
+from collections import Counter
+
+from markupsafe import escape
+
+from iris_misp_module.misp_handler.misp_template import MISPTemplateCache
+
+TRUNCATION_MARKER = '\n... truncated, {} bytes omitted'
+FINGERPRINT_PATTERN = re.compile(r'^<!-- misp-fingerprint: (\{.*?\}) -->')
+
+# Keys of an instance entry covered by its fingerprint, all the keys a report template can render
+FINGERPRINT_KEYS = ('name', 'result', 'error', 'warninglists', 'networks', 'similar_hashes')
+
+COMPACT_REPORT_TEMPLATE = """<div class="row">
+    <div class="col-12">
+        <h3>MISP results</h3>
+        <table class="table table-sm">
+            <thead><tr><th>Instance</th><th>Hits</th><th>Top events</th><th>Tags</th></tr></thead>
+            <tbody>
+            {% for instance in summary %}
+                <tr>
+                    <td><a href="{{ instance.url }}" target="_blank" rel="noopener">{{ instance.name }}</a></td>
+                    <td>{% if instance.error %}Error: {{ instance.error }}{% elif instance.warninglists %}Not searched, in warninglists: {{ instance.warninglists | join(', ') }}{% else %}{{ instance.hits }}{% endif %}{% if instance.networks %}<br/>In networks: {{ instance.networks | join(', ') }}{% endif %}{% if instance.similar_hashes %}<br/>Similar hashes: {{ instance.similar_hashes | join(', ') }}{% endif %}</td>
+                    <td>
+                    {% for event in instance.events %}
+                        <a href="{{ instance.url }}/events/view/{{ event.id }}" target="_blank" rel="noopener">#{{ event.id }}</a> {{ event.info }} ({{ event.date }})<br/>
+                    {% endfor %}
+                    {% if instance.hidden_events %}... {{ instance.hidden_events }} more events<br/>{% endif %}
+                    </td>
+                    <td>{{ instance.tags | join(', ') }}</td>
+                </tr>
+            {% endfor %}
+            </tbody>
+        </table>
+        {% if raw_results %}
+        <details>
+            <summary>MISP raw results</summary>
+            <pre style="white-space: pre-wrap; word-break: break-all;">{{ raw_results }}</pre>
+        </details>
+        {% endif %}
+    </div>
+</div>"""
+
+
+def _similar_hash_label(match):
+    """
+    Returns the label of a similar hash, e.g "3:abc:def (ssdeep score 88, events 12, 14)"
+    """
+    measure = 'score' if 'score' in match else 'distance'
+    events = ', '.join(str(event_id) for event_id in match.get('event_ids') or [])
+    return f"{match.get('value')} ({match.get('type')} {measure} {match.get(measure)}, events {events})"
+
+
+def summarize_report(report, top_events=10, top_tags=20):
+    """
+    Summarizes the report of each MISP instance
+
+    :param report: MISP report, list of {'name', 'url', 'result'[, 'error'][, 'warninglists'][, 'networks']
+                   [, 'similar_hashes']}
+    :param top_events: Number of events listed per instance, most recent first
+    :param top_tags: Number of tags listed per instance, most frequent first
+    :return: list of dict
+    """
+    summary = []
+    for instance in report:
+        events = instance.get('result') or []
+        tags = Counter(tag.get('name') for event in events for tag in event.get('Tag') or [] if tag.get('name'))
+        latest = sorted(events, key=lambda event: str(event.get('date') or ''), reverse=True)[:top_events]
+
+        summary.append({
+            'name': escape(instance.get('name') or ''),
+            'url': escape(str(instance.get('url') or '').rstrip('/')),
+            'error': escape(instance['error']) if instance.get('error') else None,
+            'warninglists': [escape(name) for name in instance.get('warninglists') or []],
+            'networks': [escape(network.get('network') or '') for network in instance.get('networks') or []],
+            'similar_hashes': [escape(_similar_hash_label(match)) for match in instance.get('similar_hashes') or []],
+            'hits': len(events),
+            'events': [{'id': escape(event.get('id') or ''), 'info': escape(event.get('info') or ''),
+                        'date': escape(event.get('date') or '')} for event in latest],
+            'hidden_events': max(0, len(events) - top_events),
+            'tags': [escape(tag) for tag, _ in tags.most_common(top_tags)]
+        })
+
+    return summary
+
+
+def truncate_text(text, max_bytes):
+    """
+    Truncates a text to a budget in UTF-8 bytes, marker included
+
+    :param text: Text to truncate
+    :param max_bytes: Budget in bytes
+    :return: str
+    """
+    encoded = text.encode()
+    if len(encoded) <= max_bytes:
+        return text
+
+    marker = TRUNCATION_MARKER.format(len(encoded))
+    kept = max(0, max_bytes - len(marker.encode()))
+    return encoded[:kept].decode(errors='ignore') + TRUNCATION_MARKER.format(len(encoded) - kept)
+
+
+def render_compact_report(report, max_bytes=256 * 1024, top_events=10):
+    """
+    Renders a report as a summary table per instance, followed by the raw results as compact JSON. The raw
+    results are truncated so the whole report fits in max_bytes, then the number of listed events is reduced
+    if the table alone does not fit.
+
+    :param report: MISP report
+    :param max_bytes: Budget in bytes of the rendered report
+    :param top_events: Number of events listed per instance
+    :return: str
+    """
+    template = MISPTemplateCache.get(COMPACT_REPORT_TEMPLATE)
+
+    while True:
+        summary = summarize_report(report, top_events=top_events)
+        table = template.render(summary=summary, raw_results=None)
+        available = max_bytes - len(table.encode())
+        if available > 0 or top_events == 0:
+            break
+        top_events //= 2
+
+    if available <= 0:
+        return truncate_text(table, max_bytes)
+
+    raw_results = json.dumps(report, separators=(',', ':'), default=str)
+
+    # Escaping only grows the text, so the raw results are shrunk until their escaped form fits the budget
+    budget = available
+    while budget > 0:
+        escaped = str(escape(truncate_text(raw_results, budget)))
+        rendered = template.render(summary=summary, raw_results=escaped)
+        excess = len(rendered.encode()) - max_bytes
+        if excess <= 0:
+            return rendered
+        budget -= excess
+
+    return table
+
+
+def report_fingerprint(report, settings):
+    """
+    Computes a digest of the results of each instance, so a report can be compared to the one stored on an IOC
+    without rendering it. Reports of composite IOCs list an instance once per part, its digest covers all of them.
+
+    :param report: MISP report
+    :param settings: Rendering settings, such as the template, changing them invalidates all the digests
+    :return: dict of instance url -> digest
+    """
+    settings_digest = hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+    digested = {}
+    for instance in report:
+        digested.setdefault(str(instance.get('url')), []).append({key: instance.get(key) for key in FINGERPRINT_KEYS})
+
+    fingerprint = {}
+    for url, entries in digested.items():
+        raw = json.dumps({'settings': settings_digest, 'entries': entries}, sort_keys=True, default=str)
+        fingerprint[url] = hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+    return fingerprint
+
+
+def embed_fingerprint(rendered, fingerprint):
+    """
+    Prepends the fingerprint of a report to its rendered HTML, as a comment
+
+    :param rendered: Rendered report
+    :param fingerprint: Fingerprint of the report
+    :return: str
+    """
+    return f'<!-- misp-fingerprint: {json.dumps(fingerprint, sort_keys=True)} -->\n{rendered}'
+
+
+def read_fingerprint(rendered):
+    """
+    Reads the fingerprint embedded in a rendered report
+
+    :param rendered: Rendered report, or None
+    :return: dict, or None if the report has no fingerprint
+    """
+    if not isinstance(rendered, str):
+        return None
+
+    match = FINGERPRINT_PATTERN.match(rendered)
+    if match is None:
+        return None
+
+    try:
+        return json.loads(match.group(1))
+    except ValueError:
+        return None
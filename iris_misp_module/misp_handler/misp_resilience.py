@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+#
+#  IRIS MISP Module Source Code
+#  contact@dfir-iris.org
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import logging
+import threading
+import time
+
+from iris_misp_module.misp_handler.misp_metrics import metrics
+
+log = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of a MISP instance. After failure_threshold consecutive failures the circuit opens, and
+    requests to the instance fail immediately instead of waiting for their timeout. Once cooldown seconds have
+    passed, a single request is let through as a probe: the circuit closes if it succeeds, and opens again for
+    another cooldown otherwise.
+
+    :param name: Name of the protected instance, used in logs and metrics
+    :param failure_threshold: Number of consecutive failures opening the circuit
+    :param cooldown: Time in seconds the circuit stays open before a probe
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    _state_values = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name, failure_threshold=5, cooldown=30):
+        self.name = name
+        self.failure_threshold = int(failure_threshold)
+        self.cooldown = float(cooldown)
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        metrics.set_gauge('misp_breaker_state', 0, instance=self.name)
+
+    @property
+    def state(self):
+        return self._state
+
+    def _transition(self, state):
+        if state == self._state:
+            return
+
+        if state == self.OPEN:
+            log.warning(f'Circuit of MISP instance {self.name} opened after {self._failures} consecutive '
+                        f'failures, retrying in {self.cooldown}s')
+        elif state == self.CLOSED:
+            log.info(f'Circuit of MISP instance {self.name} closed, the instance answers again')
+
+        self._state = state
+        metrics.set_gauge('misp_breaker_state', self._state_values[state], instance=self.name)
+        metrics.increment('misp_breaker_transitions_total', instance=self.name, state=state)
+
+    def allow(self):
+        """
+        Returns True if a request can be sent to the instance. When the cooldown is over, only the caller
+        getting True sends the probe, the others keep failing fast until it completes.
+
+        :return: bool
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                self._transition(self.HALF_OPEN)
+
+            if self._state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+
+        metrics.increment('misp_breaker_rejections_total', instance=self.name)
+        return False
+
+    def record_success(self):
+        """
+        Records a request which got an answer from the instance
+        """
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            self._transition(self.CLOSED)
+
+    def record_failure(self):
+        """
+        Records a request which failed or timed out
+        """
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._transition(self.OPEN)
+
+    def retry_in(self):
+        """
+        Returns the time in seconds before the next probe
+        """
+        return max(0.0, self.cooldown - (time.monotonic() - self._opened_at))
+
+
+class AbandonableRequest:
+    """
+    Request run by a worker for a caller which stops waiting for it after a timeout. Whichever of the caller and
+    the worker settles the request first decides whether it was abandoned or finished, so the outcome of the
+    request is recorded to the circuit breaker once, and as a failure when the caller gave up.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+
+    @property
+    def abandoned(self):
+        return self._state == 'abandoned'
+
+    def abandon(self):
+        """
+        Called by the caller giving up on the request
+
+        :return: False if the worker finished the request first
+        """
+        with self._lock:
+            if self._state is None:
+                self._state = 'abandoned'
+            return self._state == 'abandoned'
+
+    def finish(self):
+        """
+        Called by the worker once the request is done
+
+        :return: False if the caller gave up on the request first
+        """
+        with self._lock:
+            if self._state is None:
+                self._state = 'finished'
+            return self._state == 'finished'
+
+
+class TokenBucket:
+    """
+    Token bucket limiting the rate of requests sent to a MISP instance. Bursts of up to burst requests are sent
+    at once, then requests are spaced to keep the average rate.
+
+    :param rate: Number of requests allowed per second
+    :param burst: Size of the bucket
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, self.rate))
+
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+
+    def acquire(self):
+        """
+        Takes a token, waiting until one is available
+
+        :return: Time in seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+
+                delay = (1 - self._tokens) / self.rate
+
+            time.sleep(delay)
+            waited += delay
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limits the number of requests in flight to a MISP instance, and adapts the limit to the instance with an
+    additive increase, multiplicative decrease (AIMD) rule: the limit grows by one request per window of limit
+    successful requests, and is multiplied by decrease_factor when the instance is overloaded, that is when it
+    answers 429 or 5xx, times out, or answers slower than latency_target.
+
+    When latency_target is not set, it follows three times the moving average of the latency of the instance, and
+    at least the average plus 100ms, so the jitter of fast instances is not taken for an overload.
+
+    :param name: Name of the instance, used in metrics
+    :param max_limit: Maximum number of requests in flight, and initial limit
+    :param min_limit: Minimum number of requests in flight
+    :param latency_target: Latency in seconds above which the instance is considered overloaded
+    :param decrease_factor: Factor applied to the limit on overload
+    """
+
+    def __init__(self, name, max_limit, min_limit=1, latency_target=None, decrease_factor=0.5):
+        self.name = name
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        self.latency_target = float(latency_target) if latency_target else None
+        self.decrease_factor = decrease_factor
+
+        self._condition = threading.Condition()
+        self._limit = float(self.max_limit)
+        self._in_flight = 0
+        self._average_latency = None
+        self._last_decrease = 0.0
+        metrics.set_gauge('misp_concurrency_limit', self.max_limit, instance=self.name)
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def acquire(self):
+        """
+        Waits until a request can be sent
+        """
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, latency, overloaded=False):
+        """
+        Reports the end of a request and adapts the limit
+
+        :param latency: Duration of the request in seconds
+        :param overloaded: True if the instance answered 429 or 5xx, or timed out
+        """
+        with self._condition:
+            self._in_flight -= 1
+
+            target = self.latency_target
+            if target is None and self._average_latency is not None:
+                target = max(3 * self._average_latency, self._average_latency + 0.1)
+
+            now = time.monotonic()
+            if overloaded or (target is not None and latency > target):
+                # Requests sent before the decrease report the same overload, only one decrease per latency
+                if now - self._last_decrease > (self._average_latency or latency):
+                    self._limit = max(float(self.min_limit), self._limit * self.decrease_factor)
+                    self._last_decrease = now
+                    metrics.increment('misp_concurrency_decreases_total', instance=self.name)
+            else:
+                self._limit = min(float(self.max_limit), self._limit + 1 / self._limit)
+
+            if not overloaded:
+                self._average_latency = latency if self._average_latency is None else \
+                    0.9 * self._average_latency + 0.1 * latency
+
+            metrics.set_gauge('misp_concurrency_limit', int(self._limit), instance=self.name)
+            self._condition.notify_all()
+
+
+class InstanceRateLimiter:
+    """
+    Rate and concurrency limits of a MISP instance. Either limit is optional.
+
+    :param name: Name of the instance, used in metrics
+    :param rate: Number of requests allowed per second, None for no rate limit
+    :param burst: Size of the token bucket
+    :param max_concurrency: Maximum number of requests in flight, None for no concurrency limit
+    :param min_concurrency: Minimum number of requests in flight kept by the adaptive limit
+    :param latency_target: Latency in seconds above which the instance is considered overloaded
+    """
+
+    def __init__(self, name, rate=None, burst=None, max_concurrency=None, min_concurrency=1, latency_target=None):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.concurrency = AdaptiveConcurrencyLimiter(name, max_concurrency, min_concurrency, latency_target) \
+            if max_concurrency else None
+
+    def acquire(self):
+        """
+        Waits until a request can be sent to the instance
+        """
+        if self.concurrency is not None:
+            self.concurrency.acquire()
+        if self.bucket is not None:
+            waited = self.bucket.acquire()
+            if waited:
+                metrics.observe('misp_rate_limit_wait_seconds', waited, instance=self.name)
+
+    def release(self, latency, overloaded=False):
+        """
+        Reports the end of a request
+
+        :param latency: Duration of the request in seconds
+        :param overloaded: True if the instance answered 429 or 5xx, or timed out
+        """
+        if self.concurrency is not None:
+            self.concurrency.release(latency, overloaded)
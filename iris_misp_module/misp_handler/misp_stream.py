@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+#
+#  IRIS MISP Module Source Code
+#  contact@dfir-iris.org
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+from urllib.parse import urljoin
+
+import requests
+
+from iris_misp_module.misp_handler.misp_helper import normalize_value
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+def streaming_available():
+    """
+    Returns True if the iterative JSON parser needed for streaming is installed
+    """
+    return ijson is not None
+
+
+def _post_stream(connection, path, query):
+    """
+    Sends a restSearch query through the session of a PyMISP connection, without reading the body
+
+    :param connection: PyMISP connection
+    :param path: API path
+    :param query: JSON query
+    :return: requests.Response
+    """
+    # PyMISP does not expose streamed requests, so its session is used directly to keep the pooled connections
+    session = connection._PyMISP__session
+    request = requests.Request('POST', urljoin(connection.root_url, path), json=query)
+    prepped = session.prepare_request(request)
+    prepped.headers.update({'Authorization': connection.key,
+                            'Accept': 'application/json',
+                            'content-type': 'application/json',
+                            'User-Agent': connection._user_agent})
+    settings = session.merge_environment_settings(prepped.url, proxies=connection.proxies or {}, stream=True,
+                                                  verify=connection.ssl, cert=connection.cert)
+    response = session.send(prepped, timeout=connection.timeout, **settings)
+    if response.status_code != 200:
+        text = response.text
+        response.close()
+        raise requests.HTTPError(f'{response.status_code}: {text[:500]}', response=response)
+
+    response.raw.decode_content = True
+    return response
+
+
+def stream_events(connection, value, type_attribute, filters, event_ids=None, with_values=False, timestamp=None):
+    """
+    Searches events and parses the response while it is downloaded. Fields listed in filters and the content of
+    related events other than their id and info are skipped by the parser, so they are never built in memory.
+
+    Peak memory is bounded by the size of the largest event once filtered, plus the parser buffer (64 KiB),
+    instead of the size of the whole response.
+
+    :param connection: PyMISP connection
+    :param value: value or list of values to search for
+    :param type_attribute: attribute types to search for.
+    :param filters: event fields to skip
+    :param event_ids: restrict the search to these events
+    :param with_values: also collect the normalized attribute values of each event
+    :param timestamp: only return the events changed since this timestamp
+    :return: Generator of (event, values) tuples, values being None unless with_values is set
+    """
+    query = {'returnFormat': 'json', 'value': value, 'type': type_attribute}
+    if event_ids:
+        query['eventid'] = event_ids
+    if timestamp:
+        query['timestamp'] = timestamp
+
+    response = _post_stream(connection, 'events/restSearch', query)
+    filters = set(filters)
+
+    try:
+        item_prefix = None
+        builder = None
+        values = None
+
+        for prefix, event, data in ijson.parse(response.raw, use_float=True):
+            if item_prefix is None:
+                if event == 'start_map' and prefix in ('response.item', 'item'):
+                    item_prefix = prefix
+                    event_prefix = f'{prefix}.Event'
+                    attribute_value_prefixes = (f'{event_prefix}.Attribute.item.value',
+                                                f'{event_prefix}.Object.item.Attribute.item.value')
+                    related_prefix = f'{event_prefix}.RelatedEvent.item.Event'
+                else:
+                    continue
+
+            if prefix == item_prefix and event == 'start_map':
+                builder = ijson.ObjectBuilder()
+                values = set() if with_values else None
+
+            if builder is None:
+                continue
+
+            if with_values and event == 'string' and prefix in attribute_value_prefixes:
+                values.add(normalize_value(data))
+                if '|' in data:
+                    values.update(normalize_value(part) for part in data.split('|'))
+
+            # Skip the filtered fields of the event, including the key announcing them
+            if prefix == event_prefix and event == 'map_key' and data in filters:
+                continue
+            if prefix.startswith(event_prefix + '.') and prefix[len(event_prefix) + 1:].split('.', 1)[0] in filters:
+                continue
+
+            # Only keep the id and info of related events
+            if prefix == related_prefix and event == 'map_key' and data not in ('id', 'info'):
+                continue
+            if prefix.startswith(related_prefix + '.') and \
+                    prefix[len(related_prefix) + 1:].split('.', 1)[0] not in ('id', 'info'):
+                continue
+
+            builder.event(event, data)
+
+            if prefix == item_prefix and event == 'end_map':
+                misp_event = builder.value.get('Event', {})
+                if 'RelatedEvent' in misp_event:
+                    misp_event['RelatedEvent'] = [{'info': related['Event'].get('info'),
+                                                   'id': related['Event'].get('id')}
+                                                  for related in misp_event['RelatedEvent']]
+                yield misp_event, values
+                builder = None
+
+    finally:
+        response.close()
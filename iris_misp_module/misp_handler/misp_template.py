@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+#
+#  IRIS MISP Module Source Code
+#  contact@dfir-iris.org
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import hashlib
+import threading
+from collections import OrderedDict
+
+from jinja2 import Template
+
+from iris_misp_module.misp_handler.misp_metrics import metrics
+
+REPORT_TEMPLATES = ['misp_domain_report_template', 'misp_ip_report_template', 'misp_hash_report_template',
+                    'misp_ja3_report_template', 'misp_url_report_template', 'misp_mail_report_template',
+                    'misp_registry_report_template', 'misp_filename_report_template']
+
+
+class MISPTemplateCache:
+    """
+    Process-wide cache of compiled report templates, keyed by the hash of their content. Compiling a template
+    lexes and parses it, which costs far more than rendering it, so templates are only compiled once as long as
+    the module configuration does not change.
+    """
+    _lock = threading.Lock()
+    _templates = OrderedDict()
+    max_entries = 16
+
+    @staticmethod
+    def _template_key(html_template):
+        return hashlib.sha256(html_template.encode()).hexdigest()
+
+    @classmethod
+    def get(cls, html_template) -> Template:
+        """
+        Returns the compiled template, compiling it if needed
+
+        :param html_template: A string representing the HTML template
+        :return: Template
+        """
+        key = cls._template_key(html_template)
+
+        with cls._lock:
+            template = cls._templates.get(key)
+            if template is not None:
+                cls._templates.move_to_end(key)
+                return template
+
+        # Compiled outside the lock, a template compiled twice by concurrent hooks is harmless
+        with metrics.timer('template_compile'):
+            template = Template(html_template)
+
+        with cls._lock:
+            cls._templates[key] = template
+            cls._templates.move_to_end(key)
+            while len(cls._templates) > cls.max_entries:
+                cls._templates.popitem(last=False)
+
+        return template
+
+    @classmethod
+    def precompile(cls, mod_config):
+        """
+        Compiles the report templates of a module configuration
+
+        :param mod_config: Module configuration
+        :return: Nothing
+        """
+        for template_name in REPORT_TEMPLATES:
+            html_template = mod_config.get(template_name)
+            if html_template:
+                cls.get(html_template)
+
+    @classmethod
+    def clear(cls):
+        """
+        Drops all the compiled templates
+        """
+        with cls._lock:
+            cls._templates.clear()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+#
+#  IRIS MISP Module Source Code
+#  contact@dfir-iris.org
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import logging
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+HASH_TYPES = ['md5', 'sha1', 'sha256', 'ssdeep', 'sha224', 'sha384', 'sha512', 'sha512/224', 'sha512/256', 'tlsh',
+              'authentihash']
+
+
+class IOCLookup(namedtuple('IOCLookup', ['category', 'part', 'template'])):
+    """
+    MISP lookup of an IOC type.
+
+    :param category: Search category of the MISPClient, e.g hash for search_hash
+    :param part: Index of the part of a composite value (e.g 1 for the hash of filename|md5) or None for the whole
+                 value
+    :param template: Name of the report template parameter
+    """
+    __slots__ = ()
+
+    def extract(self, value):
+        """
+        Returns the value to look up from the IOC value. IOC values are typed by analysts, so a composite value
+        can miss the part: it is then skipped.
+
+        :param value: IOC value
+        :return: str, or None if the value has no such part
+        """
+        if self.part is None:
+            return value
+
+        parts = value.split('|')
+        if self.part >= len(parts):
+            log.warning(f'No part {self.part} to look up in {value}, skipping the {self.category} lookup')
+            return None
+        return parts[self.part]
+
+
+def _build_lookup_table():
+    """
+    Builds the table of the MISP lookups of each supported IRIS IOC type
+    """
+    domain = ('domain', 'misp_domain_report_template')
+    ip = ('ip', 'misp_ip_report_template')
+    hash_ = ('hash', 'misp_hash_report_template')
+    url = ('url', 'misp_url_report_template')
+    mail = ('mail', 'misp_mail_report_template')
+    registry = ('registry', 'misp_registry_report_template')
+    filename = ('filename', 'misp_filename_report_template')
+    ja3 = ('ja3', 'misp_ja3_report_template')
+
+    def lookup(target, part=None):
+        return IOCLookup(target[0], part, target[1])
+
+    table = {
+        'domain': (lookup(domain),),
+        'hostname': (lookup(domain),),
+        'hostname|port': (lookup(domain, 0),),
+        'domain|ip': (lookup(domain, 0), lookup(ip, 1)),
+        'ip-any': (lookup(ip),),
+        'ip-src': (lookup(ip),),
+        'ip-dst': (lookup(ip),),
+        'ip-src|port': (lookup(ip, 0),),
+        'ip-dst|port': (lookup(ip, 0),),
+        'url': (lookup(url),),
+        'uri': (lookup(url),),
+        'link': (lookup(url),),
+        'regkey': (lookup(registry),),
+        'regkey|value': (lookup(registry, 0),),
+        'filename': (lookup(filename),),
+        'ja3-fingerprint-md5': (lookup(ja3),)
+    }
+
+    for type_name in ['email', 'email-src', 'email-dst', 'target-email', 'email-reply-to', 'email-subject',
+                      'email-attachment', 'email-header', 'whois-registrant-email', 'dns-soa-email']:
+        table[type_name] = (lookup(mail),)
+
+    for hash_type in HASH_TYPES:
+        table[hash_type] = (lookup(hash_),)
+        table[f'filename|{hash_type}'] = (lookup(hash_, 1),)
+
+    return table
+
+
+IOC_TYPE_LOOKUPS = _build_lookup_table()
+
+
+def get_type_lookups(type_name):
+    """
+    Returns the MISP lookups of an IOC type
+
+    :param type_name: IRIS IOC type name
+    :return: tuple of IOCLookup, empty if the type is not handled
+    """
+    return IOC_TYPE_LOOKUPS.get(type_name, ())
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+#
+#  IRIS MISP Module Source Code
+#  contact@dfir-iris.org
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import json
+import logging
+import os
+import threading
+from urllib.parse import urlsplit
+
+from iris_misp_module.misp_handler.misp_helper import normalize_value
+from iris_misp_module.misp_handler.misp_network import CIDRIntervalIndex
+
+log = logging.getLogger(__name__)
+
+
+class DomainSuffixIndex:
+    """
+    Index of domains matching a domain and all its subdomains. It holds the nodes of a suffix trie on labels, each
+    node being keyed by the full suffix it stands for, so a lookup is one dict access per label of the looked up
+    domain and an entry costs a single string however deep it is.
+    """
+
+    def __init__(self):
+        self._suffixes = {}
+
+    def __len__(self):
+        return len(self._suffixes)
+
+    def add(self, domain, name):
+        """
+        Adds a domain
+
+        :param domain: Domain, leading dots and wildcards are ignored
+        :param name: Name associated with the domain, e.g the warninglist holding it
+        """
+        domain = normalize_value(domain).lstrip('*').strip('.')
+        if domain:
+            self._suffixes.setdefault(domain, []).append(name)
+
+    def lookup(self, domain):
+        """
+        Returns the names of the most specific entry matching a domain or one of its parents
+
+        :param domain: Domain
+        :return: list of names, or None
+        """
+        domain = normalize_value(domain).strip('.')
+        position = 0
+        while domain:
+            names = self._suffixes.get(domain[position:])
+            if names is not None:
+                return names
+
+            position = domain.find('.', position) + 1
+            if not position:
+                break
+
+        return None
+
+
+def _host(value):
+    """
+    Returns the host of a value, which is the value itself unless it is a URL
+    """
+    if '://' in value:
+        try:
+            return urlsplit(value).hostname or value
+        except ValueError:
+            return value
+    return value
+
+
+class MISPWarninglists:
+    """
+    Local copy of MISP warninglists, used to skip the lookup of known benign values such as private networks,
+    cloud ranges or popular domains.
+
+    Warninglists are read from an export: a JSON file holding one warninglist, a list of warninglists or the
+    answer of the MISP warninglists API, or a directory of such files like the misp-warninglists repository. cidr
+    lists are indexed in a CIDRIntervalIndex, hostname lists in a DomainSuffixIndex and string lists in a dict.
+    Each list only applies to the search categories sharing attribute types with its matching_attributes. substring
+    and regex lists are ignored. The export is loaded by a background thread, and loaded again when it changes,
+    checked every interval seconds. No value is considered warninglisted until the first load completes.
+
+    :param path: Path of the export file or directory
+    :param category_types: dict of search category -> MISP attribute types searched by the category
+    :param interval: Time in seconds between two checks of the export
+    """
+
+    def __init__(self, path, category_types, interval=3600):
+        self.path = path
+        self.category_types = {category: set(types) for category, types in category_types.items()}
+        self.interval = interval
+
+        self._indexes = {}
+        self._mtime = None
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='misp_warninglist_reload', daemon=True)
+        self._thread.start()
+
+    def _export_files(self):
+        if not os.path.isdir(self.path):
+            return [self.path]
+
+        files = []
+        for directory, _, names in os.walk(self.path):
+            files.extend(os.path.join(directory, name) for name in names if name.endswith('.json'))
+        return sorted(files)
+
+    @staticmethod
+    def _warninglists(content):
+        """
+        Returns the warninglists of an export as (name, type, matching attributes, entries) tuples
+        """
+        if isinstance(content, dict):
+            content = content.get('Warninglists') or content.get('response') or [content]
+
+        for warninglist in content:
+            warninglist = warninglist.get('Warninglist', warninglist)
+            entries = warninglist.get('list')
+            if entries is None:
+                entries = [entry.get('value') for entry in warninglist.get('WarninglistEntry', [])]
+            matching_attributes = warninglist.get('matching_attributes')
+            if matching_attributes is None:
+                matching_attributes = [entry.get('type') for entry in warninglist.get('WarninglistType', [])]
+
+            yield warninglist.get('name', 'Unnamed'), warninglist.get('type'), matching_attributes, entries
+
+    def _categories(self, list_type, matching_attributes):
+        if matching_attributes:
+            return [category for category, types in self.category_types.items() if types & set(matching_attributes)]
+        if list_type == 'cidr':
+            return ['ip']
+        if list_type == 'hostname':
+            return ['domain']
+        return list(self.category_types)
+
+    def build(self):
+        """
+        Reads the export and builds the indexes of each search category
+
+        :return: dict of category -> dict of list type -> index
+        """
+        indexes = {}
+        for file_path in self._export_files():
+            with open(file_path) as f:
+                content = json.load(f)
+
+            for name, list_type, matching_attributes, entries in self._warninglists(content):
+                if list_type not in ['cidr', 'hostname', 'string']:
+                    continue
+
+                for category in self._categories(list_type, matching_attributes):
+                    category_indexes = indexes.setdefault(category, {'cidr': CIDRIntervalIndex(),
+                                                                     'hostname': DomainSuffixIndex(),
+                                                                     'string': {}})
+                    for entry in entries:
+                        if not entry:
+                            continue
+                        if list_type == 'cidr':
+                            try:
+                                category_indexes['cidr'].add(entry, name)
+                            except ValueError:
+                                continue
+                        elif list_type == 'hostname':
+                            category_indexes['hostname'].add(entry, name)
+                        else:
+                            category_indexes['string'].setdefault(normalize_value(entry), []).append(name)
+
+        for category_indexes in indexes.values():
+            category_indexes['cidr'].build()
+
+        return indexes
+
+    def _export_mtime(self):
+        return max((os.path.getmtime(file_path) for file_path in self._export_files()), default=None)
+
+    def reload(self):
+        """
+        Rebuilds the indexes if the export changed. Lookups keep using the previous indexes until the new ones are
+        complete, or if the export cannot be read.
+        """
+        try:
+            mtime = self._export_mtime()
+            if mtime is None or mtime == self._mtime:
+                return
+
+            self._indexes = self.build()
+            self._mtime = mtime
+            log.info(f'Loaded warninglists from {self.path}: ' + ', '.join(
+                f'{category} {sum(len(index) for index in indexes.values())} entries'
+                for category, indexes in self._indexes.items()))
+
+        except Exception as e:
+            log.warning(f'Unable to load warninglists from {self.path}: {e}')
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self.reload()
+            self._stop_event.wait(self.interval)
+
+    def match(self, category, value):
+        """
+        Returns the names of the warninglists holding a value
+
+        :param category: Search category of the value
+        :param value: Value
+        :return: list of warninglist names, or None if no warninglist holds it
+        """
+        indexes = self._indexes.get(category)
+        if indexes is None or not value:
+            return None
+
+        names = indexes['string'].get(normalize_value(value))
+        if names is not None:
+            return names
+
+        host = _host(value)
+        return indexes['cidr'].lookup(host) or indexes['hostname'].lookup(host)
+
+    def stop(self):
+        self._stop_event.set()
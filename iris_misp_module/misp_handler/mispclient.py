@@ -5,6 +5,21 @@
 # https://github.com/TheHive-Project/Cortex-Analyzers/blob/master/analyzers/MISP/mispclient.py
 import pymisp
 import os
+import requests
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from requests.adapters import HTTPAdapter
+
+from iris_misp_module.misp_handler.misp_bloom import MISPBloomPrefilter
+from iris_misp_module.misp_handler.misp_delta import MISPDeltaStore, merge_events
+from iris_misp_module.misp_handler.misp_fuzzy import MISPFuzzyHashIndex
+from iris_misp_module.misp_handler.misp_helper import SingleFlight, chunks, normalize_value
+from iris_misp_module.misp_handler.misp_index import MISPAttributeIndex, MISPIndexSyncThread, attribute_values
+from iris_misp_module.misp_handler.misp_metrics import metrics
+from iris_misp_module.misp_handler.misp_network import MISPNetworkIndex
+from iris_misp_module.misp_handler.misp_resilience import AbandonableRequest, CircuitBreaker, InstanceRateLimiter
+from iris_misp_module.misp_handler.misp_stream import stream_events, streaming_available
+from iris_misp_module.misp_handler.misp_warninglist import MISPWarninglists
 
 
 class MISPClientError(Exception):
@@ -22,6 +37,11 @@ class CertificateNotFoundError(MISPClientError):
     pass
 
 
+class MISPOverloadedError(MISPClientError):
+    """Raised when a MISP instance answers 429 or 5xx"""
+    pass
+
+
 class MISPClient:
     """The MISPClient class just hides the "complexity" of the queries. All params can be lists to query more than one
     MISP instance.
@@ -36,10 +56,114 @@ class MISPClient:
     :type name: [str, list]
     :param proxies: Proxy to use for pymisp instances
     :type proxies: dict
+    :param pool_size: Maximum number of keep-alive HTTP connections kept open per MISP instance
+    :type pool_size: [int, list]
+    :param timeout: Timeout in seconds of a search on a MISP instance. A timed out instance returns an error marker
+    :type timeout: [float, list]
+    :param fanout: Query all the MISP instances concurrently instead of one after another
+    :type fanout: bool
+    :param batch_size: Maximum number of values sent in a single query by search_batch
+    :type batch_size: int
+    :param cache: Cache of the search results, see MISPLookupCache
+    :type cache: [MISPLookupCache, None]
+    :param index_interval: If set, keep a local index of the hash, ip, domain and ja3 attributes of each instance,
+                           synced every index_interval seconds, and only query instances for values present in it
+    :type index_interval: [int, None]
+    :param network_index_interval: If set, keep a local index of the ip-src and ip-dst attributes of each instance
+                                   holding a network, synced every network_index_interval seconds, and report the
+                                   networks holding the searched IPs
+    :type network_index_interval: [int, None]
+    :param fuzzy_index_config: If set, settings of the local similarity index of the ssdeep and TLSH attributes of
+                               each instance: interval, the time in seconds between two syncs, ssdeep_threshold,
+                               the minimum ssdeep score and tlsh_threshold, the maximum TLSH distance of the
+                               similar hashes reported with the searched fuzzy hashes
+    :type fuzzy_index_config: [dict, None]
+    :param prefilter_config: If set, keyword arguments of the MISPBloomPrefilter used to skip the instances which
+                             definitely do not hold a value
+    :type prefilter_config: [dict, None]
+    :param warninglist_config: If set, keyword arguments of the MISPWarninglists used to skip the lookup of values
+                               held by a warninglist, on all instances
+    :type warninglist_config: [dict, None]
+    :param search_mode: 'events' to search full events and strip them client side, or 'attributes' to search
+                        matching attributes only, with minimal event information
+    :type search_mode: str
+    :param search_limit: Number of attributes fetched per page in attributes mode, pages being fetched until one
+                         comes back short. 0 to fetch all the attributes at once
+    :type search_limit: int
+    :param streaming: In events mode, parse responses while they are downloaded and skip the stripped fields, so
+                      large responses are never fully held in memory. Requires ijson
+    :type streaming: bool
+    :param delta_config: If set, keyword arguments of the MISPDeltaStore recording each search, so the next search
+                         of a value only fetches the events changed since the previous one
+    :type delta_config: [dict, None]
+    :param breaker_threshold: Number of consecutive failures or timeouts after which an instance is considered
+                              unavailable and not queried for breaker_cooldown seconds. 0 to disable
+    :type breaker_threshold: [int, list]
+    :param breaker_cooldown: Time in seconds before an unavailable instance is probed again
+    :type breaker_cooldown: [float, list]
+    :param rate_limit: Maximum number of requests per second sent to an instance, None for no limit
+    :type rate_limit: [float, list, None]
+    :param rate_burst: Number of requests which can be sent at once before rate_limit applies
+    :type rate_burst: [int, list, None]
+    :param max_concurrency: If set, maximum number of requests in flight to an instance. The limit adapts to the
+                            instance, and is halved when it answers 429 or 5xx, times out or slows down
+    :type max_concurrency: [int, list, None]
+    :param min_concurrency: Minimum number of requests in flight the adaptive limit keeps
+    :type min_concurrency: [int, list]
+    :param latency_target: Latency in seconds above which an instance is considered overloaded. Defaults to three
+                           times the average latency of the instance
+    :type latency_target: [float, list, None]
     """
 
-    def __init__(self, url, key, ssl=True, name='Unnamed', proxies=None):
+    # Event fields stripped from the reports
+    _event_filters = ['Attribute',
+                      'ShadowAttribute',
+                      'Org',
+                      'SharingGroup',
+                      'sharing_group_id',
+                      'disable_correlation',
+                      'locked',
+                      'publish_timestamp',
+                      'attribute_count',
+                      'analysis',
+                      'published',
+                      'distribution',
+                      'proposal_email_lock']
+
+    # Delta searches start this many seconds before the previous search, to absorb clock skew with MISP and
+    # events saved while the previous search was running
+    _delta_margin = 300
+
+    def __init__(self, url, key, ssl=True, name='Unnamed', proxies=None, pool_size=10, timeout=None, fanout=True,
+                 batch_size=100, cache=None, index_interval=None, network_index_interval=None, fuzzy_index_config=None,
+                 prefilter_config=None, warninglist_config=None, search_mode='events', search_limit=1000,
+                 streaming=False, delta_config=None, breaker_threshold=5, breaker_cooldown=30,
+                 rate_limit=None, rate_burst=None, max_concurrency=None, min_concurrency=1, latency_target=None):
+        if search_mode not in ['events', 'attributes']:
+            raise MISPClientError(f'Unknown search mode {search_mode}')
+        if streaming and not streaming_available():
+            raise MISPClientError('Streaming requires the ijson package')
+
+        self.streaming = streaming
+        self.search_mode = search_mode
+        self.search_limit = int(search_limit) or None
+        self.batch_size = int(batch_size)
+        self.cache = cache
         self.misp_connections = []
+        self._adapters = []
+        self._pool_sizes = []
+        self._timeouts = []
+        self._executor = None
+        self._indexes = []
+        self._index_sync = None
+        self._network_indexes = []
+        self._network_index_sync = None
+        self._fuzzy_indexes = []
+        self._fuzzy_index_sync = None
+        self._fuzzy_index_config = fuzzy_index_config or {}
+        self._prefilters = []
+        self._delta = MISPDeltaStore(**delta_config) if delta_config else None
+        self._inflight = SingleFlight()
         if type(url) is list:
             for idx, server in enumerate(url):
                 verify = True
@@ -63,7 +187,9 @@ class MISPClient:
                 self.misp_connections.append(pymisp.ExpandedPyMISP(url=server,
                                                                    key=key[idx],
                                                                    ssl=verify,
-                                                                   proxies=proxies))
+                                                                   proxies=proxies,
+                                                                   timeout=self.__timeout(timeout, idx),
+                                                                   https_adapter=self.__adapter(pool_size, idx)))
         else:
             verify = True
             if isinstance(ssl, str) and os.path.isfile(ssl):
@@ -75,8 +201,189 @@ class MISPClient:
             self.misp_connections.append(pymisp.ExpandedPyMISP(url=url,
                                                                key=key,
                                                                ssl=verify,
-                                                               proxies=proxies))
+                                                               proxies=proxies,
+                                                               timeout=self.__timeout(timeout, 0),
+                                                               https_adapter=self.__adapter(pool_size, 0)))
         self.misp_name = name
+        self._breakers = [self.__breaker(breaker_threshold, breaker_cooldown, idx)
+                          for idx in range(len(self.misp_connections))]
+        self._limiters = [self.__limiter(rate_limit, rate_burst, max_concurrency, min_concurrency, latency_target,
+                                         idx) for idx in range(len(self.misp_connections))]
+
+        if fanout and len(self.misp_connections) > 1:
+            # One worker per pooled connection, so concurrent callers are not serialized by the fan-out
+            self._executor = ThreadPoolExecutor(max_workers=sum(self._pool_sizes),
+                                                thread_name_prefix='misp_fanout')
+
+        if index_interval:
+            category_types = {category: self._mispcategorytypes(category) for category in ['hash', 'ip', 'domain',
+                                                                                           'ja3']}
+            self._indexes = [MISPAttributeIndex(connection, category_types) for connection in self.misp_connections]
+            self._index_sync = MISPIndexSyncThread(self._indexes, interval=int(index_interval))
+            self._index_sync.start()
+
+        if network_index_interval:
+            self._network_indexes = [MISPNetworkIndex(connection) for connection in self.misp_connections]
+            self._network_index_sync = MISPIndexSyncThread(self._network_indexes,
+                                                           interval=int(network_index_interval))
+            self._network_index_sync.start()
+
+        if fuzzy_index_config:
+            self._fuzzy_indexes = [MISPFuzzyHashIndex(connection) for connection in self.misp_connections]
+            self._fuzzy_index_sync = MISPIndexSyncThread(self._fuzzy_indexes,
+                                                         interval=int(fuzzy_index_config.get('interval', 300)))
+            self._fuzzy_index_sync.start()
+
+        if prefilter_config:
+            type_attribute = sorted({t for category in ['url', 'hash', 'domain', 'mail', 'ip', 'registry', 'filename',
+                                                        'ja3'] for t in self._mispcategorytypes(category)})
+            self._prefilters = [MISPBloomPrefilter(connection, type_attribute, **prefilter_config)
+                                for connection in self.misp_connections]
+
+        self._warninglists = None
+        if warninglist_config:
+            category_types = {category: self._mispcategorytypes(category)
+                              for category in ['url', 'hash', 'domain', 'mail', 'ip', 'registry', 'filename', 'ja3']}
+            self._warninglists = MISPWarninglists(category_types=category_types, **warninglist_config)
+
+    @staticmethod
+    def _instance_param(param, idx, default=None):
+        """Returns the value of a parameter for the instance idx. The parameter can be given once for all
+        instances or as a list with one value per instance.
+
+        :param param: Parameter value or list of values
+        :param idx: Index of the instance
+        :param default: Value returned when the parameter is not set for the instance
+        """
+        if isinstance(param, list):
+            param = param[idx] if idx < len(param) else None
+        return default if param is None else param
+
+    def __timeout(self, timeout, idx):
+        """Returns the search timeout of a MISP instance and keeps track of it.
+
+        :param timeout: Timeout, or list of timeouts for each instance
+        :param idx: Index of the instance
+        :rtype: [float, None]
+        """
+        timeout = self._instance_param(timeout, idx)
+        if timeout is not None:
+            timeout = float(timeout)
+        self._timeouts.append(timeout)
+        return timeout
+
+    def __adapter(self, pool_size, idx):
+        """Builds the HTTPS adapter of a MISP instance. The adapter keeps up to pool_size connections alive, so
+        the TLS handshake is only paid once per connection and not once per search.
+
+        :param pool_size: Pool size, or list of pool sizes for each instance
+        :param idx: Index of the instance
+        :rtype: HTTPAdapter
+        """
+        pool_size = self._instance_param(pool_size, idx) or 10
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=int(pool_size))
+        self._adapters.append(adapter)
+        self._pool_sizes.append(int(pool_size))
+        return adapter
+
+    def __breaker(self, breaker_threshold, breaker_cooldown, idx):
+        """Builds the circuit breaker of a MISP instance
+
+        :param breaker_threshold: Failure threshold, or list of thresholds for each instance
+        :param breaker_cooldown: Cooldown, or list of cooldowns for each instance
+        :param idx: Index of the instance
+        :rtype: [CircuitBreaker, None]
+        """
+        threshold = int(self._instance_param(breaker_threshold, idx, 5))
+        if threshold <= 0:
+            return None
+        return CircuitBreaker(self.misp_connections[idx].root_url, failure_threshold=threshold,
+                              cooldown=float(self._instance_param(breaker_cooldown, idx, 30)))
+
+    def __limiter(self, rate_limit, rate_burst, max_concurrency, min_concurrency, latency_target, idx):
+        """Builds the rate and concurrency limits of a MISP instance. Each parameter can be given once for all
+        instances or as a list with one value per instance.
+
+        :param rate_limit: Requests per second
+        :param rate_burst: Size of the token bucket
+        :param max_concurrency: Maximum number of requests in flight
+        :param min_concurrency: Minimum number of requests in flight
+        :param latency_target: Latency in seconds above which the instance is considered overloaded
+        :param idx: Index of the instance
+        :rtype: [InstanceRateLimiter, None]
+        """
+        rate = self._instance_param(rate_limit, idx)
+        concurrency = self._instance_param(max_concurrency, idx)
+        if not rate and not concurrency:
+            return None
+        return InstanceRateLimiter(self.misp_connections[idx].root_url,
+                                   rate=float(rate) if rate else None,
+                                   burst=self._instance_param(rate_burst, idx),
+                                   max_concurrency=concurrency,
+                                   min_concurrency=self._instance_param(min_concurrency, idx, 1),
+                                   latency_target=self._instance_param(latency_target, idx))
+
+    @staticmethod
+    def __overloaded(error):
+        """Returns True if an error means the MISP instance is overloaded: 429 and 5xx answers, and timeouts
+
+        :param error: Exception raised by a query
+        :rtype: bool
+        """
+        if isinstance(error, (MISPOverloadedError, pymisp.MISPServerError, requests.Timeout)):
+            return True
+        if isinstance(error, requests.HTTPError) and error.response is not None:
+            return error.response.status_code == 429 or error.response.status_code >= 500
+        return False
+
+    def __allowed(self, idx):
+        """Returns False if the circuit breaker of the instance idx is open
+
+        :param idx: Index of the instance
+        :rtype: bool
+        """
+        breaker = self._breakers[idx]
+        return breaker is None or breaker.allow()
+
+    def __record_outcome(self, idx, failed):
+        """Reports the outcome of a request to the circuit breaker of the instance idx
+
+        :param idx: Index of the instance
+        :param failed: True if the request failed or timed out
+        """
+        breaker = self._breakers[idx]
+        if breaker is None:
+            return
+        if failed:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+    def __unavailable_error(self, idx):
+        """Returns the error marker of an instance whose circuit breaker is open
+
+        :param idx: Index of the instance
+        :rtype: str
+        """
+        return f'Instance unavailable, next attempt in {self._breakers[idx].retry_in():.0f}s'
+
+    def close(self):
+        """Closes the keep-alive connections of all MISP instances"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        if self._index_sync is not None:
+            self._index_sync.stop()
+        if self._network_index_sync is not None:
+            self._network_index_sync.stop()
+        if self._fuzzy_index_sync is not None:
+            self._fuzzy_index_sync.stop()
+        for prefilter in self._prefilters:
+            prefilter.stop()
+        if self._warninglists is not None:
+            self._warninglists.stop()
+        for adapter in self._adapters:
+            adapter.close()
 
     @staticmethod
     def __misphashtypes():
@@ -159,6 +466,29 @@ class MISPClient:
         """
         return ['ja3-fingerprint-md5']
 
+    @classmethod
+    def _mispcategorytypes(cls, category):
+        """Returns the misp data types of a search category, as used by the search_* methods
+
+        :param category: One of url, hash, domain, mail, ip, registry, filename, ja3
+        :returns: misp data types
+        :rtype: list
+        """
+        categories = {
+            'url': cls.__mispurltypes,
+            'hash': cls.__misphashtypes,
+            'domain': cls.__mispdomaintypes,
+            'mail': cls.__mispmailtypes,
+            'ip': cls.__mispiptypes,
+            'registry': cls.__mispregistrytypes,
+            'filename': cls.__mispfilenametypes,
+            'ja3': cls._mispja3types
+        }
+        if category not in categories:
+            raise MISPClientError(f'Unknown search category {category}')
+
+        return categories[category]()
+
     def __clean_relatedevent(self, related_events):
         """
         Strip relatedevent sub content of event for lighter output.
@@ -185,23 +515,7 @@ class MISPClient:
         :return: misp event
         """
 
-        filters = ['Attribute',
-                   'ShadowAttribute',
-                   'Org',
-                   'ShadowAttribute',
-                   'SharingGroup',
-                   'sharing_group_id',
-                   'disable_correlation',
-                   'locked',
-                   'publish_timestamp',
-                   'attribute_count',
-                   'attribute_count',
-                   'analysis',
-                   'published',
-                   'distribution',
-                   'proposal_email_lock']
-
-        for filter in filters:
+        for filter in self._event_filters:
             if filter in misp_event:
                 del misp_event[filter]
 
@@ -223,38 +537,592 @@ class MISPClient:
 
         return response
 
-    def __search(self, value, type_attribute):
-        """Search method call wrapper.
+    @staticmethod
+    def __clean_attribute_event(misp_event):
+        """
+        Keeps the minimal event information attached to an attribute in attributes search mode
+
+        :param misp_event: event context of an attribute
+        :return: misp event
+        """
+        event = {key: misp_event.get(key) for key in ['id', 'info', 'date', 'uuid', 'threat_level_id']
+                 if key in misp_event}
+        event['Tag'] = [{'name': tag.get('name'), 'colour': tag.get('colour')} for tag in misp_event.get('Tag', [])]
+        event['Attribute'] = []
+        return event
+
+    @staticmethod
+    def __clean_attribute(misp_attribute):
+        """
+        Keeps the useful fields of a matching attribute in attributes search mode
+
+        :param misp_attribute: misp attribute
+        :return: misp attribute
+        """
+        attribute = {key: misp_attribute.get(key) for key in ['id', 'type', 'category', 'value', 'to_ids', 'comment',
+                                                               'timestamp'] if key in misp_attribute}
+        attribute['Tag'] = [{'name': tag.get('name'), 'colour': tag.get('colour')}
+                            for tag in misp_attribute.get('Tag', [])]
+        return attribute
+
+    def __query(self, idx, value, type_attribute, event_ids=None, with_values=False, timestamp=None):
+        """Runs a search on a MISP instance and returns the cleaned events.
+
+        In events mode, full events are fetched and stripped with __clean_event, or while parsing when streaming
+        is enabled. In attributes mode, only the
+        matching attributes are fetched, with their event context, and grouped back by event, so the response
+        stays small even for events holding thousands of attributes.
+
+        :param idx: Index of the instance
+        :param value: value or list of values to search for
+        :param type_attribute: attribute types to search for.
+        :param event_ids: restrict the search to these events
+        :param with_values: also return the normalized attribute values each event matched on
+        :param timestamp: only return the events, or attributes in attributes mode, changed since this timestamp
+        :returns: list of (event, values) tuples, values being None unless with_values is set
+        :rtype: list
+        """
+        limiter = self._limiters[idx]
+        if limiter is None:
+            return self.__send_query(self.misp_connections[idx], value, type_attribute, event_ids, with_values,
+                                     timestamp)
+
+        limiter.acquire()
+        start = time.perf_counter()
+        overloaded = False
+        try:
+            return self.__send_query(self.misp_connections[idx], value, type_attribute, event_ids, with_values,
+                                     timestamp)
+        except Exception as e:
+            overloaded = self.__overloaded(e)
+            raise
+        finally:
+            limiter.release(time.perf_counter() - start, overloaded)
+
+    @staticmethod
+    def __raise_errors(misp_response):
+        """Raises the errors returned by a MISP search, MISPOverloadedError for 429 and 5xx answers
+
+        :param misp_response: Response of the search
+        """
+        if isinstance(misp_response, dict) and misp_response.get('errors'):
+            errors = misp_response.get('errors')
+            if isinstance(errors, tuple) and isinstance(errors[0], int) and (errors[0] == 429 or errors[0] >= 500):
+                raise MISPOverloadedError(errors)
+            raise MISPClientError(errors)
+
+    def __send_query(self, connection, value, type_attribute, event_ids, with_values, timestamp):
+        """Sends a search to a MISP instance, see __query
+
+        :param connection: PyMISP connection
+        :rtype: list
+        """
+        instance = connection.root_url
+        if self.search_mode == 'events' and self.streaming:
+            with metrics.timer('search_http', instance=instance):
+                return list(stream_events(connection, value, type_attribute, self._event_filters, event_ids,
+                                          with_values, timestamp))
+
+        if self.search_mode == 'events':
+            with metrics.timer('search_http', instance=instance):
+                misp_response = connection.search(type_attribute=type_attribute, value=value, eventid=event_ids,
+                                                  timestamp=timestamp)
+            self.__raise_errors(misp_response)
+
+            with metrics.timer('clean', instance=instance):
+                events = []
+                for event in misp_response:
+                    # Values are collected before cleaning, which drops the attributes
+                    values = self.__event_values(event['Event']) if with_values else None
+                    events.append((self.__clean_event(event['Event']), values))
+                return events
+
+        # The limit is shared by all the values of a batch, pages are fetched until one comes back short so the
+        # attributes of a frequent value do not push the others out
+        misp_attributes = []
+        page = 1
+        while True:
+            with metrics.timer('search_http', instance=instance):
+                misp_response = connection.search(controller='attributes', type_attribute=type_attribute,
+                                                  value=value, eventid=event_ids, include_context=True,
+                                                  limit=self.search_limit, page=page if self.search_limit else None,
+                                                  timestamp=timestamp)
+            self.__raise_errors(misp_response)
+
+            attributes = misp_response.get('Attribute', [])
+            misp_attributes.extend(attributes)
+            if not self.search_limit or len(attributes) < self.search_limit:
+                break
+            page += 1
+
+        with metrics.timer('clean', instance=instance):
+            events = {}
+            for misp_attribute in misp_attributes:
+                event_id = misp_attribute.get('event_id')
+                if event_id not in events:
+                    events[event_id] = (self.__clean_attribute_event(misp_attribute.get('Event', {})), set())
+
+                events[event_id][0]['Attribute'].append(self.__clean_attribute(misp_attribute))
+                if with_values:
+                    events[event_id][1].update(attribute_values(misp_attribute.get('value', '')))
+
+            return [(event, values if with_values else None) for event, values in events.values()]
+
+    def __instance_name(self, idx):
+        """Returns the name of the MISP instance idx
+
+        :param idx: Index of the instance
+        :rtype: str
+        """
+        # Fixes #94
+        if isinstance(self.misp_name, list):
+            return self.misp_name[idx]
+        return self.misp_name
+
+    def __index_lookup(self, idx, category, value):
+        """Returns the ids of the events of the instance idx containing a value, according to the local index
+
+        :param idx: Index of the instance
+        :param category: Search category
+        :param value: Searched value
+        :returns: set of event ids, or None if the local index cannot answer
+        :rtype: [set, None]
+        """
+        if not self._indexes or category is None:
+            return None
+        return self._indexes[idx].lookup(category, value)
+
+    def __filtered_out(self, idx, category, value):
+        """Returns True if the prefilter of the instance idx knows the value is absent
+
+        :param idx: Index of the instance
+        :param category: Search category
+        :param value: Searched value
+        :rtype: bool
+        """
+        if not self._prefilters or category is None:
+            return False
+        return not self._prefilters[idx].might_contain(value)
+
+    def __search_instance(self, idx, value, type_attribute, category=None, request=None):
+        """Searches a single MISP instance. Errors are reported in the result entry instead of being raised, so
+        that a failing instance does not hide the results of the others. When the local index or the prefilter
+        knows the value is absent, the instance is not queried at all; when the index knows it is present, the
+        search is restricted to the events containing it. When the value was searched recently, only the events
+        changed since then are fetched and merged into the previous result.
+
+        :param idx: Index of the instance
+        :param value: value to search for.
+        :param type_attribute: attribute types to search for.
+        :param category: search category
+        :param request: AbandonableRequest when a fan-out caller may stop waiting for the search
+        :rtype: dict
+        """
+        connection = self.misp_connections[idx]
+        entry = {'url': connection.root_url,
+                 'name': self.__instance_name(idx),
+                 'result': []}
+
+        event_ids = self.__index_lookup(idx, category, value)
+        if (event_ids is not None and not event_ids) or self.__filtered_out(idx, category, value):
+            return entry
+
+        if not self.__allowed(idx):
+            entry['error'] = self.__unavailable_error(idx)
+            return entry
+
+        delta_key = (connection.root_url, category, normalize_value(value))
+        previous = self._delta.get(delta_key) if self._delta is not None and category is not None else None
+        started_at = time.time()
+
+        try:
+            with metrics.timer('search', instance=connection.root_url):
+                if previous is None:
+                    events = self.__query(idx, value, type_attribute, sorted(event_ids) if event_ids else None)
+                    entry['result'] = [event for event, _ in events]
+                    full_at = started_at
+                else:
+                    checked_at, full_at, previous_events = previous
+                    events = self.__query(idx, value, type_attribute, sorted(event_ids) if event_ids else None,
+                                          timestamp=int(checked_at - self._delta_margin))
+                    entry['result'] = merge_events(previous_events, [event for event, _ in events])
+
+            if self._delta is not None and category is not None:
+                self._delta.set(delta_key, started_at, full_at, entry['result'])
+
+        except MISPClientError as e:
+            entry['error'] = str(e)
+
+        except Exception as e:
+            entry['error'] = f'{type(e).__name__}: {e}'
+
+        # A search answered after the caller gave up is a timeout for the breaker
+        abandoned = request is not None and not request.finish()
+        self.__record_outcome(idx, failed='error' in entry or abandoned)
+        if entry.get('error'):
+            metrics.increment('misp_search_errors_total', instance=connection.root_url)
+
+        return entry
+
+    def __cache_get(self, idx, category, value):
+        """Returns the cached result entry of a value on the instance idx, or None
+
+        :param idx: Index of the instance
+        :param category: Search category
+        :param value: Searched value
+        :rtype: [dict, None]
+        """
+        if self.cache is None or category is None:
+            return None
+        return self.cache.get((self.misp_connections[idx].root_url, category, normalize_value(value)))
+
+    def __cache_set(self, idx, category, value, entry):
+        """Caches the result entry of a value on the instance idx
+
+        :param idx: Index of the instance
+        :param category: Search category
+        :param value: Searched value
+        :param entry: Result entry
+        """
+        if self.cache is None or category is None:
+            return
+        self.cache.set((self.misp_connections[idx].root_url, category, normalize_value(value)), entry)
+
+    def __warninglisted(self, category, value):
+        """Returns the result entries of a value held by a warninglist, or None. The instances are not queried,
+        each entry holds the names of the matching warninglists instead.
+
+        :param category: Search category
+        :param value: Searched value
+        :rtype: [list, None]
+        """
+        if self._warninglists is None or category is None:
+            return None
+
+        warninglists = self._warninglists.match(category, value)
+        if not warninglists:
+            return None
+
+        metrics.increment('misp_warninglist_hits_total', category=category)
+        return [{'url': connection.root_url,
+                 'name': self.__instance_name(idx),
+                 'result': [],
+                 'warninglists': warninglists} for idx, connection in enumerate(self.misp_connections)]
+
+    def __with_local_matches(self, category, value, results):
+        """Adds to the result entries of a value its matches in the local indexes of each instance: the networks
+        holding an IP, and the hashes similar to a fuzzy hash. Entries are copied, as they can be shared with the
+        cache.
+
+        :param category: Search category
+        :param value: Searched value, not normalized as ssdeep hashes are case-sensitive
+        :param results: Result entries, in the order of the instances
+        :rtype: list
+        """
+        if category == 'ip' and self._network_indexes:
+            key, indexes, metric = 'networks', self._network_indexes, 'misp_network_hits_total'
+        elif category == 'hash' and self._fuzzy_indexes:
+            key, indexes, metric = 'similar_hashes', self._fuzzy_indexes, 'misp_similar_hash_hits_total'
+        else:
+            return results
+
+        entries = []
+        for idx, entry in enumerate(results):
+            if key == 'networks':
+                matches = indexes[idx].lookup_networks(value)
+            else:
+                matches = indexes[idx].lookup_similar(
+                    value, ssdeep_threshold=int(self._fuzzy_index_config.get('ssdeep_threshold', 60)),
+                    tlsh_threshold=int(self._fuzzy_index_config.get('tlsh_threshold', 40)))
+            if matches:
+                metrics.increment(metric, instance=self.misp_connections[idx].root_url)
+                entry = dict(entry, **{key: matches})
+            entries.append(entry)
+
+        return entries
+
+    def __search(self, value, type_attribute, category=None):
+        """Search method call wrapper. Instances having the value in cache are not queried. When fan-out is
+        enabled, the remaining MISP instances are queried concurrently. An instance which does not answer within
+        its timeout gets an entry with an empty result and an error marker, while the results of the others are
+        returned as usual. Results keep the order of the instances. Concurrent searches of the same value share
+        the queries of the first one, and values held by a warninglist are not searched at all. IPs are also
+        matched against the networks of the local network indexes, and fuzzy hashes against the hashes of the
+        local similarity indexes.
 
         :param value: value to search for.
         :type value: str
         :param type_attribute: attribute types to search for.
         :type type_attribute: [list, none]
+        :param category: search category, used as part of the cache key
+        :type category: [str, none]
         """
-        results = []
         if not value:
             raise EmptySearchtermError
-        for idx, connection in enumerate(self.misp_connections):
-            misp_response = connection.search(type_attribute=type_attribute, value=value)
 
-            # Fixes #94
-            if isinstance(self.misp_name, list):
-                name = self.misp_name[idx]
-            else:
-                name = self.misp_name
+        if category is None:
+            return self.__search_instances(value, type_attribute)
+
+        results = self.__warninglisted(category, value)
+        if results is None:
+            results = self._inflight.do((category, normalize_value(value)), self.__search_instances, value,
+                                        type_attribute, category)
+
+        return self.__with_local_matches(category, value, results)
+
+    def __search_instances(self, value, type_attribute, category=None):
+        """Searches a value on all the MISP instances, see __search
+
+        :param value: value to search for.
+        :param type_attribute: attribute types to search for.
+        :param category: search category
+        :rtype: list
+        """
+        results = [self.__cache_get(idx, category, value) for idx in range(len(self.misp_connections))]
+        pending = [idx for idx, entry in enumerate(results) if entry is None]
+
+        if self._executor is None or len(pending) < 2:
+            for idx in pending:
+                results[idx] = self.__search_instance(idx, value, type_attribute, category)
+                self.__cache_set(idx, category, value, results[idx])
+            return results
 
-            results.append({'url': connection.root_url,
-                            'name': name,
-                            'result': self.__clean(misp_response)})
+        start = time.monotonic()
+        requests = {idx: AbandonableRequest() for idx in pending}
+        futures = {idx: self._executor.submit(self.__search_instance, idx, value, type_attribute, category,
+                                              requests[idx])
+                   for idx in pending}
+
+        for idx, future in futures.items():
+            timeout = self._timeouts[idx]
+            remaining = None if timeout is None else max(0.0, start + timeout - time.monotonic())
+            try:
+                results[idx] = future.result(timeout=remaining)
+                self.__cache_set(idx, category, value, results[idx])
+
+            except FutureTimeoutError:
+                if not self.__give_up(idx, future, requests[idx]):
+                    results[idx] = future.result()
+                    self.__cache_set(idx, category, value, results[idx])
+                    continue
+                results[idx] = self.__timeout_entry(idx, timeout)
         return results
 
+    def __give_up(self, idx, future, request):
+        """Stops waiting for a fan-out search of the instance idx which did not answer in time. A search which
+        did not start is cancelled and recorded as a failure to the circuit breaker, a running one is recorded as
+        a failure by its worker when it ends.
+
+        :param idx: Index of the instance
+        :param future: Future of the search
+        :param request: AbandonableRequest of the search
+        :returns: False if the search finished meanwhile, its result can be used
+        :rtype: bool
+        """
+        if future.cancel():
+            request.abandon()
+            self.__record_outcome(idx, failed=True)
+            return True
+        return request.abandon()
+
+    def __timeout_entry(self, idx, timeout):
+        """Returns the result entry of an instance which did not answer within its timeout
+
+        :param idx: Index of the instance
+        :param timeout: Timeout in seconds
+        :rtype: dict
+        """
+        metrics.increment('misp_search_timeouts_total', instance=self.misp_connections[idx].root_url)
+        return {'url': self.misp_connections[idx].root_url,
+                'name': self.__instance_name(idx),
+                'result': [],
+                'error': f'Timeout after {timeout}s'}
+
+    @staticmethod
+    def __event_values(misp_event):
+        """Returns the normalized values of all the attributes of an event, including object attributes. Composite
+        values such as domain|ip are also split, as MISP matches them on each part.
+
+        :param misp_event: misp event
+        :rtype: set
+        """
+        attributes = list(misp_event.get('Attribute', []))
+        for misp_object in misp_event.get('Object', []):
+            attributes.extend(misp_object.get('Attribute', []))
+
+        values = set()
+        for attribute in attributes:
+            value = attribute.get('value')
+            if not value:
+                continue
+            values.add(normalize_value(value))
+            if '|' in value:
+                values.update(normalize_value(part) for part in value.split('|'))
+
+        return values
+
+    def __search_instance_batch(self, idx, values, type_attribute, category, request=None):
+        """Searches several values at once on a single MISP instance. Cached values and values the local index
+        or the prefilter know are absent are not queried, the others are sent in chunks of batch_size and the
+        returned events are mapped back to the values they contain.
+
+        :param idx: Index of the instance
+        :param values: normalized values to search for
+        :param type_attribute: attribute types to search for.
+        :param category: search category, used as part of the cache key
+        :param request: AbandonableRequest when a fan-out caller may stop waiting for the search
+        :returns: dict of value -> result entry
+        :rtype: dict
+        """
+        connection = self.misp_connections[idx]
+        entries = {}
+        missing = []
+        event_ids = {}
+        for value in values:
+            entries[value] = self.__cache_get(idx, category, value)
+            if entries[value] is None:
+                entries[value] = {'url': connection.root_url,
+                                  'name': self.__instance_name(idx),
+                                  'result': []}
+                event_ids[value] = self.__index_lookup(idx, category, value)
+                missing.append(value)
+
+        queried = [value for value in missing
+                   if (event_ids[value] is None or event_ids[value]) and not self.__filtered_out(idx, category, value)]
+        started_at = time.time()
+        for chunk in chunks(queried, self.batch_size):
+            if request is not None and request.abandoned:
+                # The caller gave up, the remaining chunks are not sent
+                for value in chunk:
+                    entries[value]['error'] = 'Search abandoned after timeout'
+                continue
+
+            if not self.__allowed(idx):
+                for value in chunk:
+                    entries[value]['error'] = self.__unavailable_error(idx)
+                continue
+
+            try:
+                chunk_event_ids = None
+                if all(event_ids[value] for value in chunk):
+                    chunk_event_ids = sorted(set().union(*(event_ids[value] for value in chunk)))
+
+                chunk_values = set(chunk)
+                for event, values in self.__query(idx, chunk, type_attribute, chunk_event_ids, with_values=True):
+                    for value in values & chunk_values:
+                        entries[value]['result'].append(event)
+                # A chunk answered after the caller gave up is a timeout for the breaker
+                self.__record_outcome(idx, failed=request is not None and request.abandoned)
+
+            except Exception as e:
+                self.__record_outcome(idx, failed=True)
+                for value in chunk:
+                    entries[value]['error'] = f'{type(e).__name__}: {e}'
+
+        if request is not None:
+            request.finish()
+
+        for value in missing:
+            self.__cache_set(idx, category, value, entries[value])
+
+        # Batched searches are full searches, later single searches of these values can be delta searches
+        if self._delta is not None:
+            for value in queried:
+                if not entries[value].get('error'):
+                    self._delta.set((connection.root_url, category, value), started_at, started_at,
+                                    entries[value]['result'])
+
+        return entries
+
+    def __search_instances_batch(self, values, type_attribute, category):
+        """Searches several values on all the MISP instances concurrently. Each chunk of values is a request of its
+        own, so an instance gets its timeout once per chunk. An instance which does not answer in time gets an
+        error entry for each value, or its cached entry when there is one.
+
+        :param values: normalized values to search for
+        :param type_attribute: attribute types to search for.
+        :param category: search category
+        :returns: list of dict of value -> result entry, in the order of the instances
+        :rtype: list
+        """
+        start = time.monotonic()
+        requests_count = len(list(chunks(values, self.batch_size)))
+        requests = [AbandonableRequest() for _ in self.misp_connections]
+        futures = {idx: self._executor.submit(self.__search_instance_batch, idx, values, type_attribute, category,
+                                              requests[idx])
+                   for idx in range(len(self.misp_connections))}
+
+        instances = []
+        for idx, future in futures.items():
+            timeout = self._timeouts[idx] * requests_count if self._timeouts[idx] is not None else None
+            remaining = None if timeout is None else max(0.0, start + timeout - time.monotonic())
+            try:
+                instances.append(future.result(timeout=remaining))
+
+            except FutureTimeoutError:
+                if not self.__give_up(idx, future, requests[idx]):
+                    instances.append(future.result())
+                    continue
+                entry = self.__timeout_entry(idx, timeout)
+                instances.append({value: self.__cache_get(idx, category, value) or dict(entry) for value in values})
+        return instances
+
+    def search_batch(self, category, searchterms):
+        """Search for several values of the same category with multi-value queries. Instead of one query per
+        value and instance, values are sent in chunks of batch_size. Values already being searched by another
+        thread are not queried again, their results are shared. Values held by a warninglist are not queried.
+
+        :param category: Search category, see _mispcategorytypes
+        :type category: str
+        :param searchterms: values to search for
+        :type searchterms: list
+        :returns: dict of normalized value -> result list, in the same format as the search_* methods
+        :rtype: dict
+        """
+        # Local matches are looked up with the original values, as ssdeep hashes are case-sensitive
+        originals = {normalize_value(v): str(v).strip() for v in searchterms if v}
+        values = sorted(originals)
+        if not values:
+            return {}
+
+        results = {}
+        for value in values:
+            warninglisted = self.__warninglisted(category, value)
+            if warninglisted is not None:
+                results[value] = warninglisted
+
+        type_attribute = self._mispcategorytypes(category)
+        owned, waiting = self._inflight.claim([(category, value) for value in values if value not in results])
+        queried = [value for _, value in owned]
+
+        try:
+            if queried and self._executor is None:
+                instances = [self.__search_instance_batch(idx, queried, type_attribute, category)
+                             for idx in range(len(self.misp_connections))]
+            elif queried:
+                instances = self.__search_instances_batch(queried, type_attribute, category)
+            else:
+                instances = []
+
+            results.update({value: [entries[value] for entries in instances] for value in queried})
+        except BaseException as e:
+            self._inflight.resolve(owned, exception=e)
+            raise
+
+        self._inflight.resolve(owned, results={(category, value): results[value] for value in queried})
+        for (_, value), future in waiting.items():
+            results[value] = future.result()
+
+        return {value: self.__with_local_matches(category, originals[value], result)
+                for value, result in results.items()}
+
     def search_url(self, searchterm):
         """Search for URLs
         
         :type searchterm: str
         :rtype: list
         """
-        return self.__search(type_attribute=self.__mispurltypes(), value=searchterm)
+        return self.__search(type_attribute=self.__mispurltypes(), value=searchterm, category='url')
 
     def search_hash(self, searchterm):
         """Search for hashes
@@ -262,7 +1130,7 @@ class MISPClient:
         :type searchterm: str
         :rtype: list
         """
-        return self.__search(type_attribute=self.__misphashtypes(), value=searchterm)
+        return self.__search(type_attribute=self.__misphashtypes(), value=searchterm, category='hash')
 
     def search_domain(self, searchterm):
         """Search for domains
@@ -270,7 +1138,7 @@ class MISPClient:
         :type searchterm: str
         :rtype: list
         """
-        return self.__search(type_attribute=self.__mispdomaintypes(), value=searchterm)
+        return self.__search(type_attribute=self.__mispdomaintypes(), value=searchterm, category='domain')
 
     def search_mail(self, searchterm):
         """Search for emails
@@ -278,7 +1146,7 @@ class MISPClient:
         :type searchterm: str
         :rtype: list
         """
-        return self.__search(type_attribute=self.__mispmailtypes(), value=searchterm)
+        return self.__search(type_attribute=self.__mispmailtypes(), value=searchterm, category='mail')
 
     def search_ip(self, searchterm):
         """Search for ips
@@ -286,7 +1154,7 @@ class MISPClient:
         :type searchterm: str
         :rtype: list
         """
-        return self.__search(type_attribute=self.__mispiptypes(), value=searchterm)
+        return self.__search(type_attribute=self.__mispiptypes(), value=searchterm, category='ip')
 
     def search_registry(self, searchterm):
         """Search for registry keys and values
@@ -294,7 +1162,7 @@ class MISPClient:
         :type searchterm: str
         :rtype: list
         """
-        return self.__search(type_attribute=self.__mispregistrytypes(), value=searchterm)
+        return self.__search(type_attribute=self.__mispregistrytypes(), value=searchterm, category='registry')
 
     def search_filename(self, searchterm):
         """Search for filenames
@@ -302,7 +1170,7 @@ class MISPClient:
         :type searchterm: str
         :rtype: list
         """
-        return self.__search(type_attribute=self.__mispfilenametypes(), value=searchterm)
+        return self.__search(type_attribute=self.__mispfilenametypes(), value=searchterm, category='filename')
 
     def search_ja3(self, searchterm):
         """Search for JA3
@@ -310,7 +1178,7 @@ class MISPClient:
         :type searchterm: str
         :rtype: list
         """
-        return self.__search(type_attribute=self._mispja3types(), value=searchterm)
+        return self.__search(type_attribute=self._mispja3types(), value=searchterm, category='ja3')
 
     def searchall(self, searchterm):
         """Search through all attribute types, this could be really slow.
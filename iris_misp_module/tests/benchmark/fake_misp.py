@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+#
+#  IRIS MISP Module Source Code
+#  contact@dfir-iris.org
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeMISPHandler(BaseHTTPRequestHandler):
+    """
+    Answers the few MISP API endpoints used by the module. Searched values are hits or misses depending on their
+    hash, so results are the same from one run to the other.
+    """
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, Nagle's algorithm would delay every response by the delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if 'getVersion' in self.path or 'getPyMISPVersion' in self.path:
+            return self._send({'version': '2.4.187'})
+        if 'users/view/me' in self.path:
+            return self._send({'User': {'id': 1, 'email': 'admin@admin.test'}, 'Role': {'id': 1, 'name': 'admin'},
+                               'UserSetting': []})
+        return self._send({})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        query = json.loads(self.rfile.read(length) or b'{}')
+        server = self.server
+        with server.lock:
+            server.request_count += 1
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        values = query.get('value') or []
+        values = values if isinstance(values, list) else [values]
+        hits = [value for value in values if server.is_hit(value)]
+
+        if 'attributes/restSearch' in self.path:
+            if query.get('page', 1) > 1:
+                hits = []
+            return self._send({'response': {'Attribute': [attribute for value in hits
+                                                          for attribute in server.attributes(value)]}})
+
+        return self._send({'response': [{'Event': event} for value in hits for event in server.events(value)]})
+
+
+class FakeMISPServer(ThreadingHTTPServer):
+    """
+    Local stand-in for a MISP instance, listening on a random port of the loopback interface
+
+    :param latency: Time in seconds spent before answering each search
+    :param hit_ratio: Ratio of the searched values found in the fake instance
+    :param events_per_hit: Number of events returned for a value found
+    :param attributes_per_event: Number of attributes of each returned event
+    :param attribute_size: Size in bytes of the comment of each attribute, to tune the response size
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, hit_ratio=0.2, events_per_hit=3, attributes_per_event=20, attribute_size=64):
+        super().__init__(('127.0.0.1', 0), FakeMISPHandler)
+        self.latency = latency
+        self.hit_ratio = hit_ratio
+        self.events_per_hit = events_per_hit
+        self.attributes_per_event = attributes_per_event
+        self.attribute_size = attribute_size
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def is_hit(self, value):
+        digest = hashlib.md5(str(value).encode()).digest()
+        return int.from_bytes(digest[:4], 'little') / 2 ** 32 < self.hit_ratio
+
+    def _event_ids(self, value):
+        return [str(int(hashlib.md5(f'{value}{i}'.encode()).hexdigest()[:6], 16))
+                for i in range(self.events_per_hit)]
+
+    @staticmethod
+    def _matching_attribute(value, event_id):
+        return {'id': f'{event_id}0', 'event_id': event_id, 'type': 'ip-dst', 'category': 'Network activity',
+                'value': value, 'to_ids': True, 'timestamp': '1700000000', 'comment': '', 'Tag': []}
+
+    def attributes(self, value):
+        """
+        Returns the attributes matching a value, as in an attributes search with their event context
+        """
+        return [dict(self._matching_attribute(value, event_id),
+                     Event={'id': event_id, 'info': f'Event {event_id}', 'date': '2024-01-01',
+                            'threat_level_id': '2', 'Tag': [{'name': 'tlp:green', 'colour': '#33FF00'}]})
+                for event_id in self._event_ids(value)]
+
+    def events(self, value):
+        """
+        Returns the events matching a value, with attributes_per_event attributes each
+        """
+        events = []
+        for event_id in self._event_ids(value):
+            attributes = [self._matching_attribute(value, event_id)]
+            attributes.extend({'id': f'{event_id}{i}', 'event_id': event_id, 'type': 'text', 'category': 'Other',
+                               'value': f'filler {i}', 'to_ids': False, 'timestamp': '1700000000',
+                               'comment': 'x' * self.attribute_size, 'Tag': []}
+                              for i in range(1, self.attributes_per_event))
+            events.append({'id': event_id, 'info': f'Event {event_id}', 'date': '2024-01-01',
+                           'threat_level_id': '2', 'timestamp': '1700000000', 'Org': {'name': 'ORG'},
+                           'Orgc': {'name': 'ORG'}, 'Tag': [{'name': 'tlp:green', 'colour': '#33FF00'}],
+                           'Attribute': attributes, 'Object': [], 'RelatedEvent': []})
+        return events
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='fake_misp', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
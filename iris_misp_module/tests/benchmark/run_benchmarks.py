@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+#
+#  IRIS MISP Module Source Code
+#  contact@dfir-iris.org
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+Offline benchmarks of the MISP module, run against local fake MISP instances.
+
+Each scenario is run for every combination of batch size and number of instances, and reports its throughput,
+latency percentiles and peak memory as JSON, so results of two versions can be compared:
+
+    python -m iris_misp_module.tests.benchmark.run_benchmarks --sizes 1,100,10000 --instances 1,3,5 \\
+        --output benchmark.json
+
+Scenarios:
+
+- client_search: one MISPClient.search_ip call per value, latency per search
+- client_batch: a single MISPClient.search_batch call, latency of the whole batch
+- handler: MispHandler.prefetch_reports then handle_ioc per IOC, latency per IOC
+- interface: IrisMISPInterface._handle_ioc on the whole batch, latency per IOC
+
+The IRIS database is not involved: attribute writes are replaced by an assignment on stand-in IOC objects.
+"""
+import argparse
+import gc
+import json
+import logging
+import platform
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+from unittest import mock
+
+from iris_misp_module.tests.benchmark.fake_misp import FakeMISPServer
+
+log = logging.getLogger('misp_benchmark')
+
+
+def _install_app_mock():
+    """
+    Makes the IRIS application importable outside of IRIS, as the handler imports its attribute helpers
+    """
+    try:
+        import app.datamgmt.manage.manage_attribute_db  # noqa: F401
+    except ImportError:
+        app_mock = mock.MagicMock()
+        for name in ['app', 'app.datamgmt', 'app.datamgmt.manage', 'app.datamgmt.manage.manage_attribute_db']:
+            sys.modules[name] = app_mock
+
+
+def _write_attribute(ioc, tab_name, field_name, field_type, field_value):
+    ioc.custom_attributes = {tab_name: {field_name: {'type': field_type, 'value': field_value}}}
+
+
+def percentile(samples, ratio):
+    """
+    Returns the nearest-rank percentile of samples
+
+    :param samples: Sorted list of samples
+    :param ratio: Percentile, between 0 and 1
+    :return: float
+    """
+    if not samples:
+        return None
+    rank = max(0, min(len(samples) - 1, round(ratio * len(samples) + 0.5) - 1))
+    return samples[rank]
+
+
+def make_iocs(count, prefix):
+    """
+    Returns stand-in IOC objects of type ip-dst, with values unique to the prefix so caches do not interfere
+
+    :param count: Number of IOCs
+    :param prefix: First octet of the IP addresses
+    :return: list
+    """
+    return [SimpleNamespace(ioc_id=i, ioc_value=f'{prefix}.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}',
+                            ioc_type=SimpleNamespace(type_name='ip-dst'), ioc_tags='', custom_attributes={})
+            for i in range(count)]
+
+
+def module_config(servers):
+    """
+    Returns the default module configuration, pointed at the fake instances and without cache
+
+    :param servers: List of FakeMISPServer
+    :return: dict
+    """
+    import iris_misp_module.IrisMISPConfig as interface_conf
+
+    config = {param['param_name']: param['default'] for param in interface_conf.module_configuration}
+    config['misp_config'] = json.dumps({'name': [f'fake_{i}' for i in range(len(servers))],
+                                        'type': 'public',
+                                        'url': [server.url for server in servers],
+                                        'key': ['benchmark'] * len(servers),
+                                        'ssl': [False] * len(servers)})
+    config['misp_cache_enabled'] = False
+    return config
+
+
+def scenario_client_search(servers, iocs, samples):
+    from iris_misp_module.misp_handler.mispclient import MISPClient
+
+    client = MISPClient(url=[server.url for server in servers], key=['benchmark'] * len(servers),
+                        ssl=[False] * len(servers), name=[f'fake_{i}' for i in range(len(servers))])
+    try:
+        for ioc in iocs:
+            start = time.perf_counter()
+            client.search_ip(ioc.ioc_value)
+            samples.append(time.perf_counter() - start)
+    finally:
+        client.close()
+
+
+def scenario_client_batch(servers, iocs, samples):
+    from iris_misp_module.misp_handler.mispclient import MISPClient
+
+    client = MISPClient(url=[server.url for server in servers], key=['benchmark'] * len(servers),
+                        ssl=[False] * len(servers), name=[f'fake_{i}' for i in range(len(servers))])
+    try:
+        start = time.perf_counter()
+        client.search_batch('ip', [ioc.ioc_value for ioc in iocs])
+        samples.append(time.perf_counter() - start)
+    finally:
+        client.close()
+
+
+def scenario_handler(servers, iocs, samples):
+    from iris_misp_module.misp_handler import misp_handler
+
+    with mock.patch.object(misp_handler, 'add_tab_attribute_field', _write_attribute):
+        handler = misp_handler.MispHandler(mod_config=module_config(servers), logger=log)
+        handler.load_misp_instance()
+        handler.prefetch_reports(iocs)
+        for ioc in iocs:
+            start = time.perf_counter()
+            handler.handle_ioc(ioc)
+            samples.append(time.perf_counter() - start)
+
+
+def scenario_interface(servers, iocs, samples):
+    from iris_misp_module.IrisMISPInterface import IrisMISPInterface
+    from iris_misp_module.misp_handler import misp_handler
+
+    # The module is not registered in IRIS, so only the attributes used by the hook handlers are set
+    interface = IrisMISPInterface.__new__(IrisMISPInterface)
+    interface.log = log
+    interface.message_queue = []
+    interface._dict_conf = module_config(servers)
+
+    handle_ioc_element = interface._handle_ioc_element
+
+    def timed_handle_ioc_element(handler, element):
+        start = time.perf_counter()
+        status = handle_ioc_element(handler, element)
+        samples.append(time.perf_counter() - start)
+        return status
+
+    interface._handle_ioc_element = timed_handle_ioc_element
+    with mock.patch.object(misp_handler, 'add_tab_attribute_field', _write_attribute):
+        interface._handle_ioc(data=iocs)
+
+
+SCENARIOS = {
+    'client_search': scenario_client_search,
+    'client_batch': scenario_client_batch,
+    'handler': scenario_handler,
+    'interface': scenario_interface
+}
+
+
+def run_scenario(name, servers, size, instances, run_id, measure_memory):
+    """
+    Runs a scenario and returns its measures
+
+    :param name: Scenario name
+    :param servers: Fake instances used by the scenario
+    :param size: Number of IOCs
+    :param instances: Number of instances
+    :param run_id: Unique number of the run, used to generate values not seen before
+    :param measure_memory: Also run the scenario under tracemalloc to measure its peak memory
+    :return: dict
+    """
+    result = {'scenario': name, 'iocs': size, 'instances': instances}
+    requests_before = sum(server.request_count for server in servers)
+    samples = []
+
+    gc.collect()
+    start = time.perf_counter()
+    try:
+        SCENARIOS[name](servers, make_iocs(size, 1 + run_id % 223), samples)
+    except ImportError as e:
+        result['skipped'] = f'{type(e).__name__}: {e}'
+        return result
+    duration = time.perf_counter() - start
+
+    samples.sort()
+    result.update({
+        'duration': round(duration, 6),
+        'throughput': round(size / duration, 2) if duration > 0 else None,
+        'latency_p50': percentile(samples, 0.5),
+        'latency_p99': percentile(samples, 0.99),
+        'requests': sum(server.request_count for server in servers) - requests_before
+    })
+
+    if measure_memory:
+        # Separate run, tracemalloc slows allocations down too much to be enabled while timing
+        gc.collect()
+        tracemalloc.start()
+        try:
+            SCENARIOS[name](servers, make_iocs(size, 1 + (run_id + 111) % 223), [])
+            result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the IRIS MISP module')
+    parser.add_argument('--sizes', default='1,100,10000', help='Comma separated batch sizes')
+    parser.add_argument('--instances', default='1,3,5', help='Comma separated numbers of MISP instances')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma separated scenarios to run')
+    parser.add_argument('--latency', type=float, default=0.002, help='Latency in seconds of each fake search')
+    parser.add_argument('--hit-ratio', type=float, default=0.2, help='Ratio of values found in the instances')
+    parser.add_argument('--events-per-hit', type=int, default=3, help='Events returned per value found')
+    parser.add_argument('--attributes-per-event', type=int, default=20, help='Attributes per returned event')
+    parser.add_argument('--attribute-size', type=int, default=64, help='Size of each attribute comment')
+    parser.add_argument('--no-memory', action='store_true', help='Do not measure the peak memory')
+    parser.add_argument('--output', help='Write the results to this file instead of the standard output')
+    args = parser.parse_args(argv)
+
+    _install_app_mock()
+    logging.basicConfig(level=logging.WARNING)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    instance_counts = [int(count) for count in args.instances.split(',')]
+    scenarios = [name for name in args.scenarios.split(',') if name]
+    for name in scenarios:
+        if name not in SCENARIOS:
+            parser.error(f'Unknown scenario {name}')
+
+    servers = [FakeMISPServer(latency=args.latency, hit_ratio=args.hit_ratio, events_per_hit=args.events_per_hit,
+                              attributes_per_event=args.attributes_per_event,
+                              attribute_size=args.attribute_size).start()
+               for _ in range(max(instance_counts))]
+
+    results = []
+    run_id = 0
+    try:
+        for name in scenarios:
+            for instances in instance_counts:
+                for size in sizes:
+                    run_id += 1
+                    result = run_scenario(name, servers[:instances], size, instances, run_id, not args.no_memory)
+                    log.warning(f'{name} iocs={size} instances={instances}: {result.get("throughput")} IOCs/s')
+                    results.append(result)
+    finally:
+        for server in servers:
+            server.stop()
+
+    report = {
+        'environment': {'python': platform.python_version(), 'platform': platform.platform()},
+        'settings': {key: value for key, value in vars(args).items() if key != 'output'},
+        'results': results
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
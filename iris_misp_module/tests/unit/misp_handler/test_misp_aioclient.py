@@ -0,0 +1,125 @@
+from unittest import TestCase, mock, skipIf
+
+from iris_misp_module.misp_handler import misp_aioclient
+from iris_misp_module.misp_handler.misp_pool import MISPClientPool
+from iris_misp_module.misp_handler.misp_resilience import CircuitBreaker, InstanceRateLimiter
+
+
+class FakeResponse:
+    def __init__(self, body, status=200):
+        self.body = body
+        self.status = status
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+    async def json(self, content_type=None):
+        if self.status != 200:
+            raise ValueError('Expecting value: line 1 column 1 (char 0)')
+        return self.body
+
+    async def text(self):
+        return '<html>Forbidden</html>'
+
+
+class FakeSession:
+    """
+    aiohttp session answering restSearch queries with an event for the values in its hits
+    """
+    instances = []
+
+    def __init__(self, connector=None):
+        self.hits = {'evil.com': '1', '203.0.113.7': '2'}
+        self.status = 200
+        self.queries = []
+        self.closed = False
+        FakeSession.instances.append(self)
+
+    def post(self, url, json=None, **kwargs):
+        self.queries.append((url, json.get('value')))
+        event_id = self.hits.get(json.get('value'))
+        events = [{'Event': {'id': event_id, 'info': 'Campaign', 'Org': {}}}] if event_id else []
+        return FakeResponse({'response': events}, status=self.status)
+
+    async def close(self):
+        self.closed = True
+
+
+@skipIf(misp_aioclient.aiohttp is None, 'aiohttp is not installed')
+class TestAsyncMISPClient(TestCase):
+    def setUp(self) -> None:
+        FakeSession.instances = []
+        patcher = mock.patch.object(misp_aioclient.aiohttp, 'ClientSession', FakeSession)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(MISPClientPool.clear)
+        self.config = {'url': 'https://misp', 'key': 'key', 'ssl': False, 'name': 'public'}
+        self.client = mock.Mock(cache=None, _breakers=[None], _limiters=[None])
+
+    def test_run_many(self):
+        client = MISPClientPool.get_async_client(self.config, proxies={}, client=self.client)
+
+        reports = client.run_many([('domain', 'Evil.com'), ('domain', 'evil.com'), ('ip', '203.0.113.7'),
+                                   ('domain', 'benign.com')])
+
+        # Duplicate values are only searched once
+        self.assertEqual([('https://misp/events/restSearch', 'evil.com'),
+                          ('https://misp/events/restSearch', '203.0.113.7'),
+                          ('https://misp/events/restSearch', 'benign.com')], FakeSession.instances[0].queries)
+        self.assertEqual({('domain', 'evil.com'), ('ip', '203.0.113.7'), ('domain', 'benign.com')}, set(reports))
+        self.assertEqual([{'url': 'https://misp', 'name': 'public', 'result': [{'id': '1', 'info': 'Campaign'}]}],
+                         reports[('domain', 'evil.com')])
+        self.assertEqual([], reports[('domain', 'benign.com')][0]['result'])
+
+    def test_session_reused(self):
+        client = MISPClientPool.get_async_client(self.config, proxies={}, client=self.client)
+        client.run_many([('domain', 'evil.com')])
+
+        self.assertIs(client, MISPClientPool.get_async_client(self.config, proxies={}, client=self.client))
+        client.run_many([('ip', '203.0.113.7')])
+
+        self.assertEqual(1, len(FakeSession.instances))
+        self.assertEqual(2, len(FakeSession.instances[0].queries))
+
+    def test_config_change_closes_client(self):
+        client = MISPClientPool.get_async_client(self.config, proxies={}, client=self.client)
+        client.run_many([('domain', 'evil.com')])
+
+        other = MISPClientPool.get_async_client(dict(self.config, url='https://other-misp'), proxies={},
+                                                 client=self.client)
+
+        self.assertIsNot(client, other)
+        self.assertTrue(FakeSession.instances[0].closed)
+        self.assertIsNone(client._loop)
+
+    def test_error_status(self):
+        client = MISPClientPool.get_async_client(self.config, proxies={}, client=self.client)
+        client.run_many([('domain', 'benign.com')])
+        FakeSession.instances[0].status = 403
+
+        reports = client.run_many([('domain', 'evil.com')])
+
+        self.assertEqual([], reports[('domain', 'evil.com')][0]['result'])
+        self.assertEqual("(403, 'Error code 403: <html>Forbidden</html>')", reports[('domain', 'evil.com')][0]['error'])
+
+    def test_shared_breaker_and_limiter(self):
+        breaker = CircuitBreaker('https://misp', failure_threshold=2, cooldown=60)
+        limiter = InstanceRateLimiter('https://misp', max_concurrency=4)
+        self.client._breakers, self.client._limiters = [breaker], [limiter]
+        client = MISPClientPool.get_async_client(self.config, proxies={}, client=self.client)
+        client.run_many([('domain', 'benign.com')])
+        FakeSession.instances[0].status = 503
+
+        client.run_many([('domain', 'evil.com')])
+        client.run_many([('ip', '203.0.113.7')])
+        reports = client.run_many([('domain', 'other.com')])
+
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+        self.assertTrue(reports[('domain', 'other.com')][0]['error'].startswith('Instance unavailable'))
+        self.assertEqual(3, len(FakeSession.instances[0].queries))
+        # Overloaded answers halve the concurrency limit, once per latency
+        self.assertLess(limiter.concurrency.limit, 4)
+        self.assertEqual(0, limiter.concurrency._in_flight)
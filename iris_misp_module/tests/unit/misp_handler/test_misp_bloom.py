@@ -0,0 +1,32 @@
+from unittest import TestCase
+
+from iris_misp_module.misp_handler.misp_bloom import BloomFilter
+
+
+class TestBloomFilter(TestCase):
+    def test_no_false_negative(self):
+        bloom_filter = BloomFilter(capacity=1000, fp_rate=0.01)
+        values = [f'10.0.{i // 256}.{i % 256}' for i in range(1000)]
+        for value in values:
+            bloom_filter.add(value)
+
+        self.assertTrue(all(value in bloom_filter for value in values))
+
+    def test_normalized_values(self):
+        bloom_filter = BloomFilter(capacity=10)
+        bloom_filter.add('Evil.COM ')
+
+        self.assertIn('evil.com', bloom_filter)
+
+    def test_false_positive_rate(self):
+        bloom_filter = BloomFilter(capacity=5000, fp_rate=0.01)
+        for i in range(5000):
+            bloom_filter.add(f'present{i}')
+
+        false_positives = sum(f'absent{i}' in bloom_filter for i in range(5000))
+        self.assertLess(false_positives / 5000, 0.03)
+
+    def test_memory_budget(self):
+        bloom_filter = BloomFilter(capacity=1000000, fp_rate=0.001, max_bytes=1024)
+
+        self.assertEqual(1024 * 8, bloom_filter.size)
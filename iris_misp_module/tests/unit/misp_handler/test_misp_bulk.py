@@ -0,0 +1,93 @@
+import logging
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase
+
+import iris_interface.IrisInterfaceStatus as InterfaceStatus
+
+from iris_misp_module.misp_handler.misp_bulk import MISPBulkCheckpoint, MISPBulkEnrichment
+
+
+class _Handler:
+    def __init__(self):
+        self.prefetched = []
+
+    @staticmethod
+    def get_ioc_lookups(ioc):
+        return [('ip', ioc.ioc_value)]
+
+    def prefetch_reports(self, iocs):
+        self.prefetched.append([ioc.ioc_id for ioc in iocs])
+
+    def clear_reports(self):
+        pass
+
+
+class TestMISPBulkEnrichment(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.checkpoint = MISPBulkCheckpoint(os.path.join(self.directory.name, 'checkpoint.sqlite'))
+        self.iocs = [SimpleNamespace(ioc_id=i, ioc_value=f'10.0.0.{i % 3}') for i in range(10)]
+
+    def tearDown(self):
+        self.checkpoint.close()
+        self.directory.cleanup()
+
+    def test_chunks_and_stats(self):
+        handler = _Handler()
+        job = MISPBulkEnrichment(handler, lambda misp_handler, ioc: None, logging.getLogger(), self.checkpoint,
+                                 chunk_size=4)
+        status = job.run('job', self.iocs)
+
+        self.assertEqual([4, 4, 2], [len(chunk) for chunk in handler.prefetched])
+        self.assertEqual(10, status.get_data()['iocs'])
+        self.assertEqual(3, status.get_data()['unique_values'])
+        self.assertEqual(set(), self.checkpoint.load('job'))
+
+    def test_resume(self):
+        handler = _Handler()
+        self.checkpoint.save('job', [0, 1, 2])
+        handled = []
+        job = MISPBulkEnrichment(handler, lambda misp_handler, ioc: handled.append(ioc.ioc_id), logging.getLogger(),
+                                 self.checkpoint)
+        status = job.run('job', self.iocs)
+
+        self.assertEqual(list(range(3, 10)), sorted(handled))
+        self.assertEqual(3, status.get_data()['resumed'])
+
+    def test_unique_values_normalized(self):
+        handler = _Handler()
+        iocs = [SimpleNamespace(ioc_id=0, ioc_value='Evil.com'), SimpleNamespace(ioc_id=1, ioc_value='10.0.0.1'),
+                SimpleNamespace(ioc_id=2, ioc_value=' evil.com'), SimpleNamespace(ioc_id=3, ioc_value='EVIL.COM')]
+        job = MISPBulkEnrichment(handler, lambda misp_handler, ioc: None, logging.getLogger(), chunk_size=3)
+        status = job.run('job', iocs)
+
+        self.assertEqual(2, status.get_data()['unique_values'])
+        # Identical values are sorted next to each other
+        self.assertEqual([[1, 0, 2], [3]], handler.prefetched)
+
+    def test_failed_iocs_retried(self):
+        handler = _Handler()
+
+        def dispatcher(misp_handler, ioc):
+            if ioc.ioc_id in (4, 7):
+                return InterfaceStatus.I2Error('MISP unavailable')
+            return InterfaceStatus.I2Success('Successfully processed IOC')
+
+        job = MISPBulkEnrichment(handler, dispatcher, logging.getLogger(), self.checkpoint, chunk_size=4)
+        status = job.run('job', self.iocs)
+
+        self.assertEqual(2, status.get_data()['failed'])
+        self.assertEqual(set(range(10)) - {4, 7}, self.checkpoint.load('job'))
+
+        handled = []
+        job = MISPBulkEnrichment(handler, lambda misp_handler, ioc: handled.append(ioc.ioc_id), logging.getLogger(),
+                                 self.checkpoint)
+        job.run('job', self.iocs)
+
+        self.assertEqual([4, 7], sorted(handled))
+        self.assertEqual(set(), self.checkpoint.load('job'))
+
+    def test_job_id(self):
+        self.assertEqual(MISPBulkEnrichment.job_id([2, 1]), MISPBulkEnrichment.job_id([1, 2]))
@@ -0,0 +1,142 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from iris_misp_module.misp_handler.misp_cache import MISPLookupCache, MISPSQLiteCache
+
+
+class TestMispLookupCache(TestCase):
+    def setUp(self) -> None:
+        self.hit = {'url': 'https://testmisp', 'name': 'public', 'result': [{'id': '1', 'info': 'event'}]}
+        self.miss = {'url': 'https://testmisp', 'name': 'public', 'result': []}
+
+    def test_get_set(self):
+        cache = MISPLookupCache()
+        key = ('https://testmisp', 'ip', '1.2.3.4')
+
+        self.assertIsNone(cache.get(key))
+        cache.set(key, self.hit)
+
+        self.assertEqual(self.hit, cache.get(key))
+        self.assertEqual(1, cache.stats().get('hits'))
+        self.assertEqual(1, cache.stats().get('misses'))
+
+    def test_error_not_cached(self):
+        cache = MISPLookupCache()
+        key = ('https://testmisp', 'ip', '1.2.3.4')
+        cache.set(key, dict(self.miss, error='Timeout after 1s'))
+
+        self.assertIsNone(cache.get(key))
+
+    def test_negative_ttl(self):
+        cache = MISPLookupCache(ttl=100, negative_ttl=10)
+        with mock.patch('iris_misp_module.misp_handler.misp_cache.time.monotonic', return_value=0):
+            cache.set('hit', self.hit)
+            cache.set('miss', self.miss)
+
+        with mock.patch('iris_misp_module.misp_handler.misp_cache.time.monotonic', return_value=50):
+            self.assertEqual(self.hit, cache.get('hit'))
+            self.assertIsNone(cache.get('miss'))
+
+    def test_lru_eviction(self):
+        cache = MISPLookupCache(max_entries=2)
+        cache.set('a', self.hit)
+        cache.set('b', self.hit)
+        cache.get('a')
+        cache.set('c', self.hit)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(self.hit, cache.get('a'))
+        self.assertEqual(1, cache.stats().get('evictions'))
+
+    def test_max_bytes(self):
+        cache = MISPLookupCache(max_bytes=200)
+        cache.set('a', self.hit)
+        cache.set('b', self.hit)
+        cache.set('c', self.hit)
+
+        self.assertLessEqual(cache.stats().get('bytes'), 200)
+        self.assertIsNone(cache.get('a'))
+
+
+class TestMispSQLiteCache(TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'misp_cache.db')
+        self.caches = []
+        self.hit = {'url': 'https://testmisp', 'name': 'public', 'result': [{'id': '1', 'info': 'event'}]}
+        self.miss = {'url': 'https://testmisp', 'name': 'public', 'result': []}
+
+    def tearDown(self) -> None:
+        for cache in self.caches:
+            cache._connection().close()
+        self.directory.cleanup()
+
+    def _cache(self, **kwargs):
+        cache = MISPSQLiteCache(self.path, compact_interval=1000, **kwargs)
+        self.caches.append(cache)
+        return cache
+
+    def test_get_set(self):
+        cache = self._cache()
+        key = ('https://testmisp', 'ip', '1.2.3.4')
+
+        self.assertIsNone(cache.get(key))
+        cache.set(key, self.hit)
+
+        self.assertEqual(self.hit, cache.get(key))
+        # Another worker opening the same database sees the entry
+        self.assertEqual(self.hit, self._cache().get(key))
+        self.assertEqual(1, cache.stats().get('hits'))
+        self.assertEqual(1, cache.stats().get('misses'))
+        self.assertEqual(1, cache.stats().get('entries'))
+
+    def test_error_not_cached(self):
+        cache = self._cache()
+        cache.set('key', dict(self.miss, error='Timeout after 1s'))
+
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(0, cache.stats().get('entries'))
+
+    def test_expiry(self):
+        cache = self._cache(ttl=100, negative_ttl=10)
+        with mock.patch('iris_misp_module.misp_handler.misp_cache.time.time', return_value=0):
+            cache.set('hit', self.hit)
+            cache.set('miss', self.miss)
+
+        with mock.patch('iris_misp_module.misp_handler.misp_cache.time.time', return_value=50):
+            self.assertEqual(self.hit, cache.get('hit'))
+            self.assertIsNone(cache.get('miss'))
+
+        with mock.patch('iris_misp_module.misp_handler.misp_cache.time.time', return_value=150):
+            self.assertIsNone(cache.get('hit'))
+            cache.compact()
+
+        self.assertEqual(0, cache.stats().get('entries'))
+
+    def test_compaction_evicts_least_recently_used(self):
+        cache = self._cache(max_entries=2)
+        for now, key in enumerate(['a', 'b', 'c']):
+            with mock.patch('iris_misp_module.misp_handler.misp_cache.time.time', return_value=now):
+                cache.set(key, self.hit)
+
+        with mock.patch('iris_misp_module.misp_handler.misp_cache.time.time', return_value=100):
+            cache.get('a')
+            cache.compact()
+
+            self.assertIsNone(cache.get('b'))
+            self.assertEqual(self.hit, cache.get('a'))
+            self.assertEqual(self.hit, cache.get('c'))
+        self.assertEqual(1, cache.stats().get('evictions'))
+
+    def test_max_bytes(self):
+        cache = self._cache(max_bytes=200)
+        for key in ['a', 'b', 'c']:
+            cache.set(key, self.hit)
+        cache.compact()
+
+        self.assertLessEqual(cache.stats().get('bytes'), 200)
+        self.assertIsNone(cache.get('a'))
+
+        cache.set('large', dict(self.hit, result=[{'id': '1', 'info': 'x' * 200}]))
+        self.assertIsNone(cache.get('large'))
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from iris_misp_module.misp_handler.misp_delta import MISPDeltaStore, merge_events
+
+
+class TestMergeEvents(TestCase):
+    def test_changed_and_new_events(self):
+        previous = [{'id': '1', 'info': 'old'}, {'id': '2', 'info': 'unchanged'}]
+        merged = merge_events(previous, [{'id': '1', 'info': 'new'}, {'id': '3', 'info': 'added'}])
+
+        self.assertEqual({'1': 'new', '2': 'unchanged', '3': 'added'}, {e['id']: e['info'] for e in merged})
+
+    def test_attributes_merged(self):
+        previous = [{'id': '1', 'Attribute': [{'id': '10', 'comment': 'a'}, {'id': '11', 'comment': 'b'}]}]
+        merged = merge_events(previous, [{'id': '1', 'Attribute': [{'id': '11', 'comment': 'c'}]}])
+
+        self.assertEqual({'10': 'a', '11': 'c'}, {a['id']: a['comment'] for a in merged[0]['Attribute']})
+
+
+class TestMISPDeltaStore(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'delta.sqlite')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        store = MISPDeltaStore(self.path)
+        now = time.time()
+        store.set(('https://misp', 'ip', '1.2.3.4'), now, now, [{'id': '1'}])
+
+        self.assertEqual((now, now, [{'id': '1'}]), store.get(('https://misp', 'ip', '1.2.3.4')))
+        self.assertIsNone(store.get(('https://misp', 'ip', '4.3.2.1')))
+
+    def test_full_search_due(self):
+        store = MISPDeltaStore(self.path, full_interval=60)
+        old = time.time() - 120
+        store.set(('https://misp', 'ip', '1.2.3.4'), old, old, [])
+
+        self.assertIsNone(store.get(('https://misp', 'ip', '1.2.3.4')))
+
+    def test_max_entries(self):
+        store = MISPDeltaStore(self.path, max_entries=2)
+        now = time.time()
+        for i in range(5):
+            store.set(('https://misp', 'ip', f'10.0.0.{i}'), now + i, now, [])
+        store.compact()
+
+        self.assertIsNone(store.get(('https://misp', 'ip', '10.0.0.0')))
+        self.assertIsNotNone(store.get(('https://misp', 'ip', '10.0.0.4')))
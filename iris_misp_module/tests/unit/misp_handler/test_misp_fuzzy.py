@@ -0,0 +1,95 @@
+from unittest import TestCase
+
+from iris_misp_module.misp_handler.misp_fuzzy import MISPFuzzyHashIndex, SSDeepIndex, TLSHIndex, parse_ssdeep, \
+    parse_tlsh, ssdeep_compare, tlsh_distance
+
+SSDEEP_ORIGINAL = '96:yHA7XgjygA82yXfFAYt5UYb2fIb/3vZxutCsep7huWw+EZxPalDUnneBstpatfFw:g0X4yK2OFF3b2fIb/PutCDhVw+1loneA'
+SSDEEP_MODIFIED = '96:yHA7XgjygA82yXfFAYt5UYb2fIb/3vZxuUsep7huWw+EZxPalDUnneBstpatfFrk:g0X4yK2OFF3b2fIb/PuUDhVw+1loneBO'
+SSDEEP_UNRELATED = '96:CtUb4zTJGIx2K53SkZuLsO41rkEFqrcraIQtT0IBZq/0VZtEZ3LnAaUiBPTpZ:Cu85XkASkufAOwiDTKhLnAaUiB7H'
+
+TLSH_ORIGINAL = 'T1DFC18ECF4F33396291EFA16D0CCA25F5137A12E7C9A31CD1685873E5E63400536441A8'
+TLSH_MODIFIED = 'T1BFC17DCF4B333952E2FFA1BD0D9A25F6137A12E7C9A31D95A85873E1E6240052654198'
+TLSH_UNRELATED = 'T1E6C17E7A54F3D6AFAB70C60B964A3F1DA6900DECFC09CE16B52C01DF597018B5AC1B46'
+
+
+class TestFuzzyHashComparison(TestCase):
+    def test_ssdeep_compare(self):
+        original = parse_ssdeep(SSDEEP_ORIGINAL)
+
+        self.assertEqual(100, ssdeep_compare(original, original))
+        self.assertEqual(96, ssdeep_compare(original, parse_ssdeep(SSDEEP_MODIFIED)))
+        self.assertEqual(0, ssdeep_compare(original, parse_ssdeep(SSDEEP_UNRELATED)))
+        self.assertIsNone(parse_ssdeep('d41d8cd98f00b204e9800998ecf8427e'))
+
+    def test_ssdeep_repeated_characters(self):
+        self.assertEqual((3, 'aaabc', 'x'), parse_ssdeep('3:aaaaaabc:x,"file.bin"'))
+
+    def test_tlsh_distance(self):
+        original = parse_tlsh(TLSH_ORIGINAL)
+
+        self.assertEqual(0, tlsh_distance(original, original))
+        self.assertEqual(24, tlsh_distance(original, parse_tlsh(TLSH_MODIFIED)))
+        self.assertEqual(213, tlsh_distance(original, parse_tlsh(TLSH_UNRELATED)))
+        self.assertEqual(original, parse_tlsh(TLSH_ORIGINAL[2:].lower()))
+
+
+class TestSimilarityIndexes(TestCase):
+    def test_ssdeep_index(self):
+        index = SSDeepIndex()
+        for value in [SSDEEP_ORIGINAL, SSDEEP_UNRELATED]:
+            index.add(value)
+        index.build()
+        # Added after the build, searched in the recent postings
+        index.add(SSDEEP_MODIFIED)
+
+        self.assertEqual([(SSDEEP_ORIGINAL, 100), (SSDEEP_MODIFIED, 96)], index.query(SSDEEP_ORIGINAL, 60))
+        self.assertEqual(1, index.recent)
+
+        index.build()
+        self.assertEqual(0, index.recent)
+        self.assertEqual([(SSDEEP_MODIFIED, 100), (SSDEEP_ORIGINAL, 96)], index.query(SSDEEP_MODIFIED, 60))
+
+    def test_tlsh_index(self):
+        index = TLSHIndex()
+        for value in [TLSH_ORIGINAL, TLSH_MODIFIED, TLSH_UNRELATED]:
+            index.add(value)
+
+        self.assertEqual([(TLSH_ORIGINAL, 0), (TLSH_MODIFIED, 24)], index.query(TLSH_ORIGINAL, 40))
+        self.assertEqual(3, len(index.query(TLSH_ORIGINAL, 300)))
+
+    def test_tlsh_index_wrapped_buckets(self):
+        # Q1 ratio 8 away from the original, reached by both the -8 and +8 deltas
+        shifted = TLSH_ORIGINAL[:6] + format((int(TLSH_ORIGINAL[6], 16) + 8) % 16, 'X') + TLSH_ORIGINAL[7:]
+        index = TLSHIndex()
+        index.add(shifted)
+
+        self.assertEqual([(shifted, 84)], index.query(TLSH_ORIGINAL, 96))
+
+
+class FakeConnection:
+    root_url = 'https://misp'
+
+    def __init__(self, attributes):
+        self.attributes = attributes
+
+    def search(self, **kwargs):
+        return {'Attribute': self.attributes if kwargs.get('page') == 1 else []}
+
+
+class TestMISPFuzzyHashIndex(TestCase):
+    def test_lookup_similar(self):
+        index = MISPFuzzyHashIndex(FakeConnection([
+            {'type': 'ssdeep', 'value': SSDEEP_MODIFIED, 'event_id': '1', 'timestamp': '100'},
+            {'type': 'filename|ssdeep', 'value': f'dropper.exe|{SSDEEP_ORIGINAL}', 'event_id': '2',
+             'timestamp': '100'},
+            {'type': 'tlsh', 'value': TLSH_MODIFIED, 'event_id': '3', 'timestamp': '100'}
+        ]))
+        self.assertIsNone(index.lookup_similar(SSDEEP_ORIGINAL))
+
+        index.sync()
+        self.assertEqual([{'value': SSDEEP_MODIFIED, 'type': 'ssdeep', 'score': 96, 'event_ids': [1]}],
+                         index.lookup_similar(SSDEEP_ORIGINAL))
+        self.assertEqual([{'value': TLSH_MODIFIED.lower(), 'type': 'tlsh', 'distance': 24, 'event_ids': [3]}],
+                         index.lookup_similar(TLSH_ORIGINAL))
+        self.assertEqual([], index.lookup_similar(SSDEEP_ORIGINAL, ssdeep_threshold=99))
+        self.assertIsNone(index.lookup_similar('d41d8cd98f00b204e9800998ecf8427e'))
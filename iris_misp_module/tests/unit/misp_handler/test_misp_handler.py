@@ -110,3 +110,113 @@ class TestMispHandler(TestCase):
         self.misp_handler.load_misp_instance()
 
         self.assertEqual(InterfaceStatus.I2Success(), self.misp_handler.handle_misp_domain(mock_ioc))
+
+
+def _import_handler_module():
+    app_mock = mock.Mock()
+    modules = {name: app_mock for name in ['app', 'app.datamgmt', 'app.datamgmt.manage',
+                                           'app.datamgmt.manage.manage_attribute_db']}
+    with mock.patch.dict('sys.modules', modules):
+        from iris_misp_module.misp_handler import misp_handler
+    return misp_handler
+
+
+class FakeIoc:
+    def __init__(self, type_name, value):
+        self.ioc_type = mock.Mock(type_name=type_name)
+        self.ioc_value = value
+        self.ioc_tags = ''
+        self.custom_attributes = {}
+
+
+class FakeClient:
+    def __init__(self):
+        self.results = {}
+        self.cache = None
+
+    def _search(self, value):
+        return [{'url': 'https://misp', 'name': 'misp', 'result': self.results.get(value, [])}]
+
+    search_domain = search_ip = _search
+
+
+class TestMispHandlerReports(TestCase):
+    def setUp(self) -> None:
+        self.module = _import_handler_module()
+        self.handler = self.module.MispHandler(mod_config={'misp_report_as_attribute': True,
+                                                           'misp_report_mode': 'compact'}, logger=log)
+        self.client = FakeClient()
+        self.handler.misp = {'type': 'public', 'misp': self.client}
+        self.writes = []
+
+    def _add_tab_attribute_field(self, ioc, tab_name, field_name, field_type, field_value):
+        self.writes.append(field_value)
+        ioc.custom_attributes.setdefault(tab_name, {})[field_name] = {'type': field_type, 'value': field_value}
+
+    def _handle(self, ioc):
+        self.handler.clear_reports()
+        with mock.patch.object(self.module, 'add_tab_attribute_field', self._add_tab_attribute_field):
+            return self.handler.handle_ioc(ioc)
+
+    def test_composite_ioc_single_report(self):
+        self.client.results['evil.com'] = [{'id': '1', 'info': 'Campaign', 'date': '2024-01-01'}]
+        ioc = FakeIoc('domain|ip', 'evil.com|203.0.113.7')
+
+        for _ in range(3):
+            self.assertTrue(self._handle(ioc).is_success())
+
+        self.assertEqual(1, len(self.writes))
+        self.assertIn('misp (evil.com)', self.writes[0])
+        self.assertIn('misp (203.0.113.7)', self.writes[0])
+        self.assertEqual('misp:hit', ioc.ioc_tags)
+
+    def test_composite_ioc_missing_part(self):
+        self.client.results['evil.com'] = [{'id': '1', 'info': 'Campaign', 'date': '2024-01-01'}]
+        iocs = [FakeIoc('domain|ip', 'evil.com'), FakeIoc('filename|md5', 'dropper.exe')]
+
+        self.handler.prefetch_reports(iocs)
+        self.assertEqual([('domain', 'evil.com')], list(self.handler._reports))
+
+        self.assertTrue(self._handle(iocs[0]).is_success())
+        self.assertIn('Campaign', self.writes[0])
+        self.assertNotIn('misp (evil.com)', self.writes[0])
+        self.assertTrue(self._handle(iocs[1]).is_success())
+        self.assertEqual(1, len(self.writes))
+
+    def test_hit_tag_cleared(self):
+        ioc = FakeIoc('domain', 'evil.com')
+        ioc.ioc_tags = 'apt,,misp:hit'
+
+        self._handle(ioc)
+        self.assertEqual('apt', ioc.ioc_tags)
+
+    def test_unchanged_report_skipped(self):
+        self.client.results['evil.com'] = [{'id': '1', 'info': 'Campaign', 'date': '2024-01-01'}]
+        ioc = FakeIoc('domain', 'evil.com')
+
+        self._handle(ioc)
+        self._handle(ioc)
+        self.assertEqual(1, len(self.writes))
+
+        self.client.results['evil.com'].append({'id': '2', 'info': 'Follow-up', 'date': '2024-02-01'})
+        self._handle(ioc)
+        self.assertEqual(2, len(self.writes))
+        self.assertIn('Follow-up', self.writes[1])
+
+    def test_async_disabled_with_unsupported_features(self):
+        self.client.results['evil.com'] = [{'id': '1', 'info': 'Campaign', 'date': '2024-01-01'}]
+        # Circuit breakers and limits are shared with the asynchronous client, the default configuration uses it
+        self.handler.mod_config.update({'misp_async_enabled': True, 'misp_config': '{"rate_limit": 5}'})
+
+        with mock.patch.object(self.handler, '_prefetch_reports_async') as prefetch_async:
+            self.handler.prefetch_reports([FakeIoc('domain', 'evil.com')])
+            prefetch_async.assert_called_once_with([('domain', 'evil.com')])
+
+            self.handler.clear_reports()
+            prefetch_async.reset_mock()
+            self.handler.mod_config['misp_streaming_enabled'] = True
+            self.handler.prefetch_reports([FakeIoc('domain', 'evil.com')])
+            prefetch_async.assert_not_called()
+
+        # Looked up by the MISPClient instead
+        self.assertEqual(['1'], [event['id'] for event in self.handler._reports[('domain', 'evil.com')][0]['result']])
@@ -0,0 +1,53 @@
+import threading
+import time
+from unittest import TestCase
+
+from iris_misp_module.misp_handler.misp_helper import SingleFlight
+
+
+class TestSingleFlight(TestCase):
+    def test_concurrent_calls_share_result(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        def lookup(value):
+            calls.append(value)
+            time.sleep(0.05)
+            return [value]
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(single_flight.do(('ip', '1.2.3.4'), lookup,
+                                                                                   '1.2.3.4')))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(['1.2.3.4'], calls)
+        self.assertEqual([['1.2.3.4']] * 5, results)
+
+    def test_key_released_after_call(self):
+        single_flight = SingleFlight()
+        single_flight.do('key', lambda: 1)
+
+        self.assertEqual(2, single_flight.do('key', lambda: 2))
+
+    def test_claim_waits_on_running_keys(self):
+        single_flight = SingleFlight()
+        owned, _ = single_flight.claim(['a', 'b'])
+        other_owned, waiting = single_flight.claim(['b', 'c'])
+
+        self.assertEqual({'c'}, set(other_owned))
+        self.assertEqual({'b'}, set(waiting))
+
+        single_flight.resolve(owned, results={'a': 1, 'b': 2})
+        self.assertEqual(2, waiting['b'].result(timeout=1))
+
+    def test_exception_shared(self):
+        single_flight = SingleFlight()
+        owned, _ = single_flight.claim(['a'])
+        _, waiting = single_flight.claim(['a'])
+        single_flight.resolve(owned, exception=ValueError('down'))
+
+        self.assertRaises(ValueError, waiting['a'].result, 1)
@@ -0,0 +1,93 @@
+from unittest import TestCase
+
+from iris_misp_module.misp_handler.misp_index import MISPAttributeIndex
+
+CATEGORY_TYPES = {'domain': ['domain', 'domain|ip'], 'ip': ['ip-dst', 'domain|ip']}
+
+
+class FakeConnection:
+    """
+    PyMISP connection serving attribute-level searches from a list of attributes
+    """
+    root_url = 'https://misp'
+
+    def __init__(self, attributes):
+        self.attributes = attributes
+        self.queries = []
+
+    def search(self, **kwargs):
+        self.queries.append(kwargs)
+        attributes = [attribute for attribute in self.attributes
+                      if attribute.get('type') in kwargs.get('type_attribute')
+                      and (kwargs.get('timestamp') is None or int(attribute.get('timestamp')) >= kwargs['timestamp'])
+                      and (kwargs.get('deleted') or not attribute.get('deleted'))]
+
+        start = (kwargs.get('page') - 1) * kwargs.get('limit')
+        return {'Attribute': attributes[start:start + kwargs.get('limit')]}
+
+
+class TestMISPAttributeIndex(TestCase):
+    def setUp(self) -> None:
+        self.connection = FakeConnection([
+            {'type': 'domain', 'value': 'Evil.com', 'event_id': '1', 'timestamp': '100'},
+            {'type': 'domain|ip', 'value': 'evil.com|203.0.113.7', 'event_id': '2', 'timestamp': '110'},
+            {'type': 'ip-dst', 'value': '198.51.100.1', 'event_id': '3', 'timestamp': '120'},
+            {'type': 'md5', 'value': 'd41d8cd98f00b204e9800998ecf8427e', 'event_id': '4', 'timestamp': '130'}
+        ])
+        self.index = MISPAttributeIndex(self.connection, CATEGORY_TYPES, page_size=2)
+
+    def test_lookup_before_sync(self):
+        self.assertFalse(self.index.ready)
+        self.assertIsNone(self.index.lookup('domain', 'evil.com'))
+
+    def test_full_sync(self):
+        self.assertEqual(3, self.index.sync())
+
+        self.assertTrue(self.index.ready)
+        # Two full pages and the last partial one
+        self.assertEqual([1, 2], [query.get('page') for query in self.connection.queries])
+        self.assertEqual({1, 2}, self.index.lookup('domain', ' EVIL.COM '))
+        self.assertEqual({2, 3}, {*self.index.lookup('ip', '203.0.113.7'), *self.index.lookup('ip', '198.51.100.1')})
+        self.assertEqual(set(), self.index.lookup('domain', 'benign.com'))
+        self.assertIsNone(self.index.lookup('hash', 'd41d8cd98f00b204e9800998ecf8427e'))
+        # Composite values are indexed whole and by part
+        self.assertEqual({'domain': 3, 'ip': 4}, self.index.stats())
+
+    def test_delta_sync(self):
+        self.index.sync()
+        self.connection.queries.clear()
+        self.connection.attributes.extend([
+            {'type': 'domain', 'value': 'new.com', 'event_id': '5', 'timestamp': '200'},
+            {'type': 'domain', 'value': 'evil.com', 'event_id': '6', 'timestamp': '210'}
+        ])
+
+        # The timestamp filter is inclusive, the last attribute of the previous sync is pulled again
+        self.assertEqual(3, self.index.sync())
+
+        self.assertEqual(120, self.connection.queries[0].get('timestamp'))
+        self.assertEqual([0, 1], self.connection.queries[0].get('deleted'))
+        self.assertEqual({5}, self.index.lookup('domain', 'new.com'))
+        self.assertEqual({1, 2, 6}, self.index.lookup('domain', 'evil.com'))
+
+    def test_deleted_attributes(self):
+        self.index.sync()
+        self.connection.attributes.extend([
+            {'type': 'domain', 'value': 'Evil.com', 'event_id': '1', 'timestamp': '300', 'deleted': True},
+            {'type': 'ip-dst', 'value': '198.51.100.1', 'event_id': '3', 'timestamp': '310', 'deleted': '1'},
+            {'type': 'domain', 'value': 'unknown.com', 'event_id': '7', 'timestamp': '320', 'deleted': 1}
+        ])
+
+        self.index.sync()
+
+        self.assertEqual({2}, self.index.lookup('domain', 'evil.com'))
+        self.assertEqual(set(), self.index.lookup('ip', '198.51.100.1'))
+        self.assertEqual({'domain': 3, 'ip': 3}, self.index.stats())
+
+    def test_full_sync_drops_removed_attributes(self):
+        self.index.sync()
+        del self.connection.attributes[0]
+        self.index.full_sync_interval = -1
+
+        self.index.sync()
+
+        self.assertEqual({2}, self.index.lookup('domain', 'evil.com'))
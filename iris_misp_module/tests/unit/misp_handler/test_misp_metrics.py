@@ -0,0 +1,35 @@
+from unittest import TestCase
+
+from iris_misp_module.misp_handler.misp_metrics import MISPMetrics, STAGE_DURATION
+
+
+class TestMISPMetrics(TestCase):
+    def test_histogram_buckets(self):
+        metrics = MISPMetrics(buckets=(0.1, 1.0))
+        for value in [0.05, 0.1, 0.5, 2.0]:
+            metrics.observe(STAGE_DURATION, value, stage='search', instance='https://misp')
+
+        histogram = metrics.snapshot()['histograms'][0]
+        self.assertEqual([2, 1, 1], histogram['buckets'])
+        self.assertEqual(4, histogram['count'])
+        self.assertEqual({'stage': 'search', 'instance': 'https://misp'}, histogram['labels'])
+
+    def test_summary(self):
+        metrics = MISPMetrics()
+        with metrics.timer('render', ioc_type='md5'):
+            pass
+        with metrics.timer('render', ioc_type='ip-dst'):
+            pass
+
+        self.assertEqual(2, metrics.summary()['render']['count'])
+
+    def test_prometheus(self):
+        metrics = MISPMetrics(buckets=(1.0,))
+        metrics.increment('misp_report_writes_total', outcome='skipped')
+        metrics.observe(STAGE_DURATION, 0.5, stage='clean')
+        text = metrics.prometheus()
+
+        self.assertIn('# TYPE misp_report_writes_total counter', text)
+        self.assertIn('misp_report_writes_total{outcome="skipped"} 1', text)
+        self.assertIn('misp_stage_duration_seconds_bucket{stage="clean",le="+Inf"} 1', text)
+        self.assertIn('misp_stage_duration_seconds_count{stage="clean"} 1', text)
@@ -0,0 +1,56 @@
+from unittest import TestCase
+
+from iris_misp_module.misp_handler.misp_network import CIDRIntervalIndex, MISPNetworkIndex
+
+
+class TestCIDRIntervalIndex(TestCase):
+    def test_most_specific_network(self):
+        index = CIDRIntervalIndex()
+        index.add('10.0.0.0/8', 'rfc1918')
+        index.add('10.1.0.0/16', 'cloud')
+        index.add('10.2.0.0/16', 'other')
+        index.add('2001:db8::/32', 'documentation')
+        index.build()
+
+        self.assertEqual(['cloud'], index.lookup('10.1.2.3'))
+        self.assertEqual(['rfc1918'], index.lookup('10.3.0.1'))
+        # Last interval starting before the address is a sibling, the parent holds it
+        self.assertEqual(['rfc1918'], index.lookup('10.200.0.1'))
+        self.assertEqual(['documentation'], index.lookup('2001:db8::1'))
+        self.assertIsNone(index.lookup('11.0.0.1'))
+        self.assertIsNone(index.lookup('evil.com'))
+
+    def test_all_networks(self):
+        index = CIDRIntervalIndex()
+        index.add('10.0.0.0/8', 'a')
+        index.add('10.1.0.0/16', 'b')
+        index.add('10.1.1.0/24', 'c')
+        index.build()
+
+        self.assertEqual(['c', 'b', 'a'], index.lookup_all('10.1.1.1'))
+        self.assertEqual([], index.lookup_all('8.8.8.8'))
+
+
+class FakeConnection:
+    root_url = 'https://misp'
+
+    def __init__(self, attributes):
+        self.attributes = attributes
+
+    def search(self, **kwargs):
+        return {'Attribute': self.attributes if kwargs.get('page') == 1 else []}
+
+
+class TestMISPNetworkIndex(TestCase):
+    def test_lookup_networks(self):
+        index = MISPNetworkIndex(FakeConnection([
+            {'type': 'ip-dst', 'value': '203.0.113.0/24', 'event_id': '1', 'timestamp': '100'},
+            {'type': 'ip-src', 'value': '203.0.0.0/16', 'event_id': '2', 'timestamp': '100'},
+            {'type': 'ip-dst', 'value': '203.0.113.7', 'event_id': '3', 'timestamp': '100'}
+        ]))
+        self.assertIsNone(index.lookup_networks('203.0.113.7'))
+
+        index.sync()
+        self.assertEqual([{'network': '203.0.113.0/24', 'event_ids': [1]},
+                          {'network': '203.0.0.0/16', 'event_ids': [2]}], index.lookup_networks('203.0.113.7'))
+        self.assertEqual([], index.lookup_networks('198.51.100.1'))
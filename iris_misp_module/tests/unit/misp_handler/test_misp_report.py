@@ -0,0 +1,55 @@
+from unittest import TestCase
+
+from iris_misp_module.misp_handler.misp_report import render_compact_report, report_fingerprint, summarize_report
+
+
+def _report(events):
+    return [{'name': 'MISP', 'url': 'https://misp.local/', 'result': [
+        {'id': str(i), 'info': f'<event {i}>', 'date': f'2024-01-{i % 28 + 1:02d}', 'Tag': [{'name': 'tlp:green'}],
+         'padding': 'x' * 200} for i in range(events)]}]
+
+
+class TestCompactReport(TestCase):
+    def test_summary(self):
+        summary = summarize_report(_report(30), top_events=5)
+
+        self.assertEqual(30, summary[0]['hits'])
+        self.assertEqual(5, len(summary[0]['events']))
+        self.assertEqual(25, summary[0]['hidden_events'])
+        self.assertEqual(['tlp:green'], summary[0]['tags'])
+        self.assertEqual('&lt;event 27&gt;', str(summary[0]['events'][0]['info']))
+
+    def test_budget(self):
+        rendered = render_compact_report(_report(1000), max_bytes=16 * 1024)
+
+        self.assertLessEqual(len(rendered.encode()), 16 * 1024)
+        self.assertIn('truncated', rendered)
+
+    def test_small_report_not_truncated(self):
+        rendered = render_compact_report(_report(2), max_bytes=16 * 1024)
+
+        self.assertNotIn('truncated', rendered)
+        self.assertIn('&#34;padding&#34;', rendered)
+
+
+class TestReportFingerprint(TestCase):
+    def assertFingerprintChanges(self, key, value):
+        report = _report(2)
+        fingerprint = report_fingerprint(report, {'template': 'compact'})
+
+        self.assertEqual(fingerprint, report_fingerprint(_report(2), {'template': 'compact'}))
+        self.assertNotEqual(fingerprint, report_fingerprint([dict(report[0], **{key: value})],
+                                                            {'template': 'compact'}))
+
+    def test_warninglists(self):
+        self.assertFingerprintChanges('warninglists', ['List of known domains'])
+
+    def test_networks(self):
+        self.assertFingerprintChanges('networks', [{'network': '203.0.113.0/24', 'event_ids': [1]}])
+
+    def test_name(self):
+        self.assertFingerprintChanges('name', 'Renamed MISP')
+
+    def test_similar_hashes(self):
+        self.assertFingerprintChanges('similar_hashes', [{'value': '3:abc:def', 'type': 'ssdeep', 'score': 90,
+                                                          'event_ids': [1]}])
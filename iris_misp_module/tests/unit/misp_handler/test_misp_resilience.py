@@ -0,0 +1,98 @@
+import time
+from unittest import TestCase
+
+from iris_misp_module.misp_handler.misp_resilience import AbandonableRequest, AdaptiveConcurrencyLimiter, \
+    CircuitBreaker, TokenBucket
+
+
+class TestCircuitBreaker(TestCase):
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker('https://misp', failure_threshold=3, cooldown=60)
+        for _ in range(2):
+            breaker.record_failure()
+        self.assertTrue(breaker.allow())
+
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+        self.assertFalse(breaker.allow())
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker('https://misp', failure_threshold=2, cooldown=60)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+
+    def test_single_probe_after_cooldown(self):
+        breaker = CircuitBreaker('https://misp', failure_threshold=1, cooldown=0.01)
+        breaker.record_failure()
+        time.sleep(0.02)
+
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+        breaker.record_success()
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+        self.assertTrue(breaker.allow())
+
+    def test_failed_probe_reopens(self):
+        breaker = CircuitBreaker('https://misp', failure_threshold=5, cooldown=0.01)
+        for _ in range(5):
+            breaker.record_failure()
+        time.sleep(0.02)
+
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+        self.assertFalse(breaker.allow())
+
+
+class TestAbandonableRequest(TestCase):
+    def test_first_settlement_wins(self):
+        request = AbandonableRequest()
+        self.assertTrue(request.abandon())
+        self.assertFalse(request.finish())
+        self.assertTrue(request.abandoned)
+
+        request = AbandonableRequest()
+        self.assertTrue(request.finish())
+        self.assertFalse(request.abandon())
+        self.assertFalse(request.abandoned)
+
+
+class TestTokenBucket(TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=100, burst=5)
+        for _ in range(5):
+            self.assertEqual(0.0, bucket.acquire())
+
+        self.assertGreater(bucket.acquire(), 0.0)
+
+
+class TestAdaptiveConcurrencyLimiter(TestCase):
+    def test_overload_halves_limit(self):
+        limiter = AdaptiveConcurrencyLimiter('https://misp', max_limit=8, latency_target=1.0)
+        limiter.acquire()
+        limiter.release(0.1, overloaded=True)
+
+        self.assertEqual(4, limiter.limit)
+
+    def test_additive_increase(self):
+        limiter = AdaptiveConcurrencyLimiter('https://misp', max_limit=8, latency_target=1.0)
+        limiter.acquire()
+        limiter.release(0.1, overloaded=True)
+        for _ in range(5):
+            limiter.acquire()
+            limiter.release(0.1)
+
+        self.assertEqual(5, limiter.limit)
+
+    def test_slow_answers_decrease_limit(self):
+        limiter = AdaptiveConcurrencyLimiter('https://misp', max_limit=8, min_limit=3, latency_target=0.5)
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(2.0)
+            limiter._last_decrease = 0.0
+
+        self.assertEqual(3, limiter.limit)
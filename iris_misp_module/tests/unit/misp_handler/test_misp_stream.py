@@ -0,0 +1,75 @@
+import io
+import json
+from unittest import TestCase, mock, skipUnless
+
+import requests
+
+from iris_misp_module.misp_handler import misp_stream
+from iris_misp_module.misp_handler.mispclient import MISPClient
+
+EVENTS = [
+    {'Event': {'id': '1', 'info': 'Campaign', 'date': '2024-01-01', 'Org': {'name': 'CIRCL'},
+               'Attribute': [{'type': 'domain', 'value': 'Evil.com'}],
+               'Object': [{'Attribute': [{'type': 'domain|ip', 'value': 'evil.com|203.0.113.7'}]}],
+               'Tag': [{'name': 'tlp:white'}], 'published': True, 'distribution': '3',
+               'RelatedEvent': [{'Event': {'id': '2', 'info': 'Related', 'date': '2023-12-01', 'Org': {}}}]}},
+    {'Event': {'id': '3', 'info': 'Other', 'date': '2024-02-01', 'Attribute': [], 'analysis': '2'}}
+]
+
+
+class FakeResponse:
+    def __init__(self, body, status_code=200):
+        self.raw = io.BytesIO(body)
+        self.text = body.decode()
+        self.status_code = status_code
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def _clean(misp_response):
+    # Cleaning does not use the connections of the client
+    client = object.__new__(MISPClient)
+    return client._MISPClient__clean(json.loads(json.dumps(misp_response)))
+
+
+@skipUnless(misp_stream.streaming_available(), 'ijson is not installed')
+class TestStreamEvents(TestCase):
+    def _stream(self, body, **kwargs):
+        response = FakeResponse(json.dumps(body).encode())
+        with mock.patch.object(misp_stream, '_post_stream', return_value=response):
+            events = list(misp_stream.stream_events(mock.Mock(), 'evil.com', ['domain'], MISPClient._event_filters,
+                                                    **kwargs))
+        self.assertTrue(response.closed)
+        return events
+
+    def test_same_events_as_clean(self):
+        for body in [{'response': EVENTS}, EVENTS]:
+            events = self._stream(body)
+
+            self.assertEqual(_clean(EVENTS), [event for event, _ in events])
+            self.assertEqual([None, None], [values for _, values in events])
+
+    def test_event_values(self):
+        events = self._stream({'response': EVENTS}, with_values=True)
+
+        self.assertEqual({'evil.com', 'evil.com|203.0.113.7', '203.0.113.7'}, events[0][1])
+        self.assertEqual(set(), events[1][1])
+
+    def test_empty_response(self):
+        self.assertEqual([], self._stream({'response': []}))
+        self.assertEqual([], self._stream([]))
+
+    def test_error_response(self):
+        session = mock.Mock()
+        session.prepare_request.return_value = mock.Mock(headers={})
+        session.merge_environment_settings.return_value = {}
+        session.send.return_value = FakeResponse(b'{"name": "Authentication failed."}', status_code=403)
+        connection = mock.Mock(root_url='https://misp', proxies=None, _PyMISP__session=session)
+
+        with self.assertRaises(requests.HTTPError) as context:
+            list(misp_stream.stream_events(connection, 'evil.com', ['domain'], MISPClient._event_filters))
+
+        self.assertEqual(403, context.exception.response.status_code)
+        self.assertTrue(session.send.return_value.closed)
@@ -0,0 +1,30 @@
+from unittest import TestCase
+
+from iris_misp_module.misp_handler.misp_types import get_type_lookups
+
+
+class TestIOCTypeLookups(TestCase):
+    def test_composite_values(self):
+        self.assertEqual([('domain', 'evil.com'), ('ip', '1.2.3.4')],
+                         [(lookup.category, lookup.extract('evil.com|1.2.3.4'))
+                          for lookup in get_type_lookups('domain|ip')])
+        self.assertEqual('1.2.3.4', get_type_lookups('ip-dst|port')[0].extract('1.2.3.4|443'))
+        self.assertEqual('evil.com', get_type_lookups('hostname|port')[0].extract('evil.com|443'))
+        self.assertEqual('d41d8cd98f00b204e9800998ecf8427e',
+                         get_type_lookups('filename|md5')[0].extract('a.exe|d41d8cd98f00b204e9800998ecf8427e'))
+
+    def test_missing_part(self):
+        with self.assertLogs('iris_misp_module.misp_handler.misp_types', level='WARNING'):
+            self.assertIsNone(get_type_lookups('domain|ip')[1].extract('evil.com'))
+        self.assertEqual('evil.com', get_type_lookups('domain|ip')[0].extract('evil.com'))
+        self.assertIsNone(get_type_lookups('filename|md5')[0].extract('a.exe'))
+
+    def test_categories(self):
+        expected = {'url': 'url', 'email-src': 'mail', 'regkey': 'registry', 'filename': 'filename',
+                    'sha256': 'hash', 'ja3-fingerprint-md5': 'ja3', 'hostname': 'domain', 'ip-any': 'ip'}
+        for type_name, category in expected.items():
+            self.assertEqual(category, get_type_lookups(type_name)[0].category)
+
+    def test_unsupported_types(self):
+        self.assertEqual((), get_type_lookups('user-agent'))
+        self.assertEqual((), get_type_lookups('whois-registrant-domain'))
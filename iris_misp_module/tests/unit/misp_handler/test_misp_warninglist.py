@@ -0,0 +1,57 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from iris_misp_module.misp_handler.misp_warninglist import DomainSuffixIndex, MISPWarninglists
+
+
+class TestDomainSuffixIndex(TestCase):
+    def test_subdomains(self):
+        index = DomainSuffixIndex()
+        index.add('.google.com', 'top-domains')
+
+        self.assertEqual(['top-domains'], index.lookup('google.com'))
+        self.assertEqual(['top-domains'], index.lookup('Mail.Google.com.'))
+        self.assertIsNone(index.lookup('notgoogle.com'))
+        self.assertIsNone(index.lookup('com'))
+
+
+class TestMISPWarninglists(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        lists = {
+            'rfc1918': {'name': 'RFC 1918', 'type': 'cidr', 'list': ['10.0.0.0/8', '192.168.0.0/16'],
+                        'matching_attributes': ['ip-src', 'ip-dst', 'domain|ip']},
+            'top': {'name': 'Top domains', 'type': 'hostname', 'list': ['google.com'],
+                    'matching_attributes': ['hostname', 'domain', 'url']},
+            'hashes': {'name': 'Empty hashes', 'type': 'string', 'list': ['D41D8CD98F00B204E9800998ECF8427E'],
+                       'matching_attributes': ['md5']},
+            'regex': {'name': 'Regex', 'type': 'regex', 'list': ['.*'], 'matching_attributes': ['domain']}
+        }
+        for name, warninglist in lists.items():
+            os.makedirs(os.path.join(self.directory.name, name))
+            with open(os.path.join(self.directory.name, name, 'list.json'), 'w') as f:
+                json.dump(warninglist, f)
+
+        self.warninglists = MISPWarninglists(self.directory.name, {'ip': ['ip-src', 'ip-dst'],
+                                                                   'domain': ['domain', 'hostname'],
+                                                                   'url': ['url'],
+                                                                   'hash': ['md5', 'sha1']})
+        self.warninglists.reload()
+
+    def tearDown(self):
+        self.warninglists.stop()
+        self.directory.cleanup()
+
+    def test_match(self):
+        self.assertEqual(['RFC 1918'], self.warninglists.match('ip', '192.168.1.1'))
+        self.assertEqual(['Top domains'], self.warninglists.match('domain', 'www.google.com'))
+        self.assertEqual(['Top domains'], self.warninglists.match('url', 'https://www.google.com/search'))
+        self.assertEqual(['Empty hashes'], self.warninglists.match('hash', 'd41d8cd98f00b204e9800998ecf8427e'))
+
+    def test_no_match(self):
+        self.assertIsNone(self.warninglists.match('ip', '8.8.8.8'))
+        self.assertIsNone(self.warninglists.match('domain', 'evil.com'))
+        # cidr lists only apply to the categories of their matching attributes
+        self.assertIsNone(self.warninglists.match('domain', '10.0.0.1'))
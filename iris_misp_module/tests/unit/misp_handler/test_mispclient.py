@@ -0,0 +1,126 @@
+import threading
+import time
+from unittest import TestCase, mock
+
+from iris_misp_module.misp_handler.mispclient import MISPClient
+
+EVENTS = {
+    '1': ['evil.com', 'a.com'],
+    '2': ['c.com'],
+    '3': ['Evil.com|203.0.113.7'],
+    '4': ['a.com', 'c.com']
+}
+
+
+class FakeConnection:
+    """
+    PyMISP connection matching values case-insensitively against EVENTS, as MISP does
+    """
+
+    # Searches on these instances wait until the event is set
+    stalled = {}
+
+    def __init__(self, url, **kwargs):
+        self.root_url = url
+        self.queries = []
+
+    def search(self, value, **kwargs):
+        if self.root_url in self.stalled:
+            self.stalled[self.root_url].wait()
+        values = {v.lower() for v in (value if isinstance(value, list) else [value])}
+        self.queries.append(sorted(values))
+
+        response = []
+        for event_id, attribute_values in EVENTS.items():
+            parts = {part.lower() for v in attribute_values for part in [v] + v.split('|')}
+            if values & parts:
+                response.append({'Event': {'id': event_id, 'info': f'Event {event_id}',
+                                           'Attribute': [{'type': 'domain', 'value': v} for v in attribute_values]}})
+        return response
+
+
+class TestSearchBatch(TestCase):
+    def setUp(self) -> None:
+        with mock.patch('pymisp.ExpandedPyMISP', FakeConnection):
+            self.client = MISPClient('https://misp', 'key', batch_size=2)
+        self.connection = self.client.misp_connections[0]
+
+    def tearDown(self) -> None:
+        self.client.close()
+
+    def _event_ids(self, results):
+        return {value: sorted(event['id'] for event in result[0]['result']) for value, result in results.items()}
+
+    def test_results_mapped_to_values(self):
+        results = self.client.search_batch('domain', ['a.com', 'c.com', 'evil.com', 'unknown.com'])
+
+        self.assertEqual({'a.com': ['1', '4'], 'c.com': ['2', '4'], 'evil.com': ['1', '3'], 'unknown.com': []},
+                         self._event_ids(results))
+
+    def test_chunk_boundaries(self):
+        # a.com and c.com are sent in different chunks, event 4 holding both is mapped to each of them
+        results = self.client.search_batch('domain', ['c.com', 'a.com', 'unknown.com'])
+
+        self.assertEqual([['a.com', 'c.com'], ['unknown.com']], self.connection.queries)
+        self.assertEqual({'a.com': ['1', '4'], 'c.com': ['2', '4'], 'unknown.com': []}, self._event_ids(results))
+
+    def test_duplicate_values(self):
+        results = self.client.search_batch('domain', ['Evil.com', 'evil.com', ' EVIL.COM ', 'a.com'])
+
+        self.assertEqual([['a.com', 'evil.com']], self.connection.queries)
+        self.assertEqual({'a.com': ['1', '4'], 'evil.com': ['1', '3']}, self._event_ids(results))
+
+
+class TestSearchBatchTimeout(TestCase):
+    def setUp(self) -> None:
+        with mock.patch('pymisp.ExpandedPyMISP', FakeConnection):
+            self.client = MISPClient(['https://misp', 'https://slow-misp'], ['key', 'key'], name=['public', 'slow'],
+                                     timeout=0.2, batch_size=2)
+        self.release = threading.Event()
+        FakeConnection.stalled = {'https://slow-misp': self.release}
+
+    def tearDown(self) -> None:
+        self.release.set()
+        FakeConnection.stalled = {}
+        self.client.close()
+
+    def test_slow_instance(self):
+        start = time.monotonic()
+        results = self.client.search_batch('domain', ['a.com', 'evil.com', 'unknown.com'])
+
+        # Two chunks, each with its own timeout
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(['1', '3'], sorted(event['id'] for event in results['evil.com'][0]['result']))
+        for value in ['a.com', 'evil.com', 'unknown.com']:
+            self.assertEqual({'url': 'https://slow-misp', 'name': 'slow', 'result': [], 'error': 'Timeout after 0.4s'},
+                             results[value][1])
+
+
+class TestFanoutTimeoutOutcome(TestCase):
+    def setUp(self) -> None:
+        with mock.patch('pymisp.ExpandedPyMISP', FakeConnection):
+            # One fan-out worker per instance, the fan-out timeout being shorter than the answers
+            self.client = MISPClient(['https://misp', 'https://slow-misp'], ['key', 'key'], timeout=0.2,
+                                     pool_size=1, breaker_threshold=10)
+        self.release = threading.Event()
+        FakeConnection.stalled = {'https://misp': self.release, 'https://slow-misp': self.release}
+
+    def tearDown(self) -> None:
+        self.release.set()
+        FakeConnection.stalled = {}
+        self.client.close()
+
+    def test_timeouts_recorded_as_failures(self):
+        # Holds both workers until the answers come in
+        results = self.client.search_domain('evil.com')
+        self.assertEqual(['Timeout after 0.2s', 'Timeout after 0.2s'], [entry.get('error') for entry in results])
+
+        # Never started, cancelled by the caller
+        results = self.client.search_domain('a.com')
+        self.assertEqual(['Timeout after 0.2s', 'Timeout after 0.2s'], [entry.get('error') for entry in results])
+
+        # The answers to the first search come in after the caller gave up
+        self.release.set()
+        self.client._executor.shutdown(wait=True)
+
+        self.assertEqual([2, 2], [breaker._failures for breaker in self.client._breakers])
@@ -18,5 +18,9 @@ setup(
         "setuptools",
         "pyunpack",
         "pymisp==2.4.187"
-    ]
+    ],
+    extras_require={
+        'streaming': ['ijson'],
+        'async': ['aiohttp']
+    }
 )